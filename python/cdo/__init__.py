@@ -1,4 +1,10 @@
 __author__ = "Brian Earl Spilner stark.dreamdetective@gmail.com"
-__version__ = "1.6.0"
+__version__ = "1.7.0"
 
-from .cdo import Cdo, CDOException
+from .cdo import Cdo, CDOException, CDOTimeoutException
+from .scheduler import ThreadBudget, MemoryBudget
+from .incremental import Pipeline
+from .formats import FormatPolicy
+from .stager import InputStager
+from .writebehind import WriteBehind, DeliveryError
+from .memory import MemoryEstimator
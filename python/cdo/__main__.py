@@ -0,0 +1,64 @@
+import sys
+import argparse
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# command line interface: python -m cdo <command>
+
+def catalogBuild(args):
+    from .cdo import Cdo
+    from .catalog import buildCatalog
+    cdo = Cdo(cdo=args.cdo, catalog=False)
+    path = buildCatalog(cdo, args.output, docs=not args.no_docs, workers=args.workers)
+    print("Wrote catalog of '%s' (CDO %s, %d operators) to '%s'"
+          % (cdo.CDO, cdo.version(), len(cdo.operators), path))
+    return 0
+
+
+def run(args):
+    from .batch import runManifest
+    from .cdo import Cdo
+    cdo = Cdo(cdo=args.cdo) if args.cdo else None
+    report = runManifest(args.manifest, report=args.report, cdo=cdo, cores=args.cores,
+                         memory=args.memory, force=args.force)
+    summary = report['summary']
+    print("%d ok, %d skipped, %d failed in %.2fs" % (
+        summary['ok'], summary['skipped'], summary['failed'], report['duration']))
+    return 1 if summary['failed'] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cdo', description='python bindings to CDO')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    catalog = commands.add_parser('catalog', help='operator catalog of a CDO binary')
+    catalogCommands = catalog.add_subparsers(dest='action')
+    catalogCommands.required = True
+    build = catalogCommands.add_parser('build', help='write the catalog of a CDO binary')
+    build.add_argument('--cdo', default='cdo', help='CDO binary (default: cdo)')
+    build.add_argument('--output', default=None, help='catalog file (default: user cache dir)')
+    build.add_argument('--no-docs', action='store_true', help='skip the operator docs')
+    build.add_argument('--workers', type=int, default=8, help='parallel doc queries')
+    build.set_defaults(func=catalogBuild)
+
+    runner = commands.add_parser('run', help='run the jobs of a manifest (yaml or json)')
+    runner.add_argument('manifest', help='jobs.yaml or jobs.json')
+    runner.add_argument('--cores', type=int, default=None, help='core budget (default: all)')
+    runner.add_argument('--memory', default=None, help='memory budget, e.g. 16G')
+    runner.add_argument('--report', default=None, help='write a json report to this file')
+    runner.add_argument('--force', action='store_true', help='rerun up to date jobs')
+    runner.add_argument('--cdo', default=None, help='CDO binary')
+    runner.set_defaults(func=run)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -0,0 +1,202 @@
+import os
+import sys
+import glob
+import json
+import time
+import shlex
+import threading
+import concurrent.futures
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# batch runner: python -m cdo run jobs.yaml|jobs.json
+#
+#   cores: 8                  # optional, default: all
+#   memory: 16G               # optional, default: no limit
+#   options: -f nc4           # optional, default options of all jobs
+#   jobs:
+#     - name: means
+#       chain: -timmean -selname,tas
+#       input: data/*.nc      # glob, one job per file (output has a pattern)
+#       output: out/{stem}_mean.nc
+#       memory: 2G            # optional, default: estimated, see memory.py
+#     - chain: -mergetime
+#       input: [out/*_mean.nc]
+#       output: means.nc      # no pattern: one job for all files
+#
+# Output patterns: {name} (file name of the input), {stem} (without suffix),
+# {dir} (its directory) and {index}. Outputs which are up to date with their
+# inputs and chain are skipped, see incremental.py. The entries of 'jobs' run
+# one after another (so globs can match outputs of earlier entries), the jobs
+# of one entry run concurrently.
+
+GlobCharacters = '*?['
+
+
+# reading and expanding the manifest {{{
+def readManifest(path):
+    with open(path, 'r') as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("Reading '%s' needs PyYAML" % path)
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def expandInputs(inputs):
+    files = []
+    for item in inputs if isinstance(inputs, list) else [inputs]:
+        tokens = shlex.split(str(item))
+        for token in tokens:
+            matches = sorted(glob.glob(token)) if any(c in token for c in GlobCharacters) else []
+            files.extend(matches or [token])
+    return files
+
+
+def expandJobs(manifest, i):
+    """Return the jobs of the i-th entry of a manifest: one per output"""
+    spec = manifest['jobs'][i]
+    if 'chain' not in spec or 'output' not in spec:
+        raise ValueError("Job %d needs a 'chain' and an 'output'!" % i)
+    options = ' '.join(filter(None, [manifest.get('options'), spec.get('options')]))
+    inputs = expandInputs(spec.get('input', []))
+    job = {'name': spec.get('name', 'job%d' % i), 'chain': spec['chain'],
+           'options': options, 'memory': spec.get('memory')}
+    if '{' not in spec['output']:
+        return [dict(job, input=inputs, output=spec['output'])]
+    jobs = []
+    for index, ifile in enumerate(inputs):
+        stem = os.path.splitext(os.path.basename(ifile))[0]
+        output = spec['output'].format(name=os.path.basename(ifile), stem=stem,
+                                       dir=os.path.dirname(ifile), index=index)
+        jobs.append(dict(job, input=[ifile], output=output))
+    return jobs
+# }}}
+
+
+# running the jobs {{{
+class BatchRunner(object):
+    """Run the jobs of a manifest concurrently under a core and memory budget"""
+
+    def __init__(self, manifest, cdo=None, cores=None, memory=None, force=False,
+                 progress=sys.stderr):
+        from .cdo import Cdo
+        from .scheduler import ThreadBudget, MemoryBudget
+        self.manifest = manifest
+        if not manifest.get('jobs'):
+            raise ValueError("The manifest has no 'jobs'!")
+        self.cores = ThreadBudget(cores or manifest.get('cores'))
+        memory = memory or manifest.get('memory')
+        self.memory = MemoryBudget(memory) if memory else None
+        if cdo is None:
+            self.cdo = Cdo(threadBudget=self.cores, memoryBudget=self.memory)
+        else:
+            # the budgets are set on a copy: the given object stays unchanged
+            self.cdo = cdo._newChain()
+            self.cdo.threadBudget = self.cores
+            if self.memory:
+                from .memory import MemoryEstimator
+                self.cdo.memoryBudget = self.memory
+                self.cdo.memoryEstimator = self.cdo.memoryEstimator or MemoryEstimator(self.cdo)
+        self.force = force
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._finished, self._total = 0, 0
+
+    def chainOf(self, job):
+        from .parallel import chainTokens, isOperator, operatorName
+        tokens = chainTokens(job['chain'])
+        unknown = [t for t in tokens if isOperator(t) and operatorName(t) not in self.cdo.operators]
+        if unknown or not tokens or not isOperator(tokens[0]):
+            raise ValueError("Unknown operators in chain '%s' of job '%s'" % (job['chain'], job['name']))
+        # tokens stay raw, they are quoted for the shell with the command line
+        return self.cdo._withCmd(tokens)
+
+    def callKwargs(self, job):
+        kwargs = {'input': ' '.join(shlex.quote(f) for f in job['input']),
+                  'output': job['output'], 'incremental': True, 'returnResult': False}
+        if job['memory']:
+            kwargs['memory'] = job['memory']
+        if job['options']:
+            kwargs['options'] = job['options']
+        return kwargs
+
+    def isUpToDate(self, job):
+        from .incremental import callManifest, isUpToDate
+        kwargs = self.callKwargs(job)
+        cmd = self.chainOf(job)._buildCmd(dict(kwargs))
+        if self.cdo.writeBehind:
+            self.cdo.writeBehind.waitFor(cmd, [job['output']])
+        return isUpToDate(job['output'], callManifest(cmd, [job['output']]))
+
+    def report(self, job, result):
+        with self._lock:
+            self._finished += 1
+            if self.progress is not None:
+                self.progress.write('[%*d/%d] %-7s %8.2fs  %s\n' % (
+                    len(str(self._total)), self._finished, self._total,
+                    result['status'], result['duration'], job['output']))
+                self.progress.flush()
+
+    def runJob(self, job):
+        from .cdo import CDOException
+        from .incremental import manifestPath
+        start = time.time()
+        result = {'name': job['name'], 'input': job['input'], 'output': job['output'],
+                  'chain': job['chain'], 'status': 'ok', 'returncode': 0}
+        try:
+            if not self.force and self.isUpToDate(job):
+                result['status'] = 'skipped'
+            else:
+                if self.force and os.path.isfile(manifestPath(job['output'])):
+                    os.remove(manifestPath(job['output']))
+                directory = os.path.dirname(job['output'])
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                # the memory budget is kept by the Cdo object: given or estimated
+                self.chainOf(job)(**self.callKwargs(job))
+        except CDOException as e:
+            result.update(status='failed', returncode=e.returncode, error=e.stderr.strip())
+        except Exception as e:
+            result.update(status='failed', returncode=None, error=str(e))
+        result['duration'] = time.time() - start
+        self.report(job, result)
+        return result
+
+    def run(self):
+        """Run all jobs and return the report"""
+        start, results = time.time(), []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.cores.cores) as pool:
+            for i in range(len(self.manifest['jobs'])):
+                # globs are expanded when the entry starts
+                jobs = expandJobs(self.manifest, i)
+                with self._lock:
+                    self._total += len(jobs)
+                results.extend(pool.map(self.runJob, jobs))
+        summary = {status: sum(1 for r in results if status == r['status'])
+                   for status in ('ok', 'skipped', 'failed')}
+        return {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(start)),
+                'duration': time.time() - start,
+                'cores': self.cores.cores,
+                'memory': self.memory.limit if self.memory else None,
+                'summary': summary,
+                'jobs': results}
+# }}}
+
+
+def runManifest(path, report=None, **kwargs):
+    """Run the jobs of a manifest file, write the report and return it"""
+    runner = BatchRunner(readManifest(path), **kwargs)
+    result = runner.run()
+    result['manifest'] = os.path.abspath(path)
+    if report:
+        with open(report, 'w') as f:
+            json.dump(result, f, indent=1)
+    return result
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
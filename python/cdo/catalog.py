@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import hashlib
+import concurrent.futures
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# catalog of a CDO binary: operators with their number of input and output
+# streams, parameter signatures and docs plus version, features and config.
+# It is written once by 'python -m cdo catalog build' and loaded by Cdo()
+# instead of asking the binary. A catalog belongs to the binary with the same
+# path, modification time and size: any other binary ignores it.
+
+CatalogFormat = 1
+
+
+# location and identity of a binary {{{
+def binaryPath(cdo):
+    return os.path.realpath(shutil.which(cdo) or cdo)
+
+
+def binaryIdentity(cdo):
+    path = binaryPath(cdo)
+    stat = os.stat(path)
+    return {'path': path, 'mtime': stat.st_mtime, 'size': stat.st_size}
+
+
+def catalogDir():
+    if 'CDO_CATALOG_DIR' in os.environ:
+        return os.environ['CDO_CATALOG_DIR']
+    cache = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache, 'cdo-bindings')
+
+
+def defaultCatalogPath(cdo):
+    digest = hashlib.sha1(binaryPath(cdo).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(catalogDir(), 'catalog_%s.json' % digest)
+# }}}
+
+
+# parameter signature from the SYNOPSIS of an operator's doc {{{
+def signature(name, doc):
+    synopsis = doc.split('SYNOPSIS', 1)[-1]
+    for line in synopsis.splitlines():
+        tokens = line.split()
+        if tokens and (tokens[0] == name or tokens[0].startswith(name + ',')):
+            return tokens[0]
+    return name
+# }}}
+
+
+def buildCatalog(cdo, path=None, docs=True, workers=8):
+    """Write the catalog of the binary of a Cdo object and return its path"""
+    from .cdo import operator_doc
+    path = path or defaultCatalogPath(cdo.CDO)
+
+    names = sorted(cdo.operators)
+    texts = {}
+    if docs:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            texts = dict(zip(names, pool.map(lambda name: operator_doc(name, cdo.CDO), names)))
+
+    catalog = {
+        'format': CatalogFormat,
+        'binary': binaryIdentity(cdo.CDO),
+        'version': cdo.version(),
+        'libs': cdo.libs,
+        'config': cdo.config,
+        # name: [inputs, outputs, signature, doc]
+        'operators': {name: [cdo.operatorInputs.get(name, 1),
+                             cdo.operators[name],
+                             signature(name, texts.get(name, '')),
+                             texts.get(name)] for name in names},
+    }
+
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(catalog, f, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def loadCatalog(cdo, path=None):
+    """Return the catalog of a binary or None if there is no matching one"""
+    try:
+        path = path or defaultCatalogPath(cdo)
+        with open(path, 'r') as f:
+            catalog = json.load(f)
+        if CatalogFormat != catalog.get('format') or binaryIdentity(cdo) != catalog.get('binary'):
+            return None
+        return catalog
+    except (IOError, OSError, ValueError):
+        return None
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -5,15 +5,22 @@ import tempfile
 import random
 import glob
 import signal
+import shlex
 import threading
 import functools
 from packaging.version import parse as parse_version
 from io import StringIO
-import logging as pyLog
 import six
 import sys
 import threading
 import json
+import atexit
+import contextlib
+import time
+import weakref
+from .formats import FormatPolicy, toPolicy
+from .log import setupLogging
+from .catalog import loadCatalog
 try:
     from shutil import which, get_terminal_size
 except ImportError:
@@ -76,22 +83,73 @@ def getCdoVersion(path2cdo, verbose=False):
     match = re.search(r"Climate Data Operators version (\d.*) .*", cdo_help)
     return match.group(1)
 
-# helper function without side effects {{{
-
-def setupLogging(logFile):
-    logger = pyLog.getLogger(__name__)
-    logger.setLevel(pyLog.INFO)
-
-    if isinstance(logFile, six.string_types):
-        handler = pyLog.FileHandler(logFile)
-    else:
-        handler = pyLog.StreamHandler(stream=logFile)
+# bookkeeping of running CDO processes {{{
+# Each CDO call runs in its own process group, so that the shell and CDO can be
+# killed together. Registries can be nested: killing a registry kills the
+# processes of all its children, too.
+
+class ProcessRegistry(object):
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self._procs = set()
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def add(self, proc):
+        with self._lock:
+            self._procs.add(proc)
+            closed = self._closed
+        if self.parent is not None:
+            self.parent.add(proc)
+        if closed:
+            killProcessGroup(proc)
+
+    def discard(self, proc):
+        with self._lock:
+            self._procs.discard(proc)
+        if self.parent is not None:
+            self.parent.discard(proc)
+
+    def running(self):
+        with self._lock:
+            return list(self._procs)
+
+    def killAll(self):
+        for proc in self.running():
+            killProcessGroup(proc)
+
+    def close(self):
+        """Kill all processes, also the ones which are added later"""
+        with self._lock:
+            self._closed = True
+        self.killAll()
+
+
+def shellToken(token):
+    """Quote an operator for the shell, unless it is quoted already"""
+    if '"' in token or "'" in token:
+        return token
+    return shlex.quote(token)
+
+
+def killProcessGroup(proc):
+    try:
+        # calls on executors are cancelled by their executor, see executor.py
+        if proc.pid is None:
+            proc.kill()
+        elif hasattr(os, 'killpg'):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except OSError:
+        # process has finished already
+        pass
 
-    formatter = pyLog.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
 
-    return logger
+# all CDO processes of this python process: stop them on exit
+allProcesses = ProcessRegistry()
+atexit.register(allProcesses.killAll)
 # }}}
 
 # extra exceptions for CDO {{{
@@ -107,6 +165,14 @@ class CDOException(Exception):
 
     def __str__(self):
         return self.msg
+
+
+class CDOTimeoutException(CDOException):
+
+    def __init__(self, stdout, stderr, returncode, timeout):
+        super(CDOTimeoutException, self).__init__(stdout, stderr, returncode)
+        self.timeout = timeout
+        self.msg = '(timeout:%ss) %s' % (timeout, stderr)
 # }}}
 
 # MAIN Cdo class {{{
@@ -114,7 +180,7 @@ class CDOException(Exception):
 class Cdo(object):
 
     # fallback operator lists {{{
-    NoOutputOperators = 'cdiread cmor codetab conv_cmor_table diff diffc diffn \
+    NoOutputOperators = set('cdiread cmor codetab conv_cmor_table diff diffc diffn \
     diffp diffv dump_cmor_table dumpmap filedes gmtcells gmtxyz gradsdes griddes \
     griddes2 gridverify info infoc infon infop infos infov map ncode ndate \
     ngridpoints ngrids nlevel nmon npar ntime nvar nyear output outputarr \
@@ -125,29 +191,56 @@ class Cdo(object):
     showcode showdate showformat showgrid showlevel showltype showmon showname \
     showparam showstdname showtime showtimestamp showunit showvar showyear sinfo \
     sinfoc sinfon sinfop sinfov spartab specinfo tinfo vardes vct vct2 verifygrid \
-    vlist xinfon zaxisdes'.split()
-    TwoOutputOperators = 'trend samplegridicon mrotuv eoftime \
-    eofspatial eof3dtime eof3dspatial eof3d eof complextorect complextopol'.split()
-    MoreOutputOperators = 'distgrid eofcoeff eofcoeff3d intyear scatter splitcode \
+    vlist xinfon zaxisdes'.split())
+    TwoOutputOperators = set('trend samplegridicon mrotuv eoftime \
+    eofspatial eof3dtime eof3dspatial eof3d eof complextorect complextopol'.split())
+    MoreOutputOperators = set('distgrid eofcoeff eofcoeff3d intyear scatter splitcode \
     splitday splitgrid splithour splitlevel splitmon splitname splitparam splitrec \
-    splitseas splitsel splittabnum splitvar splityear splityearmon splitzaxis'.split()
+    splitseas splitsel splittabnum splitvar splityear splityearmon splitzaxis'.split())
     AliasOperators = {'seq': 'for'}
 
     # the following operators introduce additional new lines in cdo-2.0.0 for
     # increased readability in the therminal. This leads to inconsistens parsing
     # behaviour here because before new lines indicated meta data for a new
     # variable for all show* operators.
-    ShowTimeOperators = 'showdate showtime showtimestamp showyear showmon'.split()
+    ShowTimeOperators = set('showdate showtime showtimestamp showyear showmon'.split())
     # operators are now called with '-s' to ease the parsing process. diff* does
     # not print the errors when '-s' is given, so these operators need special
     # treatment
     # avoiding '-s' can lead to errors when working with operators which write to
     # stdout, but it can done with cdo.silent = False
-    DiffOperators = 'diff diffc diffn diffv diffp'.split()
+    DiffOperators = set('diff diffc diffn diffv diffp'.split())
+    # operators which handle each timestep independently: a chain of these can
+    # be run on timestep ranges of the input in parallel (see timeChunks)
+    TimeChunkOperators = set('abs acos addc aexpr asin atan chcode chlevel chname \
+    chparam chunit copy cos divc exp expr fldavg fldmax fldmean fldmin fldrange \
+    fldstd fldsum fldvar gridboxmax gridboxmean gridboxmin ln log10 masklonlatbox \
+    maskregion mermean mulc remap remapbic remapbil remapcon remapdis remaplaf \
+    remapnn selcode selgrid selindexbox sellevel sellevidx sellonlatbox selname \
+    selparam selvar selzaxis setattribute setcode setctomiss setgrid setgridtype \
+    setlevel setmissval setmisstoc setname setparam setrtoc setrtomiss setunit \
+    sin sqr sqrt subc tan vertmean vertsum zonmean zonsum'.split())
+    # operators which handle each grid point independently: a chain of these can
+    # be run on horizontal tiles of the input in parallel (see tiles)
+    SpatialTileOperators = set('abs acos addc aexpr asin atan chcode chlevel chname \
+    chparam chunit copy cos daymax daymean daymin daysum divc exp expr ln log10 \
+    monmax monmean monmin monsum mulc runmean seasmax seasmean seasmin seassum \
+    selcode seldate sellevel sellevidx selmon selname selparam selseason \
+    seltimestep selvar selyear selzaxis setattribute setcalendar setcode \
+    setctomiss setlevel setmissval setmisstoc setname setparam setrtoc \
+    setrtomiss settaxis setunit shifttime sin sqr sqrt subc tan timavg timmax \
+    timmean timmin timrange timstd timsum timvar vertmean vertsum yearmax \
+    yearmean yearmin yearsum ydaymean ymonmax ymonmean ymonmin ymonsum'.split())
+    # operators which can be combined from their results on groups of the
+    # inputs: long input lists are reduced in a tree (see treeReduce)
+    TreeReduceOperators = set('cat copy enssum ensmax ensmean ensmin merge mergetime'.split())
     # }}}
 
     name = ''
 
+    # operator methods are created on first access, see __getattr__
+    _operatorLock = threading.RLock()
+
     def __init__(self, #{{{
                  cdo='cdo',
                  returnNoneOnError=False,
@@ -158,27 +251,84 @@ class Cdo(object):
                  tempStore=None,
                  logging=False,
                  logFile=StringIO(),
-                 cmd=[],
-                 options=[],
-                 silent=True):
+                 cmd=(),
+                 options=(),
+                 silent=True,
+                 timeout=None,
+                 threadBudget=None,
+                 incremental=False,
+                 formatPolicy=None,
+                 catalog=None,
+                 stager=None,
+                 writeBehind=None,
+                 memoryBudget=None,
+                 engine=None,
+                 returnResults=False,
+                 logSampling=1.0):
 
         if 'CDO' in os.environ and os.path.isfile(os.environ['CDO']):
             self.CDO = os.environ['CDO']
         else:
             self.CDO = cdo
 
-        self._cmd = cmd
-        self._options = options
+        # chains and options are never changed in place, see _withCmd()
+        self._cmd = tuple(cmd)
+        self._options = tuple(options)
 
+        # operators, features and config of the binary are taken from its
+        # catalog if there is one (see catalog.py), catalog=False asks the binary
+        self._catalog = None if catalog is False else loadCatalog(self.CDO, catalog)
         self.operators = self.__getOperators()
-        self.noOutputOperators = [op for op, num in self.operators.items() if 0 == num]
+        self.noOutputOperators = {op for op, num in self.operators.items() if 0 == num}
         self.returnNoneOnError = returnNoneOnError
         self.tempStore = tempStore or CdoTempfileStore(dir=tempdir)
         self.forceOutput = forceOutput
         self.env = env
         self.debug = True if 'DEBUG' in os.environ else debug
         self.silent = silent
-        self.libs = self.getSupportedLibs()
+        self.timeout = timeout
+        # share the cores of the node with other calls: True uses the budget
+        # of the whole node, see scheduler.nodeBudget()
+        if threadBudget is True:
+            from .scheduler import nodeBudget
+            threadBudget = nodeBudget()
+        self.threadBudget = threadBudget
+        # rerun calls with given output only if inputs or command changed:
+        # True compares size and mtime of the inputs, 'hash' their content
+        self.incremental = incremental
+        # output format, precision, compression and chunking by the consumer of
+        # a result: True uses the default FormatPolicy, a dict changes its rules
+        self.formatPolicy = toPolicy(formatPolicy)
+        # copy inputs from slow filesystems into local scratch, see stager.py
+        self.stager = stager
+        # write outputs to local scratch and deliver them in the background:
+        # True uses a WriteBehind with default settings, see writebehind.py
+        if writeBehind is True:
+            from .writebehind import WriteBehind
+            writeBehind = WriteBehind()
+        self.writeBehind = writeBehind
+        # start calls only if their estimated peak memory fits into the budget:
+        # a size like '16G' or a MemoryBudget, True uses the memory of the
+        # whole node. Estimates are refined with the measured peak memory
+        if memoryBudget is True:
+            from .scheduler import nodeMemory
+            memoryBudget = nodeMemory()
+        elif memoryBudget is not None and not hasattr(memoryBudget, 'acquire'):
+            from .scheduler import MemoryBudget
+            memoryBudget = MemoryBudget(memoryBudget)
+        self.memoryBudget = memoryBudget
+        self.memoryEstimator = None
+        if memoryBudget is not None:
+            from .memory import MemoryEstimator
+            self.memoryEstimator = MemoryEstimator(self)
+        # engine='numpy' computes simple chains on xarray inputs in-process,
+        # see engine.py
+        self.engine = engine
+        # return CdoResult handles instead of file names: True or 'lazy', see
+        # result.py
+        self.returnResults = returnResults
+        self._processes = ProcessRegistry(parent=allProcesses)
+        self.libs = self._catalog['libs'] if self._catalog else self.getSupportedLibs()
 
         # optional IO libraries for additional return types
         self.hasNetcdf = False
@@ -189,11 +339,13 @@ class Cdo(object):
 
         self.logging = logging  # internal logging {{{
         self.logFile = logFile
+        # all objects share one queue based logger per process, logSampling
+        # is the fraction of successful calls which are logged
         if self.logging:
-            self.logger = setupLogging(self.logFile)  # }}}
+            self.logger = setupLogging(self.logFile, logSampling)  # }}}
 
         # CDO build configuration available since cdo-1.9x
-        self.config = self.__getConfig()
+        self.config = self._catalog['config'] if self._catalog else self.__getConfig()
         #}}}
 
     def __get__(self, instance, owner):
@@ -206,25 +358,20 @@ class Cdo(object):
         # This workaround translates all calls of 'seq' into for in case of
         # versions prior to 1.9.7
         if name in self.AliasOperators and (
-                parse_version(getCdoVersion(self.CDO)) < parse_version('1.9.7')):
+                parse_version(self._version) < parse_version('1.9.7')):
             name = self.AliasOperators[name]
-        return self.__class__(
-            instance.CDO,
-            instance.returnNoneOnError,
-            instance.forceOutput,
-            instance.env,
-            instance.debug,
-            instance.tempStore.dir,
-            instance.tempStore,
-            instance.logging,
-            instance.logFile,
-            instance._cmd + ['-' + name],
-            instance._options,
-            instance.silent)
+        # the new chain shares all settings with the calling object, so there
+        # is no need to query the CDO binary again
+        chain = object.__new__(self.__class__)
+        chain.__dict__.update(instance.__dict__)
+        chain._cmd = instance._cmd + ('-' + name,)
+        chain.__dict__.pop('_memo', None)
+        chain.__doc__ = self.__doc__
+        return chain
 
     # from 1.9.6 onwards CDO returns 1 of diff* finds a difference {{{
     def __exit_success(self, operatorName):
-        if parse_version(getCdoVersion(self.CDO)) < parse_version('1.9.6'):
+        if parse_version(self._version) < parse_version('1.9.6'):
             return 0
         if 'diff' != operatorName[0:4]:
             return 0
@@ -240,11 +387,19 @@ class Cdo(object):
         return {} #}}}
 
     # retrieve the list of operators from the CDO binary plus info out number of {{{
-    # output streams
+    # output streams. The number of input streams is only available for
+    # cdo-1.9.3 and later and stored in self.operatorInputs
     def __getOperators(self):
+        if self._catalog:
+            self._version = self._catalog['version']
+            self.operatorInputs = {name: op[0] for name, op in self._catalog['operators'].items()}
+            return {name: op[1] for name, op in self._catalog['operators'].items()}
+
         operators = {}
+        self.operatorInputs = {}
 
-        version = parse_version(getCdoVersion(self.CDO))
+        self._version = getCdoVersion(self.CDO)
+        version = parse_version(self._version)
         if version < parse_version('1.7.2'):
             proc = subprocess.Popen(
                 [self.CDO, '-h'], stderr=subprocess.PIPE, stdout=subprocess.PIPE)
@@ -292,7 +447,7 @@ class Cdo(object):
                 stderr=subprocess.PIPE,
                 stdout=subprocess.PIPE)
             ret = proc.communicate()
-            opsNoOutput = list(map(lambda x: x.split(
+            opsNoOutput = set(map(lambda x: x.split(
                 ' ')[0], ret[0].decode("utf-8")[0:-1].split(os.linesep)))
 
             for op in ops:
@@ -319,24 +474,105 @@ class Cdo(object):
                     _values = m.groups()
                     name, nInputs, nOutputs = str(_values[0]), int(_values[1]), int(_values[2])
                     operators[name] = nOutputs
+                    self.operatorInputs[name] = nInputs
 
         return operators  # }}}
 
     # execute a single CDO command line {{{
-    def __call(self, cmd, envOfCall={}):
-        if self.logging and '-h' != cmd[1]:
-            self.logger.info(u' '.join(cmd))
-
+    # With a timeout or on interruption the whole process group is killed and
+    # partially written outputs are removed
+    def __call(self, cmd, envOfCall={}, timeout=None, outputs=(), memory=None):
+        start, retvals = time.time(), {}
+        try:
+            retvals = self.__callStaged(cmd, envOfCall, timeout, outputs, memory)
+            return retvals
+        finally:
+            if self.logging and '-h' != cmd[1]:
+                self.logger.call(cmd, time.time() - start, retvals.get('returncode'))
+
+    def __callStaged(self, cmd, envOfCall, timeout, outputs, memory):
+        if self.stager is None or '-h' == cmd[1]:
+            return self.__callWithMemory(cmd, envOfCall, timeout, outputs, memory)
+        # staged inputs are kept in scratch until the call has finished
+        with self.stager.staged(cmd, outputs) as stagedCmd:
+            return self.__callWithMemory(stagedCmd, envOfCall, timeout, outputs, memory)
+
+    # wait until the (estimated or given) memory of the call is free, see memory.py
+    def __callWithMemory(self, cmd, envOfCall, timeout, outputs, memory):
+        if self.memoryBudget is None or not outputs:
+            return self.__callWithBudget(cmd, envOfCall, timeout, outputs)
+        estimate = self.memoryEstimator.estimate(cmd, outputs)
+        if memory is None:
+            memory = estimate['memory'] if estimate else 0
+        reserved = self.memoryBudget.acquire(memory)
+        try:
+            start = time.time()
+            retvals = self.__callWithBudget(cmd, envOfCall, timeout, outputs, measure=True)
+        finally:
+            self.memoryBudget.release(reserved)
+        duration = time.time() - start if 0 == retvals['returncode'] else None
+        self.memoryEstimator.observe(estimate, retvals.pop('maxrss', None), duration)
+        return retvals
+
+    def __callWithBudget(self, cmd, envOfCall, timeout, outputs, measure=False):
         env = dict(self.env)
         env.update(envOfCall)
 
-        proc = subprocess.Popen(' '.join(cmd),
-                                shell=True,
-                                stderr=subprocess.PIPE,
-                                stdout=subprocess.PIPE,
-                                env=env)
+        # without a thread budget, CDO decides on the number of threads
+        budget = self.threadBudget
+        tokens = ' '.join(cmd).split()
+        operators = [t[1:].split(',')[0] for t in tokens if t.startswith('-')
+                     and t[1:].split(',')[0] in self.operators]
+        if budget is None or not operators:
+            return self.__run(cmd, env, timeout, outputs, measure=measure)
+
+        # user given '-P' is respected
+        userThreads = re.search(r'(?:^|\s)-P\s*(\d+)', ' '.join(cmd))
+        userThreads = int(userThreads.group(1)) if userThreads else None
+        cores = budget.acquire(operators, userThreads)
+        try:
+            if userThreads is None:
+                cmd = cmd[:2] + ['-P', str(len(cores))] + cmd[2:]
+            env['OMP_NUM_THREADS'] = str(len(cores))
+            return self.__run(cmd, env, timeout, outputs, cores, measure)
+        finally:
+            budget.release(cores)
+
+    def __run(self, cmd, env, timeout, outputs, cores=None, measure=False):
+        if self.__dict__.get('_executor') is not None:
+            return self.__runOnExecutor(cmd, env, timeout, outputs)
+        with (self.threadBudget.pinned(cores) if cores else contextlib.nullcontext()):
+            proc = subprocess.Popen(' '.join(cmd),
+                         shell=True,
+                         stderr=subprocess.PIPE,
+                         stdout=subprocess.PIPE,
+                         env=env,
+                         start_new_session=True)
+        self._processes.add(proc)
+        if measure:
+            from .memory import MeasuredProcess
+            measured = MeasuredProcess(proc)
+            communicate = measured.communicate
+        else:
+            communicate = proc.communicate
+        try:
+            retvals = communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            killProcessGroup(proc)
+            retvals = communicate()
+            self.__removeOutputs(outputs)
+            raise CDOTimeoutException(retvals[0].decode("utf-8"),
+                                      retvals[1].decode("utf-8"),
+                                      proc.returncode,
+                                      timeout)
+        except BaseException:
+            killProcessGroup(proc)
+            proc.wait()
+            self.__removeOutputs(outputs)
+            raise
+        finally:
+            self._processes.discard(proc)
 
-        retvals = proc.communicate()
         stdout = retvals[0].decode("utf-8")
         stderr = retvals[1].decode("utf-8")
 
@@ -355,20 +591,80 @@ class Cdo(object):
             # }}}
             print('# DEBUG - end ===============================================================')
 
-        return {"stdout": stdout, "stderr": stderr, "returncode": proc.returncode}  # }}}
+        # killed from outside, e.g. by cancel()
+        if proc.returncode < 0:
+            self.__removeOutputs(outputs)
+
+        retvals = {"stdout": stdout, "stderr": stderr, "returncode": proc.returncode}
+        if measure:
+            retvals["maxrss"] = measured.maxrss
+        return retvals
+
+    # run the command line on the executor of a submitted call, see executor.py
+    def __runOnExecutor(self, cmd, env, timeout, outputs):
+        from .executor import runCommand, RemoteCall
+        remote = RemoteCall(self.tempStore.dir, self.tempStore.fileTag)
+        self._processes.add(remote)
+        try:
+            future = self._executor.submit(runCommand, ' '.join(cmd), env, timeout,
+                                           remote.cancelFile)
+            # the cancel file is polled until the command has ended
+            future.add_done_callback(lambda f: remote.remove())
+            retvals = future.result()
+        except BaseException:
+            remote.kill()
+            self.__removeOutputs(outputs)
+            raise
+        finally:
+            self._processes.discard(remote)
+        if retvals.pop("timedOut"):
+            self.__removeOutputs(outputs)
+            raise CDOTimeoutException(retvals["stdout"], retvals["stderr"],
+                                      retvals["returncode"], timeout)
+        if self.debug:
+            print('CALL  :' + ' '.join(cmd))
+            print('STDOUT:' + retvals["stdout"])
+            print('STDERR:' + retvals["stderr"])
+        if retvals["returncode"] < 0:
+            self.__removeOutputs(outputs)
+        return retvals
+
+    def __removeOutputs(self, outputs):
+        for output in outputs:
+            if os.path.isfile(output):
+                os.remove(output)  # }}}
+
+    # wait until all write-behind outputs are delivered, failed deliveries {{{
+    # are raised as DeliveryError
+    def flush(self):
+        if self.writeBehind:
+            self.writeBehind.flush()  # }}}
+
+    # stop all running CDO calls of this object and its chains {{{
+    def cancel(self):
+        self._processes.killAll()
+
+    # copy of this object with its own process registry: cancel() on the copy
+    # stops only the calls made through it, cancel() on this object stops all
+    def _withOwnProcesses(self):
+        chain = self._withCmd(self._cmd)
+        chain._processes = ProcessRegistry(parent=self._processes)
+        return chain  # }}}
 
     # error handling for CDO calls {{{
     def __hasError(self, method_name, cmd, retvals):
         if self.debug:
             print("RETURNCODE:" + retvals["returncode"].__str__())
-        if self.__exit_success(method_name) < retvals["returncode"]:
+        # negative return codes: CDO was killed by a signal
+        if self.__exit_success(method_name) < retvals["returncode"] \
+           or 0 > retvals["returncode"]:
             print("Error in calling operator " + method_name + " with:")
             print(">>> " + ' '.join(cmd) + "<<<")
             print('STDOUT:' + retvals["stdout"])
             print('STDERR:' + retvals["stderr"])
 
             if self.logging:
-                self.logger.error(cmd + " with:" + retvals["stderr"])
+                self.logger.error(' '.join(cmd) + " with:" + retvals["stderr"])
             return True
         else:
             return False  # }}}
@@ -393,80 +689,111 @@ class Cdo(object):
             print("-->> Could not load netCDF4! <<--")  # }}}
 
     def infile(self, *infiles): #{{{
+        cmd = self._cmd
         for infile in infiles:
             if isinstance(infile, six.string_types):
-                self._cmd.append(infile)
+                cmd += (infile,)
             elif self.hasXarray:
                 import xarray  # <<-- python2 workaround
                 if type(infile) == xarray.core.dataset.Dataset:
                     # create a temp nc file from input data
                     tmpfile = self.tempStore.newFile()
                     infile.to_netcdf(tmpfile)
-                    self._cmd.append(tmpfile)
-        return self #}}}
+                    cmd += (tmpfile,)
+        return self._withCmd(cmd) #}}}
 
     def add_option(self, *options): #{{{
-        self._options = self._options + list(options)
-        return self #}}}
+        chain = self._withCmd(self._cmd)
+        chain._options = self._options + tuple(options)
+        return chain #}}}
+
+    # copy of this object with another operator chain. Chains are never changed {{{
+    # in place, so that one object can be used by many threads at the same time
+    def _withCmd(self, cmd):
+        chain = object.__new__(self.__class__)
+        chain.__dict__.update(self.__dict__)
+        chain._cmd = tuple(cmd)
+        chain.__dict__.pop('_memo', None)
+        return chain
+
+    # empty chain with the same settings, e.g. for helper calls within a chain
+    def _newChain(self):
+        return self._withCmd(()) #}}}
 
     def __call__(self, *args, **kwargs):
+        # run the CDO command on a concurrent.futures.Executor, return a future
+        if kwargs.get('executor') is not None:
+            from .executor import submit
+            return submit(self, kwargs.pop('executor'), args, kwargs)
+        # lazy results run when their file is needed or as part of another
+        # chain, with all modes of the call. Only calls with a single output
+        # file are lazy, calls without keywords build chains
+        if 'lazy' == kwargs.get('returnResult', self.returnResults) and kwargs \
+           and kwargs.get('compute', True) and not kwargs.get('stream') \
+           and 1 == self.operators.get(self._operatorName()) \
+           and 1 >= len((kwargs.get('output') or '').split()) \
+           and not any(kwargs.get(k) is not None for k in ('returnArray', 'returnMaArray', 'returnXArray',
+                                                            'returnXDataset', 'returnCdf')):
+            from .result import CdoResult
+            chain = self._withCmd(self._cmd[:-1] + (self._cmd[-1] + ',' + ','.join(map(str, args)),)) \
+                if args else self
+            return CdoResult.lazy(chain, kwargs)
+        # run the chain on timestep ranges in parallel
+        if kwargs.get('timeChunks'):
+            from .parallel import runTimeChunked
+            return runTimeChunked(self, args, kwargs)
+        # run the chain on horizontal tiles in parallel
+        if kwargs.get('tiles') or kwargs.get('tileMemory'):
+            from .parallel import runTiled
+            return runTiled(self, args, kwargs)
+        # reduce long input lists in a tree of partial reductions, by default
+        # if the inputs do not fit on a command line
+        if kwargs.get('treeReduce') or (kwargs.get('treeReduce') is None
+                                        and isinstance(kwargs.get('input'), (list, tuple))
+                                        and self._operatorName() in self.TreeReduceOperators):
+            from .parallel import runTreeReduced, exceedsCommandLine
+            if kwargs.get('treeReduce') or exceedsCommandLine(kwargs['input']):
+                return runTreeReduced(self, args, kwargs)
+        # yield the outputs of split operators as soon as they are written
+        if kwargs.get('stream'):
+            from .streaming import streamSplit
+            return streamSplit(self, args, kwargs)
+        # run the chain in checkpointed segments
+        if kwargs.get('checkpoints'):
+            from .parallel import runCheckpointed
+            return runCheckpointed(self, args, kwargs)
+
         user_kwargs = kwargs.copy()
-        try:
-            method_name = self._cmd[0][1:].split(',')[0]
-        except IndexError:
-            method_name = ''
+        method_name = self._operatorName()
         operatorPrintsOut = method_name in self.noOutputOperators
 
-        self.envByCall = {}
-
-        # Build the cdo command
-        # 0. the cdo command itself
-        cmd = [self.CDO]
-
-        # 1. OVERWRITE EXISTING FILES
-        cmd.append('-O')
-
-        # 2. set the options
-        # show full output in case of diff-like operators
-        # or user requested the non-silent mode directly
-        if (not method_name in self.DiffOperators) and self.silent:
-            cmd.append('-s')
-        cmd.extend(self._options)
-        # switch to netcdf output in case of numpy/xarray usage
-        if kwargs.get('returnArray') is not None \
-           or kwargs.get('returnMaArray') is not None \
-           or kwargs.get('returnXArray') is not None \
-           or kwargs.get('returnXDataset') is not None \
-           or kwargs.get('returnCdf') is not None:
-            cmd.append('-f nc')
-        if 'options' in kwargs:
-            cmd += kwargs['options'].split()
-
-        # 3. add operators
         # collect operator parameters and pad them to the operator name
+        chain = self
         if len(args) != 0:
-            self._cmd[-1] += ',' + ','.join(map(str, args))
-        if self._cmd:
-            cmd.extend(self._cmd)
-
-        # 4. input files or other operators
-        if 'input' in kwargs:
-            if isinstance(kwargs["input"], six.string_types):
-                cmd.append(kwargs["input"])
-            elif type(kwargs["input"]) == list:
-                cmd.append(' '.join(kwargs["input"]))
-            elif self.hasXarray:
-                import xarray  # <<-- python2 workaround
-                if type(kwargs["input"]) in [xarray.core.dataset.Dataset,xarray.core.dataarray.DataArray]:
-                    # create a temp nc file from input data
-                    tmpfile = self.tempStore.newFile()
-                    kwargs["input"].to_netcdf(tmpfile)
-                    kwargs["input"] = tmpfile
-
-                    cmd.append(kwargs["input"])
-            else:
-                # we assume it's either a list, a tuple or any iterable.
-                cmd.append(kwargs["input"])
+            chain = self._withCmd(
+                self._cmd[:-1] + (self._cmd[-1] + ',' + ','.join(map(str, args)),))
+
+        # small in-memory inputs: simple chains run in numpy, everything else
+        # falls back to CDO
+        if 'numpy' == kwargs.get('engine', self.engine) and self.hasXarray \
+           and kwargs.get('compute', True):
+            from .engine import runNumpy
+            result = runNumpy(chain, kwargs)
+            if result is not None:
+                return result
+
+        # partial reads: labels of returnArray/returnMaArray become sel*
+        # operators in front of the chain, CDO writes the selection only
+        for key in ('returnArray', 'returnMaArray'):
+            if isinstance(kwargs.get(key), tuple) and chain._cmd and not operatorPrintsOut:
+                from .selection import splitSelection, isLabelSelection, selOperators
+                varname, select = splitSelection(kwargs[key])
+                if isLabelSelection(select):
+                    chain = chain._withCmd(selOperators(select) + list(chain._cmd))
+                    kwargs[key] = varname
+
+        # steps 0. - 4.
+        cmd = chain._buildCmd(kwargs)
 
         # 5. handle rewrite of existing output files
         if not kwargs.__contains__("force"):
@@ -485,13 +812,15 @@ class Cdo(object):
         if kwargs.get("output") is not None:
             outputs.append(kwargs["output"])
 
+        # keep=False used to reset the chain after the call: chains are never
+        # changed by calls anymore, every call starts from a fresh chain
         if not user_kwargs or not kwargs.get('compute', True):
-            return self
-        elif not kwargs.get('keep', True):
-            self._cmd.clear()
+            return chain
+
+        timeout = kwargs.get('timeout', self.timeout)
 
         if operatorPrintsOut:
-            retvals = self.__call(cmd, envOfCall)
+            retvals = self.__call(cmd, envOfCall, timeout)
             if not self.__hasError(method_name, cmd, retvals):
                 r = list(map(strip, retvals["stdout"].split(os.linesep)))
                 if "autoSplit" in kwargs:
@@ -509,20 +838,58 @@ class Cdo(object):
                 else:
                     raise CDOException(**retvals)
         else:
-            if kwargs["force"] or \
-               (kwargs.__contains__("output") and not os.path.isfile(kwargs["output"])):
+            # inputs (or the output) of this call may still be on their way
+            # to their write-behind destination, also if this call does not
+            # write behind
+            writeBehind = kwargs.get('writeBehind', self.writeBehind)
+            for pending in set(w for w in (self.writeBehind, writeBehind) if w):
+                pending.waitFor(cmd, outputs)
+
+            # incremental mode: rerun only if the manifest of the given output
+            # does not match the current call
+            incremental = kwargs.get('incremental', self.incremental)
+            if incremental and outputs:
+                from .incremental import callManifest, isUpToDate, writeManifest
+                manifest = callManifest(cmd, outputs, hashing='hash' == incremental)
+                mustRun = not all(isUpToDate(output, manifest) for output in outputs)
+            else:
+                mustRun = kwargs["force"] or \
+                    (kwargs.__contains__("output") and not os.path.isfile(kwargs["output"]))
+
+            if mustRun:
                 if not kwargs.__contains__("output") or kwargs["output"] is None:
                     for i in range(0, self.operators[method_name]):
                         outputs.append(self.tempStore.newFile())
 
+                # write-behind: CDO writes a single output to local scratch, the
+                # file is moved to the given output in the background
+                finalOutputs = None
+                if writeBehind and kwargs.get("output") is not None \
+                   and 1 == self.operators[method_name] and 1 == len(kwargs["output"].split()) \
+                   and not any(kwargs.get(k) for k in ('returnArray', 'returnMaArray', 'returnXArray',
+                                                       'returnXDataset', 'returnCdf')) \
+                   and writeBehind.wants(kwargs["output"]):
+                    finalOutputs, outputs = outputs, [writeBehind.scratchFile(kwargs["output"])]
+
                 cmd.append(' '.join(outputs))
 
-                retvals = self.__call(cmd, envOfCall)
+                retvals = self.__call(cmd, envOfCall, timeout, outputs, kwargs.get('memory'))
                 if self.__hasError(method_name, cmd, retvals):
+                    if finalOutputs:
+                        self.__removeOutputs(outputs)
                     if self.returnNoneOnError:
                         return None
                     else:
                         raise CDOException(**retvals)
+                if finalOutputs:
+                    after = None
+                    if incremental:
+                        after = functools.partial(writeManifest, finalOutputs[0], manifest)
+                    writeBehind.deliver(outputs[0], finalOutputs[0], after)
+                    outputs = finalOutputs
+                elif incremental and kwargs.get("output") is not None:
+                    for output in outputs:
+                        writeManifest(output, manifest)
             else:
                 if self.debug:
                     print(("Use existing file'" + kwargs["output"] + "'"))
@@ -555,34 +922,117 @@ class Cdo(object):
 
         # handle split-operator outputs
         elif 'split' == method_name[0:5]:
+            if kwargs.get('returnResult', self.returnResults):
+                from .result import CdoResult
+                return [CdoResult(self, f, cmd=cmd) for f in glob.glob(kwargs["output"] + '*')]
             return glob.glob(kwargs["output"] + '*')
 
         # default: return filename (given or tempfile)
         else:
+            if kwargs.get('returnResult', self.returnResults):
+                from .result import CdoResult
+                outputs = [CdoResult(self, f, temporary=kwargs.get("output") is None, cmd=cmd)
+                           for f in outputs]
             if 1 == len(outputs):
                 return outputs[0]
             else:
                 return outputs
 
+    def _operatorName(self):
+        try:
+            return self._cmd[0][1:].split(',')[0]
+        except IndexError:
+            return ''
+
+    # build the cdo command line for the current chain (without outputs) {{{
+    def _buildCmd(self, kwargs):
+        method_name = self._operatorName()
+
+        # 0. the cdo command itself
+        cmd = [self.CDO]
+
+        # 1. OVERWRITE EXISTING FILES
+        cmd.append('-O')
+
+        # 2. set the options
+        # show full output in case of diff-like operators
+        # or user requested the non-silent mode directly
+        if (not method_name in self.DiffOperators) and self.silent:
+            cmd.append('-s')
+        cmd.extend(self._options)
+        # let the format policy choose the output options by the next consumer
+        # of the result. Without policy switch to netcdf output in case of
+        # numpy/xarray usage
+        policy = kwargs.get('formatPolicy', self.formatPolicy)
+        override = None
+        if isinstance(policy, dict):
+            policy, override = self.formatPolicy or FormatPolicy(), policy
+        elif policy is True:
+            policy = self.formatPolicy or FormatPolicy()
+        if policy and method_name not in self.noOutputOperators:
+            cmd.extend(policy.options(FormatPolicy.consumer(kwargs),
+                                      self._options + (kwargs.get('options', ''),),
+                                      override,
+                                      netcdf4=self.hasLib('nc4')))
+        elif kwargs.get('returnArray') is not None \
+           or kwargs.get('returnMaArray') is not None \
+           or kwargs.get('returnXArray') is not None \
+           or kwargs.get('returnXDataset') is not None \
+           or kwargs.get('returnCdf') is not None:
+            cmd.append('-f nc')
+        if 'options' in kwargs:
+            cmd += kwargs['options'].split()
+
+        # 3. add operators
+        cmd.extend(shellToken(token) for token in self._cmd)
+
+        # 4. input files or other operators
+        if 'input' in kwargs:
+            from .result import inputTokens
+            if isinstance(kwargs["input"], six.string_types):
+                cmd.append(kwargs["input"])
+            elif type(kwargs["input"]) == list:
+                for item in kwargs["input"]:
+                    cmd.extend(inputTokens(item))
+            elif hasattr(kwargs["input"], '__fspath__'):
+                # results of other calls and paths
+                cmd.extend(inputTokens(kwargs["input"]))
+            elif self.hasXarray:
+                import xarray  # <<-- python2 workaround
+                if type(kwargs["input"]) in [xarray.core.dataset.Dataset,xarray.core.dataarray.DataArray]:
+                    # create a temp nc file from input data
+                    tmpfile = self.tempStore.newFile()
+                    kwargs["input"].to_netcdf(tmpfile)
+                    kwargs["input"] = tmpfile
+
+                    cmd.append(kwargs["input"])
+            else:
+                # we assume it's either a list, a tuple or any iterable.
+                cmd.append(kwargs["input"])
+
+        return cmd  # }}}
+
     def __getattr__(self, method_name):  # main method-call handling for Cdo-objects {{{
         if any(method_name in opts for opts in (
                self.__dict__, self.operators, self.AliasOperators)):
             if self.debug:
                 print(("Found operator:" + method_name))
 
-            # cache the method for later
-            class Operator(self.__class__):
-                name = method_name
-                __name__ = method_name
-                __qualname__ = getattr(  # __qualname__ is available in python 3.3+
-                    self.__class__, '__qualname__', self.__class__.__name__
-                ) + '.' + method_name
-
-                def __init__(self, *args, **kwargs):
-                    super().__init__(*args, **kwargs)
-                    self.__doc__ = operator_doc(method_name, self.CDO)
-
-            setattr(self.__class__, method_name, Operator())
+            # cache the method for later: only one thread should create it
+            with self._operatorLock:
+                if method_name not in vars(self.__class__):
+                    class Operator(self.__class__):
+                        name = method_name
+                        __name__ = method_name
+                        __qualname__ = getattr(  # __qualname__ is available in python 3.3+
+                            self.__class__, '__qualname__', self.__class__.__name__
+                        ) + '.' + method_name
+
+                        def __init__(self, *args, **kwargs):
+                            super().__init__(*args, **kwargs)
+                            self.__doc__ = self._operatorDoc(method_name)
+
+                    setattr(self.__class__, method_name, Operator())
             return getattr(self, method_name)
         else:
             # given method might match part of know operators: autocompletion
@@ -629,15 +1079,12 @@ class Cdo(object):
 
         return libraries #}}}
 
+    # the last records of the log target of this object {{{
     def collectLogs(self):
-        if isinstance(self.logFile, six.string_types):
-            content = []
-            with open(self.logFile, 'r') as f:
-                content.append(f.read())
-            return ''.join(content)
-        else:
-            self.logFile.flush()
-            return self.logFile.getvalue()
+        from .log import collectLogs
+        if not self.logging:
+            return ''
+        return collectLogs(self.logger)  # }}}
 
     def showLog(self):
         print(self.collectLogs())
@@ -659,9 +1106,16 @@ class Cdo(object):
             print(self.__call([self.CDO, ' -V']))
         return True
 
+    # documentation of an operator from the catalog or the binary
+    def _operatorDoc(self, name):
+        if self._catalog and self._catalog['operators'].get(name, [None] * 4)[3] is not None:
+            return self._catalog['operators'][name][3]
+        return operator_doc(name, self.CDO)
+
     # change the CDO binary for the current object
     def setCdo(self, value):
         self.CDO = value
+        self._catalog = loadCatalog(self.CDO)
         self.operators = self.__getOperators()
 
     # return the path to the CDO binary currently used
@@ -696,6 +1150,8 @@ class Cdo(object):
 
     def version(self, verbose=False):
         # return CDO's version
+        if not verbose:
+            return self._version
         return getCdoVersion(self.CDO, verbose)
 
     def boundaryLevels(self, **kwargs):
@@ -726,10 +1182,64 @@ class Cdo(object):
         else:
             return self(compute=True)
 
+    # what a call would run and cost: command, operators, temporary files and {{{
+    # estimates per stage. Nothing is computed, see explain.py
+    def explain(self, *args, **kwargs):
+        from .explain import explainChain
+        return explainChain(self, args, kwargs)  # }}}
+
+    # iterate over a long result in batches of timesteps, see timesteps.py {{{
+    def iterTimesteps(self, chain, varname, batch=1, readAhead=2):
+        """Yield numpy arrays of 'batch' timesteps of varname
+
+        chain is a file, a result, a chain object or a chain expression. The
+        next batches are read in the background while the current one is used.
+        """
+        from .timesteps import iterTimesteps
+        return iterTimesteps(self, chain, varname, batch, readAhead)
+
+    iter_timesteps = iterTimesteps  # }}}
+
+    # time axis of a file, see timeindex.py {{{
+    def timeIndex(self, iFile):
+        """Timestamps of a file as numpy.datetime64 with its calendar, cached per file
+
+        index.seltimestep(start, end) is the operator which selects a date range.
+        """
+        from .timeindex import timeIndex
+        return timeIndex(self, iFile)
+
+    time_index = timeIndex  # }}}
+
+    # output of the chain of this object for the read* methods: CDO runs {{{
+    # only once per chain. The temporary output is removed together with the
+    # chain object or by invalidate()
+    def __chainOutput(self):
+        key = (self.CDO, self._options, self._cmd)
+        memo = self.__dict__.get('_memo')
+        if memo is not None and memo[0] == key and \
+           all(os.path.isfile(f) for f in memo[1]):
+            output = memo[1]
+        else:
+            from .parallel import removeFiles
+            output = self(compute=True, returnResult=False)
+            output = output if isinstance(output, list) else [output]
+            self._memo = (key, output)
+            weakref.finalize(self, removeFiles, output)
+        return output[0] if 1 == len(output) else output
+
+    def invalidate(self):
+        """Forget the output of this chain, the next read runs CDO again"""
+        from .parallel import removeFiles
+        memo = self.__dict__.pop('_memo', None)
+        if memo is not None:
+            removeFiles(memo[1])
+    # }}}
+
     def readCdf(self, iFile=None):
         """Return a cdf handle created by the available cdf library"""
         if iFile is None:
-            iFile = self.run()
+            iFile = self.__chainOutput()
         if self.hasNetcdf:
             fileObj = self.cdf(iFile, mode='r')
             return fileObj
@@ -737,47 +1247,86 @@ class Cdo(object):
             print("Could not import data from file '%s' (python-netCDF4)" % iFile)
             six.raise_from(ImportError, None)
 
-    def readArray(self, iFile=None, varname=None):
-        """Direcly return a numpy array for a given variable name"""
+    # open a file for reading one or more variables. Labels which cannot be {{{
+    # mapped onto the coordinates of the file are selected by CDO, see
+    # selection.py. Returns the file handle and the index of each variable
+    def __openSelection(self, iFile, varnames, select):
+        from .selection import isLabelSelection, readIndex, selOperators
+        fileObj = self.readCdf(iFile)
+        if not isLabelSelection(select):
+            index = slice(None) if select is None else select
+            return fileObj, {name: index for name in varnames}
+        index = self.timeIndex(iFile) if 'time' in select else None
+        indices = {name: readIndex(self.np, fileObj, name, select, index, iFile)
+                   for name in varnames if name in fileObj.variables}
+        if None in indices.values() or not indices:
+            iFile = self._withCmd(selOperators(select, index))(input=iFile, formatPolicy={'format': 'nc2'})
+            fileObj, indices = self.readCdf(iFile), {name: slice(None) for name in varnames}
+        return fileObj, indices
+    # }}}
+
+    def readArray(self, iFile=None, varname=None, select=None):
+        """Direcly return a numpy array for a given variable name
+
+        A list of names returns a dict of arrays read from one file handle.
+        select reads a part of the variables only: an index expression like
+        numpy.s_[0, :, 2:4] or labels like {'time': (start, end), 'level': 850,
+        'bbox': (lon1, lon2, lat1, lat2)}. varname can be a (varname, select)
+        tuple as well.
+        """
+        from .selection import splitSelection
+        varname, select = splitSelection(varname, select)
         if iFile is None:
-            iFile = self.run()
+            iFile = self.__chainOutput()
         if varname is None:
             raise ValueError("A varname needs to be specified!")
-        filehandle = self.readCdf(iFile)
-        try:
-            # return the data array for given variable name
-            return filehandle.variables[varname][:].copy()
-        except Exception:
-            print("Cannot find variable '%s'" % varname)
-            six.raise_from(LookupError, None)
-
-    def readMaArray(self, iFile=None, varname=None):  # {{{
-        """Create a masked array based on cdf's FillValue"""
+        varnames = varname if isinstance(varname, list) else [varname]
+        filehandle, indices = self.__openSelection(iFile, varnames, select)
+        # the netCDF library is not thread-safe: variables are read one
+        # after the other from the same handle
+        arrays = {}
+        for name in varnames:
+            if name not in filehandle.variables:
+                print("Cannot find variable '%s'" % name)
+                six.raise_from(LookupError, None)
+            # netCDF reads only the selected hyperslab into a new array,
+            # invalid index expressions and read errors are raised as they are
+            arrays[name] = filehandle.variables[name][indices[name]]
+        return arrays if isinstance(varname, list) else arrays[varname]
+
+    def readMaArray(self, iFile=None, varname=None, select=None):  # {{{
+        """Create a masked array based on cdf's FillValue, see readArray for select"""
+        from .selection import splitSelection
+        varname, select = splitSelection(varname, select)
         if iFile is None:
-            iFile = self.run()
+            iFile = self.__chainOutput()
         if varname is None:
             raise ValueError("A varname needs to be specified!")
-        fileObj = self.readCdf(iFile)
-
-        if varname not in fileObj.variables:
-            print("Cannot find variables '%s'" % varname)
-            six.raise_from(LookupError, None)
-        else:
-            data = fileObj.variables[varname][:].copy()
+        varnames = varname if isinstance(varname, list) else [varname]
+        fileObj, indices = self.__openSelection(iFile, varnames, select)
+
+        arrays = {}
+        for name in varnames:
+            if name not in fileObj.variables:
+                print("Cannot find variables '%s'" % name)
+                six.raise_from(LookupError, None)
+            else:
+                data = fileObj.variables[name][indices[name]]
 
-        if hasattr(fileObj.variables[varname], '_FillValue'):
-            # return masked array
-            retval = self.np.ma.array(
-                data, mask=data == fileObj.variables[varname]._FillValue)
-        else:
-            # generate dummy mask which is always valid
-            retval = self.np.ma.array(data, mask=data != data)
+            if hasattr(fileObj.variables[name], '_FillValue'):
+                # return masked array
+                arrays[name] = self.np.ma.array(
+                    data, mask=data == fileObj.variables[name]._FillValue)
+            else:
+                # generate dummy mask which is always valid
+                arrays[name] = self.np.ma.array(data, mask=data != data)
 
-        return retval  # }}}
+        return arrays if isinstance(varname, list) else arrays[varname]  # }}}
 
     def readXArray(self, ifile=None, varname=None):
+        """Return a DataArray or a dict of them for a list of names"""
         if ifile is None:
-            ifile = self.run()
+            ifile = self.__chainOutput()
         if varname is None:
             raise ValueError("A varname needs to be specified!")
         if not self.hasXarray:
@@ -786,6 +1335,8 @@ class Cdo(object):
 
         dataSet = self.xa_open(ifile)
         try:
+            if isinstance(varname, list):
+                return {name: dataSet[name] for name in varname}
             return dataSet[varname]
         except Exception:
             print("Cannot find variable '%s'" % varname)
@@ -793,7 +1344,7 @@ class Cdo(object):
 
     def readXDataset(self, ifile=None):
         if ifile is None:
-            ifile = self.run()
+            ifile = self.__chainOutput()
         if not self.hasXarray:
             print("Could not load XArray")
             six.raise_from(ImportError, None)
@@ -836,7 +1387,9 @@ class CdoTempfileStore(object):
                 os.remove(filename)
 
     def __catch__(self, signum, frame, throw=None, **kwargs):
-        # if a termination signal could be caught, remove tempfile
+        # if a termination signal could be caught, stop running CDO processes and
+        # remove tempfile
+        allProcesses.killAll()
         self.__del__()
         if callable(throw):
             throw(signum, frame, **kwargs)
@@ -0,0 +1,208 @@
+import os
+
+import numpy as np
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# in-process engine for small in-memory inputs: with engine='numpy', chains
+# of simple operators on xarray inputs are computed with numpy instead of
+# writing the input to netCDF, running CDO and reading the result back.
+# Results follow CDO: missing values (NaN) are skipped, fldmean is weighted
+# by the cell area of a regular lon/lat grid. Whatever is not covered here
+# (operators, options, grids, return types) runs with CDO as usual.
+
+LatNames = ('lat', 'latitude', 'y')
+LonNames = ('lon', 'longitude', 'x')
+
+
+# coordinates {{{
+def coordinateName(ds, names, units):
+    for name in ds.coords:
+        if name in names or ds[name].attrs.get('units') == units:
+            if 1 == ds[name].ndim and name in ds.dims:
+                return name
+    return None
+
+
+def timeName(ds):
+    for name in ds.coords:
+        if 'time' == name or 'T' == ds[name].attrs.get('axis'):
+            return name if name in ds.dims else None
+    return None
+
+
+def cellBounds(ds, name, limit=None):
+    """Bounds of a 1d coordinate: its bounds variable or the midpoints"""
+    bounds = ds[name].attrs.get('bounds')
+    if bounds in ds.variables and ds[bounds].shape == ds[name].shape + (2,):
+        return ds[bounds].values.astype(np.float64)
+    values = ds[name].values.astype(np.float64)
+    if 1 == len(values):
+        edges = np.array([values[0] - 0.5, values[0] + 0.5]) if limit is None else np.array([-limit, limit])
+    else:
+        middle = 0.5 * (values[1:] + values[:-1])
+        edges = np.concatenate([[2 * values[0] - middle[0]], middle, [2 * values[-1] - middle[-1]]])
+    if limit is not None:
+        edges = np.clip(edges, -limit, limit)
+    return np.stack([edges[:-1], edges[1:]], axis=-1)
+
+
+def areaWeights(ds, lat, lon):
+    """Relative cell areas of a regular lon/lat grid (lat x lon)"""
+    latBounds = np.radians(cellBounds(ds, lat, limit=90.0))
+    lonBounds = np.radians(cellBounds(ds, lon))
+    return np.outer(np.abs(np.sin(latBounds[:, 1]) - np.sin(latBounds[:, 0])),
+                    np.abs(lonBounds[:, 1] - lonBounds[:, 0]))
+# }}}
+
+
+def fields(ds):
+    """Names of the data variables without bounds variables"""
+    bounds = {v.attrs.get('bounds') for v in ds.variables.values()}
+    return [name for name in ds.data_vars if name not in bounds and not name.endswith('_bnds')]
+
+
+def floating(values, like):
+    return values.astype(like.dtype) if np.issubdtype(like.dtype, np.floating) else values
+
+
+# operators: dataset and parameters in, dataset out (None: not supported) {{{
+def fldmean(ds, params):
+    lat = coordinateName(ds, LatNames, 'degrees_north')
+    lon = coordinateName(ds, LonNames, 'degrees_east')
+    if lat is None or lon is None or params:
+        return None
+    weights = areaWeights(ds, lat, lon)
+    # CDO writes a single cell at 0/0
+    result = ds.isel({lat: [0], lon: [0]})
+    result = result.drop_vars([v for v in result.variables
+                               if v in (ds[lat].attrs.get('bounds'), ds[lon].attrs.get('bounds'))])
+    result = result.assign_coords({lat: (lat, [0.0], ds[lat].attrs), lon: (lon, [0.0], ds[lon].attrs)})
+    for name in fields(ds):
+        var = ds[name]
+        if lat not in var.dims or lon not in var.dims:
+            return None
+        var = var.transpose(*[d for d in var.dims if d not in (lat, lon)] + [lat, lon])
+        values = var.values.astype(np.float64)
+        valid = ~np.isnan(values)
+        total = np.where(valid, values * weights, 0).sum(axis=(-2, -1))
+        area = np.where(valid, weights, 0).sum(axis=(-2, -1))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(0 < area, total / np.where(0 < area, area, 1), np.nan)
+        result[name] = (var.dims, floating(mean[..., np.newaxis, np.newaxis], var), var.attrs)
+    return result
+
+
+def timmean(ds, params):
+    time = timeName(ds)
+    if time is None or params:
+        return None
+    result = ds.isel({time: [-1]})
+    for name in fields(ds):
+        var = ds[name]
+        if time not in var.dims:
+            continue
+        values = var.values.astype(np.float64)
+        axis = var.dims.index(time)
+        with np.errstate(invalid='ignore'):
+            count = (~np.isnan(values)).sum(axis=axis, keepdims=True)
+            mean = np.where(0 < count, np.nansum(values, axis=axis, keepdims=True)
+                            / np.maximum(count, 1), np.nan)
+        result[name] = (var.dims, floating(mean, var), var.attrs)
+    return result
+
+
+def arithmetic(function):
+    def operator(ds, params):
+        if 1 != len(params):
+            return None
+        try:
+            constant = float(params[0])
+        except ValueError:
+            return None
+        result = ds.copy()
+        for name in fields(ds):
+            var = ds[name]
+            result[name] = (var.dims, floating(function(var.values.astype(np.float64), constant), var),
+                            var.attrs)
+        return result
+    return operator
+
+
+def selname(ds, params):
+    names = [name for name in fields(ds) if name in params]
+    if not names:
+        return None
+    return ds.drop_vars([name for name in fields(ds) if name not in names])
+
+
+Operators = {
+    'fldmean': fldmean,
+    'timmean': timmean,
+    'mulc': arithmetic(np.multiply),
+    'addc': arithmetic(np.add),
+    'selname': selname,
+}
+# }}}
+
+
+def runNumpy(chain, kwargs):
+    """Result of chain(**kwargs) computed with numpy, None if CDO has to run it"""
+    import xarray
+    ds = kwargs.get('input')
+    if isinstance(ds, xarray.DataArray):
+        if ds.name is None:
+            return None
+        ds = ds.to_dataset()
+    if not isinstance(ds, xarray.Dataset) or chain._options or kwargs.get('options') \
+       or kwargs.get('returnCdf') or kwargs.get('formatPolicy'):
+        return None
+    for key in ('returnArray', 'returnMaArray'):
+        if isinstance(kwargs.get(key), tuple):
+            return None
+    # existing outputs are kept with force=False: the CDO path skips the call
+    if kwargs.get('output') is not None and not kwargs.get('force', chain.forceOutput) \
+       and os.path.isfile(kwargs['output']):
+        return None
+
+    # innermost operator first
+    for token in reversed(chain._cmd):
+        parts = token[1:].split(',')
+        if parts[0] not in Operators:
+            return None
+        ds = Operators[parts[0]](ds, parts[1:])
+        if ds is None:
+            return None
+
+    def read(names, function):
+        if isinstance(names, (list, tuple)):
+            return {name: function(ds[name]) for name in names}
+        return function(ds[names])
+
+    # unknown variables: CDO reports the error
+    for key in ('returnXArray', 'returnArray', 'returnMaArray'):
+        names = kwargs.get(key)
+        names = names if isinstance(names, (list, tuple)) else [names]
+        if kwargs.get(key) is not None and any(name not in ds.variables for name in names):
+            return None
+
+    if kwargs.get('returnXDataset'):
+        return ds
+    if kwargs.get('returnXArray') is not None:
+        return read(kwargs['returnXArray'], lambda var: var)
+    if kwargs.get('returnArray') is not None:
+        return read(kwargs['returnArray'], lambda var: var.values)
+    if kwargs.get('returnMaArray') is not None:
+        return read(kwargs['returnMaArray'], lambda var: np.ma.masked_invalid(var.values))
+    output = kwargs.get('output') or chain.tempStore.newFile()
+    ds.to_netcdf(output)
+    if kwargs.get('returnResult', chain.returnResults):
+        from .result import CdoResult
+        return CdoResult(chain, output, temporary=kwargs.get('output') is None,
+                         cmd=[chain.CDO] + list(chain._cmd))
+    return output
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -0,0 +1,168 @@
+import os
+import time
+import uuid
+import signal
+import weakref
+import threading
+import subprocess
+import concurrent.futures
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# running Cdo calls on any concurrent.futures.Executor: thread or process
+# pools or a dask client (client.get_executor()). The executor runs the CDO
+# command line only, everything else (temporary files, error handling and
+# return values) stays with the calling Cdo object. With executors on other
+# nodes, inputs, outputs and the tempdir have to be on a shared filesystem.
+# The CDO process may run in another process or on another node, so it is
+# cancelled through a file in the tempdir: the executor polls for it and
+# kills the process group of the call.
+
+# number of local threads which wait for the results of an executor, if its
+# size is not known (e.g. dask), and for streaming calls
+DispatchThreads = 64
+
+# seconds between two checks for a cancel request
+CancelInterval = 0.2
+
+_dispatcher = None
+_dispatchers = weakref.WeakKeyDictionary()
+_dispatcherLock = threading.Lock()
+
+
+def executorWorkers(executor):
+    """Number of calls an executor runs at the same time, None if unknown"""
+    return getattr(executor, '_max_workers', None)
+
+
+def dispatcher(executor=None):
+    """Local threads for the calls on executor: as many as the executor runs"""
+    global _dispatcher
+    workers = executorWorkers(executor) if executor is not None else None
+    with _dispatcherLock:
+        if workers is None:
+            if _dispatcher is None:
+                _dispatcher = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=DispatchThreads, thread_name_prefix='cdoDispatch')
+            return _dispatcher
+        if executor not in _dispatchers:
+            _dispatchers[executor] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='cdoDispatch')
+        return _dispatchers[executor]
+
+
+# the part which runs on the executor: a plain function of plain data, so that {{{
+# it can be pickled for process pools and remote workers
+def runCommand(cmd, env, timeout=None, cancelFile=None):
+    """Run a CDO command line and return stdout, stderr and return code
+
+    The process group is killed after timeout seconds or as soon as cancelFile
+    exists.
+    """
+    proc = subprocess.Popen(cmd,
+                            shell=True,
+                            stderr=subprocess.PIPE,
+                            stdout=subprocess.PIPE,
+                            env=env,
+                            start_new_session=True)
+    deadline = None if timeout is None else time.time() + timeout
+    timedOut = False
+    try:
+        while True:
+            wait = CancelInterval if cancelFile else None
+            if deadline is not None:
+                wait = max(0, min(wait or timeout, deadline - time.time()))
+            try:
+                stdout, stderr = proc.communicate(timeout=wait)
+                break
+            except subprocess.TimeoutExpired:
+                timedOut = deadline is not None and time.time() >= deadline
+                if timedOut or os.path.exists(cancelFile or ''):
+                    killGroup(proc)
+                    stdout, stderr = proc.communicate()
+                    break
+    except BaseException:
+        killGroup(proc)
+        proc.wait()
+        raise
+    return {"stdout": stdout.decode("utf-8"),
+            "stderr": stderr.decode("utf-8"),
+            "returncode": proc.returncode,
+            "timedOut": timedOut}
+
+
+def killGroup(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass
+# }}}
+
+
+# caller side of a command on an executor {{{
+class RemoteCall(object):
+    """Handle of a command running on an executor, for ProcessRegistry
+
+    kill() asks the executor to kill the process group of the command.
+    """
+
+    pid = None
+
+    def __init__(self, directory, tag):
+        self.cancelFile = os.path.join(directory, '%s_cancel_%s' % (tag, uuid.uuid4().hex))
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def kill(self):
+        with self._lock:
+            if not self.finished:
+                with open(self.cancelFile, 'w'):
+                    pass
+
+    def remove(self):
+        """The command has ended: the cancel file is not needed anymore"""
+        with self._lock:
+            self.finished = True
+            if os.path.exists(self.cancelFile):
+                os.remove(self.cancelFile)
+# }}}
+
+
+def submit(cdo, executor, args, kwargs):
+    """Run cdo(*args, **kwargs) with its CDO command on executor
+
+    Returns a future for the value the call returns. CDO errors are raised by
+    future.result() as CDOException.
+    """
+    chain = cdo._withOwnProcesses()
+    chain._executor = executor
+    call = dispatcher(executor).submit(chain, *args, **kwargs)
+
+    # the returned future stays pending until the call is done, so cancel()
+    # stops running calls as well: their processes are killed
+    future = concurrent.futures.Future()
+
+    def cancelled(f):
+        if f.cancelled():
+            call.cancel()
+            # also kills the process if the call has not started it yet
+            chain._processes.close()
+
+    def done(c):
+        if not future.set_running_or_notify_cancel():
+            return
+        if c.cancelled():
+            future.set_exception(concurrent.futures.CancelledError())
+        elif c.exception() is not None:
+            future.set_exception(c.exception())
+        else:
+            future.set_result(c.result())
+
+    future.add_done_callback(cancelled)
+    call.add_done_callback(done)
+    return future
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -0,0 +1,119 @@
+import os
+import shlex
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# dry run of a call: chain.explain(input=..., output=...) takes the arguments
+# of a call and reports what would run and what it would cost. CDO is only
+# asked for the metadata of input files (sinfo), the chain itself never runs.
+# Run times come from earlier calls of the same Cdo object under a memory
+# budget, see memory.py; without them they are unknown (None).
+
+
+def humanSize(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(size) < 1024 or 'TiB' == unit:
+            return ('%d %s' if 'B' == unit else '%.1f %s') % (size, unit)
+        size /= 1024.0
+
+
+def humanTime(seconds):
+    return '?' if seconds is None else '%.2fs' % seconds
+
+
+class ChainPlan(dict):
+    """Report of explain(): a dict which prints as a table"""
+
+    def __str__(self):
+        lines = ['command: ' + self['command']]
+        if self['tempFiles']:
+            lines.append('temp files: ' + ' '.join(self['tempFiles']))
+        lines.append('operators:')
+        for op in self['operators']:
+            lines.append('  %-20s inputs %2d  outputs %2d' % (op['operator'], op['inputs'], op['outputs']))
+        if self['stages']:
+            lines.append('stages (in order of execution):')
+            for stage in self['stages']:
+                lines.append('  %-30s read %10s  write %10s  memory %10s  runtime %s' % (
+                    stage['operator'], humanSize(stage['read']), humanSize(stage['written']),
+                    humanSize(stage['memory']), humanTime(stage['runtime'])))
+            lines.append('total: volume %s, output %s, peak memory %s, runtime %s' % (
+                humanSize(self['volume']), humanSize(self['output']),
+                humanSize(self['memory']), humanTime(self['runtime'])))
+        else:
+            lines.append('no estimates: the chain could not be parsed')
+        return '\n'.join(lines)
+
+
+def explainChain(cdo, args, kwargs):
+    """Plan of cdo(*args, **kwargs) without running it, see Cdo.explain()"""
+    from .memory import MemoryEstimator
+    from .parallel import parseChain, checkpointNodes, checkpointFile, isOperator, operatorName
+
+    kwargs = dict(kwargs)
+    chain = cdo
+    if args:
+        chain = cdo._withCmd(cdo._cmd[:-1] + (cdo._cmd[-1] + ',' + ','.join(map(str, args)),))
+    name = chain._operatorName()
+    if not name:
+        raise ValueError("Nothing to explain: the chain has no operators!")
+    placeholder = os.path.join(cdo.tempStore.dir, cdo.tempStore.fileTag + 'XXXXXXXX')
+
+    tempFiles = []
+    # in-memory datasets would be written to a temporary input file
+    if hasattr(kwargs.get('input'), 'to_netcdf'):
+        kwargs['input'] = placeholder
+        tempFiles.append(placeholder)
+    cmd = chain._buildCmd(kwargs)
+
+    outputs = []
+    if kwargs.get('output') is not None:
+        outputs = kwargs['output'].split()
+    elif 0 < cdo.operators.get(name, 1):
+        outputs = [placeholder] * cdo.operators[name]
+        tempFiles.extend(outputs)
+    argv = shlex.split(' '.join(cmd + outputs))
+
+    tokens = [t for t in argv[1:] if t not in outputs]
+    first = next((i for i, t in enumerate(tokens)
+                  if isOperator(t) and operatorName(t) in cdo.operators), len(tokens))
+    operators = [{'operator': operatorName(t),
+                  'parameters': t.split(',')[1:],
+                  'inputs': cdo.operatorInputs.get(operatorName(t), 1),
+                  'outputs': cdo.operators[operatorName(t)]}
+                 for t in tokens[first:] if isOperator(t) and operatorName(t) in cdo.operators]
+
+    # results of checkpointed segments are kept in the tempdir
+    if kwargs.get('checkpoints'):
+        try:
+            root = parseChain(cdo, tokens[first:])
+            tempFiles.extend(checkpointFile(cdo, node)
+                             for node in checkpointNodes(root, kwargs['checkpoints']))
+        except ValueError:
+            pass
+
+    estimator = cdo.memoryEstimator or MemoryEstimator(cdo)
+    estimate = estimator.estimate(cmd)
+    plan = ChainPlan(command=' '.join(cmd + outputs), argv=argv, operators=operators,
+                     tempFiles=tempFiles, stages=[], volume=None, output=None,
+                     memory=None, runtime=None)
+    if estimate is None:
+        return plan
+
+    runtime = estimator.runtime(estimate['key'], estimate['volume'])
+    for stage in estimate['stages']:
+        stage = dict(stage)
+        # telemetry of the single operator, else its share of the whole chain
+        stage['runtime'] = estimator.runtime((operatorName(stage['operator']),),
+                                             stage['read'] + stage['written'])
+        if stage['runtime'] is None and runtime is not None and estimate['volume']:
+            stage['runtime'] = runtime * (stage['read'] + stage['written']) / estimate['volume']
+        plan['stages'].append(stage)
+    plan.update(volume=estimate['volume'], output=estimate['output'],
+                memory=estimate['memory'], runtime=runtime)
+    return plan
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
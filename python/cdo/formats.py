@@ -0,0 +1,98 @@
+import six
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# output format of a call depending on who reads the result next
+
+# choice of format, precision, compression and chunking {{{
+class FormatPolicy(object):
+    """Choose the output options of a call by the consumer of its result
+
+    Consumers:
+      'numpy'  : returnArray, returnMaArray - whole variables are read at once
+      'xarray' : returnXArray, returnXDataset - lazy reads, field by field
+      'netcdf' : returnCdf
+      'cdo'    : temporary output, usually the input of the next call
+      'file'   : output given by the user - left as it is
+
+    A rule has the keys 'format' (-f), 'precision' (-b), 'compression' (-z)
+    and 'chunking' (-k, netCDF4 only). None keeps the default of CDO.
+    Options given by the user always win over the policy.
+    """
+
+    # uncompressed netCDF with 64bit offsets is read without any decoding and
+    # keeps all meta data. xarray reads field by field, hence one chunk per field
+    rules = {
+        'numpy':  {'format': 'nc2', 'precision': None, 'compression': None, 'chunking': None},
+        'xarray': {'format': 'nc4', 'precision': None, 'compression': None, 'chunking': 'grid'},
+        'netcdf': {'format': 'nc2', 'precision': None, 'compression': None, 'chunking': None},
+        'cdo':    {'format': 'nc2', 'precision': None, 'compression': None, 'chunking': None},
+        'file':   {'format': None,  'precision': None, 'compression': None, 'chunking': None},
+    }
+
+    flags = {'format': '-f', 'precision': '-b', 'compression': '-z', 'chunking': '-k'}
+
+    def __init__(self, rules=None):
+        self.rules = {consumer: dict(rule) for consumer, rule in self.rules.items()}
+        for consumer, rule in (rules or {}).items():
+            self.rules.setdefault(consumer, dict(self.rules['file'])).update(rule)
+
+    @staticmethod
+    def consumer(kwargs):
+        """Return the consumer of the result of a call with the given kwargs"""
+        if kwargs.get('returnArray') is not None or kwargs.get('returnMaArray') is not None:
+            return 'numpy'
+        if kwargs.get('returnXArray') is not None or kwargs.get('returnXDataset'):
+            return 'xarray'
+        if kwargs.get('returnCdf'):
+            return 'netcdf'
+        if kwargs.get('output') is None:
+            return 'cdo'
+        return 'file'
+
+    def rule(self, consumer, override=None):
+        rule = dict(self.rules.get(consumer, self.rules['file']))
+        rule.update(override or {})
+        return rule
+
+    def options(self, consumer, userOptions=(), override=None, netcdf4=True):
+        """Return the CDO options for a consumer
+
+        userOptions: options of the call, flags given here are not set again
+        override:    dict with parts of a rule for this call only
+        netcdf4:     False if CDO has no netCDF4 support
+        """
+        rule = self.rule(consumer, override)
+        given = ' '.join(userOptions).split()
+
+        if not netcdf4 and rule.get('format') in ('nc4', 'nc4c'):
+            rule['format'], rule['compression'] = 'nc2', None
+        if rule.get('format') not in ('nc4', 'nc4c'):
+            rule['chunking'] = None
+
+        options = []
+        for key in ('format', 'precision', 'compression', 'chunking'):
+            flag, value = self.flags[key], rule.get(key)
+            if value is not None and flag not in given:
+                options.extend([flag, value])
+        return options
+
+
+def toPolicy(value):
+    """Return a FormatPolicy for the formatPolicy argument of Cdo
+
+    True selects the default policy, a dict overrides parts of its rules
+    """
+    if value is True:
+        return FormatPolicy()
+    if isinstance(value, dict):
+        return FormatPolicy(value)
+    if isinstance(value, six.string_types):
+        raise ValueError("Unknown formatPolicy '%s'!" % value)
+    return value or None
+# }}}
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
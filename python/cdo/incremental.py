@@ -0,0 +1,177 @@
+import os
+import json
+import hashlib
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# make-style incremental recomputation: every output written in incremental
+# mode gets a sidecar manifest holding the normalized command and the state of
+# all input files. A call is skipped only if the manifest still matches.
+
+ManifestSuffix = '.cdo.json'
+
+# options which do not change the content of an output {{{
+VolatileOptions = ['-O', '-s']
+VolatileOptionsWithValue = ['-P']
+
+
+def normalizedCommand(cmd, outputs):
+    """Return the command tokens without output names and volatile options"""
+    tokens = ' '.join(cmd).split()
+    normalized, skip = [], False
+    for token in tokens[1:]:
+        if skip:
+            skip = False
+        elif token in VolatileOptions or token in outputs:
+            continue
+        elif token in VolatileOptionsWithValue:
+            skip = True
+        else:
+            normalized.append(token)
+    return normalized
+# }}}
+
+# input files: plain tokens and file parameters of operators {{{
+def inputFiles(tokens, outputs):
+    candidates = []
+    for token in tokens:
+        if token.startswith('-'):
+            candidates.extend(token.split(',')[1:])
+        else:
+            candidates.append(token)
+    files = []
+    for candidate in candidates:
+        candidate = candidate.strip('\'"')
+        if candidate not in outputs and candidate not in files and os.path.isfile(candidate):
+            files.append(candidate)
+    return files
+
+
+def fileHash(path, blockSize=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fileState(path, hashing=False):
+    stat = os.stat(path)
+    state = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+    if hashing:
+        state['sha1'] = fileHash(path)
+    return state
+# }}}
+
+# manifest handling {{{
+def manifestPath(output):
+    return output + ManifestSuffix
+
+
+def callManifest(cmd, outputs, hashing=False):
+    """Create the manifest of a call from its command line (without outputs)"""
+    command = normalizedCommand(cmd, outputs)
+    return {
+        'command': command,
+        'inputs': [fileState(f, hashing) for f in inputFiles(command, outputs)],
+    }
+
+
+def readManifest(output):
+    try:
+        with open(manifestPath(output), 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def writeManifest(output, manifest):
+    # write to a temporary file first: a crash leaves no half written manifest
+    path = manifestPath(output)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def isUpToDate(output, manifest):
+    """True if output exists and was created by the same call from unchanged inputs
+
+    Inputs are compared by their hash if both manifests have one, otherwise by
+    size and modification time.
+    """
+    if not os.path.isfile(output):
+        return False
+    stored = readManifest(output)
+    if stored is None or stored.get('command') != manifest['command']:
+        return False
+    if len(stored.get('inputs', [])) != len(manifest['inputs']):
+        return False
+    for old, new in zip(stored['inputs'], manifest['inputs']):
+        if old['path'] != new['path']:
+            return False
+        if 'sha1' in old and 'sha1' in new:
+            if old['sha1'] != new['sha1']:
+                return False
+        elif old['size'] != new['size'] or old['mtime'] != new['mtime']:
+            return False
+    return True
+# }}}
+
+# pipeline of incremental calls {{{
+class Pipeline(object):
+    """Ordered list of CDO calls which only rebuilds outdated outputs
+
+    pipe = Pipeline(cdo)
+    pipe.add(cdo.timmean, input='data.nc', output='mean.nc')
+    pipe.add(cdo.sub, input='data.nc mean.nc', output='anomaly.nc')
+    pipe.run()
+
+    A step is outdated if its manifest does not match or if it reads the
+    output of another outdated step.
+    """
+
+    def __init__(self, cdo, hashing=False):
+        self.cdo = cdo
+        self.mode = 'hash' if hashing else True
+        self.steps = []
+
+    def add(self, chain, *args, **kwargs):
+        if kwargs.get('output') is None:
+            raise ValueError("Pipeline steps need an 'output'!")
+        self.steps.append((chain, args, kwargs))
+        return self
+
+    def __stepManifest(self, chain, args, kwargs):
+        chain = chain(*args) if args else chain
+        cmd = chain._buildCmd(dict(kwargs))
+        # outputs of earlier steps may still be delivered by write-behind
+        if self.cdo.writeBehind:
+            self.cdo.writeBehind.waitFor(cmd, [kwargs['output']])
+        return callManifest(cmd, [kwargs['output']], hashing='hash' == self.mode)
+
+    def outdated(self):
+        """Return the outputs which would be rebuilt by run()"""
+        outdated = []
+        for chain, args, kwargs in self.steps:
+            tokens = normalizedCommand(chain._buildCmd(dict(kwargs)), [])
+            readsOutdated = any(f in outdated for f in tokens)
+            if readsOutdated or \
+               not isUpToDate(kwargs['output'], self.__stepManifest(chain, args, kwargs)):
+                outdated.append(kwargs['output'])
+        return outdated
+
+    def run(self):
+        """Run all steps in order and return the rebuilt outputs"""
+        rebuilt = []
+        for chain, args, kwargs in self.steps:
+            upToDate = isUpToDate(kwargs['output'], self.__stepManifest(chain, args, kwargs))
+            chain(*args, **dict(kwargs, incremental=self.mode, returnResult=False))
+            if not upToDate:
+                rebuilt.append(kwargs['output'])
+        return rebuilt
+# }}}
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
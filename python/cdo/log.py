@@ -0,0 +1,147 @@
+import atexit
+import random
+import threading
+import collections
+import logging as pyLog
+import logging.handlers
+
+import six
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# logging of CDO calls: all Cdo objects of a process share one queue. The call
+# path only puts a record into the queue, a single listener thread writes it to
+# the log file (or stream) of the Cdo object and keeps the last records in a
+# bounded in-memory buffer for collectLogs().
+
+LogFormat = '%(asctime)s - %(levelname)s - %(message)s'
+LogBufferSize = 1000
+
+_lock = threading.Lock()
+_queue = None
+_listener = None
+_queueHandler = None
+_targets = {}   # log target -> (file or stream handler, buffer)
+
+
+# handlers of the listener thread {{{
+class LogBuffer(pyLog.Handler):
+    """Keep the last formatted records in memory"""
+
+    def __init__(self, size=LogBufferSize):
+        pyLog.Handler.__init__(self)
+        self.lines = collections.deque(maxlen=size)
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+    def getvalue(self):
+        return ''.join(line + '\n' for line in list(self.lines))
+
+
+class TargetHandler(pyLog.Handler):
+    """Pass records to the handlers of their log target"""
+
+    def emit(self, record):
+        for handler in _targets.get(getattr(record, 'logTarget', None), ()):
+            handler.handle(record)
+# }}}
+
+
+# logger of a Cdo object {{{
+class CdoLogger(pyLog.LoggerAdapter):
+    """Add the log target of a Cdo object (and other fields) to its records"""
+
+    def __init__(self, logger, target, sampling=1.0):
+        pyLog.LoggerAdapter.__init__(self, logger, {'logTarget': target})
+        self.sampling = sampling
+
+    def process(self, msg, kwargs):
+        kwargs['extra'] = dict(self.extra, **kwargs.get('extra', {}))
+        return msg, kwargs
+
+    def call(self, cmd, duration, returncode):
+        """Structured record of a CDO call: command, duration and return code
+
+        With sampling < 1 only this fraction of the successful calls is logged
+        """
+        if 0 == returncode and self.sampling < 1.0 and random.random() >= self.sampling:
+            return
+        command = ' '.join(cmd)
+        level = pyLog.INFO if 0 == returncode else pyLog.WARNING
+        self.log(level, u'%s [%.3fs, returncode %s]', command, duration, returncode,
+                 extra={'command': command, 'duration': duration, 'returncode': returncode})
+# }}}
+
+
+def startListener(logger):
+    """Start the queue and its listener once per process"""
+    global _queue, _listener, _queueHandler
+    if _listener is None:
+        _queue = six.moves.queue.Queue(-1)
+        _listener = pyLog.handlers.QueueListener(_queue, TargetHandler())
+        _listener.start()
+        _queueHandler = pyLog.handlers.QueueHandler(_queue)
+        logger.addHandler(_queueHandler)
+
+
+def stop():
+    """Write all queued records, stop the listener and close the log files
+
+    Called at exit. Cdo objects created afterwards start logging again.
+    """
+    global _queue, _listener, _queueHandler
+    with _lock:
+        if _listener is not None:
+            # the listener handles the queued records before it stops
+            _listener.stop()
+            pyLog.getLogger('cdo.cdo').removeHandler(_queueHandler)
+        for handler, buffer in _targets.values():
+            handler.flush()
+            handler.close()
+        _targets.clear()
+        _queue = _listener = _queueHandler = None
+
+
+atexit.register(stop)
+
+
+def setupLogging(logFile, sampling=1.0):
+    """Return the logger of a Cdo object writing to logFile (path or stream)"""
+    logger = pyLog.getLogger('cdo.cdo')
+    logger.setLevel(pyLog.INFO)
+
+    target = logFile if isinstance(logFile, six.string_types) else id(logFile)
+    with _lock:
+        startListener(logger)
+        if target not in _targets:
+            if isinstance(logFile, six.string_types):
+                handler = pyLog.FileHandler(logFile)
+            else:
+                handler = pyLog.StreamHandler(stream=logFile)
+            handler.setFormatter(pyLog.Formatter(LogFormat))
+            buffer = LogBuffer()
+            buffer.setFormatter(pyLog.Formatter(LogFormat))
+            _targets[target] = (handler, buffer)
+
+    return CdoLogger(logger, target, sampling)
+
+
+def flush():
+    """Wait until the listener has handled all queued records"""
+    if _queue is not None:
+        _queue.join()
+    for handler, buffer in list(_targets.values()):
+        handler.flush()
+
+
+def collectLogs(logger):
+    """Return the buffered records of the log target of a logger"""
+    flush()
+    target = _targets.get(logger.extra['logTarget'])
+    return target[1].getvalue() if target is not None else ''
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
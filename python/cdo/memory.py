@@ -0,0 +1,311 @@
+import os
+import re
+import sys
+import math
+import time
+import threading
+import subprocess
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# estimates of the peak memory and output size of a chain from the metadata
+# of its inputs. CDO streams timesteps through the chain, so every operator
+# holds about one timestep of its input and output, plus accumulators (time
+# statistics), all timesteps (operators working on whole time series) or
+# remapping weights. Estimates are scaled by the ratio of measured peak RSS
+# and estimate of earlier calls with the same operators.
+
+# fixed memory of a CDO process
+BaseMemory = 32 * 2**20
+
+# bytes per value in files by CDO's data types (P* is GRIB packing)
+DataTypeBytes = {'F32': 4, 'F64': 8, 'I8': 1, 'I16': 2, 'I32': 4,
+                 'U8': 1, 'U16': 2, 'U32': 4, 'C32': 8, 'C64': 16}
+
+# number of links per target point of remapping methods
+RemapWeights = {'bil': 4, 'bic': 16, 'nn': 1, 'dis': 4, 'con': 8, 'con2': 8,
+                'ycon': 8, 'laf': 8}
+
+# operators which keep all timesteps of their input
+WholeSeriesOperators = {'detrend', 'timsort', 'timpctl', 'timselpctl', 'ydaypctl',
+                        'ymonpctl', 'yseaspctl', 'runpctl', 'eof', 'eoftime',
+                        'eofspatial', 'eof3d', 'inttime', 'intntime', 'shifttime'}
+
+# operators creating data on a grid given as first parameter
+GeneratorOperators = {'topo', 'const', 'random', 'stdatm'}
+
+# output timesteps of time statistics (prefix: timesteps)
+TimeStatistics = {'tim': 1, 'ymon': 12, 'yday': 366, 'yseas': 4, 'yhour': 8784}
+
+
+# metadata of files {{{
+def emptyShape():
+    return {'gridsize': 0, 'nlevel': 0, 'nvar': 0, 'ntime': 0, 'points': 0, 'bytes': 4}
+
+
+def parseSinfo(lines):
+    """Shape of a file from the output of 'cdo sinfo'"""
+    shape = emptyShape()
+    for line in lines:
+        # '  1 : unknown  unknown  v instant  1   1   64800   1  F32  : topo'
+        var = re.search(r'\s(\d+)\s+\d+\s+(\d+)\s+\d+\s+([A-Z]+\d+)\s+:', line)
+        if var and re.match(r'\s*\d+ :', line):
+            levels, gridsize = int(var.group(1)), int(var.group(2))
+            shape['nvar'] += 1
+            shape['nlevel'] = max(shape['nlevel'], levels)
+            shape['gridsize'] = max(shape['gridsize'], gridsize)
+            shape['points'] += levels * gridsize
+            shape['bytes'] = max(shape['bytes'], DataTypeBytes.get(var.group(3), 8))
+        steps = re.search(r'(\d+) steps?', line)
+        if steps:
+            shape['ntime'] = int(steps.group(1))
+    shape['ntime'] = max(shape['ntime'], 1)
+    return shape
+
+
+def volume(shape):
+    """Bytes of all timesteps of a shape"""
+    return shape['points'] * shape['ntime'] * shape['bytes']
+
+
+def gridPoints(spec, shapeOf=None):
+    """Number of points of a grid given like CDO does: r360x180, global_0.5, n80, file"""
+    match = re.match(r'^r(\d+)x(\d+)$', spec)
+    if match:
+        return int(match.group(1)) * int(match.group(2))
+    match = re.match(r'^global_([\d.]+)$', spec)
+    if match:
+        inc = float(match.group(1))
+        return int(round(360 / inc)) * int(round(180 / inc))
+    match = re.match(r'^[nF](\d+)$', spec)
+    if match:
+        return 8 * int(match.group(1)) ** 2
+    if os.path.isfile(spec):
+        # grid description (text) or data file
+        with open(spec, 'rb') as f:
+            head = f.read(4096)
+        match = re.search(br'gridsize\s*=\s*(\d+)', head)
+        if match:
+            return int(match.group(1))
+        if shapeOf is not None:
+            return shapeOf(spec)['gridsize'] or None
+    return None
+# }}}
+
+
+class MemoryEstimator(object):
+    """Predict peak memory and output size of CDO calls
+
+    Metadata of inputs is cached per (path, mtime, size). observe() refines
+    the estimates of a chain (its operator names) with the measured peak RSS.
+    """
+
+    def __init__(self, cdo, weight=0.5):
+        self.cdo = cdo
+        self.weight = weight
+        self._lock = threading.Lock()
+        self._metadata = {}   # (path, mtime, size) -> shape
+        self._ratios = {}     # operator names -> measured / estimated
+        self._rates = {}      # operator names -> seconds per byte
+
+    def metadata(self, path):
+        """Shape of a file: gridsize, nlevel, nvar, ntime, points per timestep, bytes"""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+        with self._lock:
+            if key in self._metadata:
+                return dict(self._metadata[key])
+        # the estimator's own calls are not budgeted
+        info = self.cdo._withCmd(())
+        info.memoryBudget = None
+        shape = parseSinfo(info.sinfo(input=path))
+        with self._lock:
+            self._metadata[key] = shape
+        return dict(shape)
+
+    # shape of the result of a node and memory used by its operator {{{
+    def __inputShape(self, node, stages):
+        if node.isOperator():
+            return self.__estimate(node, stages)
+        if os.path.isfile(node.token):
+            return self.metadata(node.token), 0
+        return emptyShape(), 0
+
+    def __estimate(self, node, stages):
+        from .parallel import operatorName
+        name = operatorName(node.token)
+        params = node.token.split(',')[1:]
+        inputs = [self.__inputShape(child, stages) for child in node.children]
+        below = sum(m for s, m in inputs)
+        memory = 0
+        shapes = [s for s, m in inputs]
+        inputPoints = sum(s['points'] for s in shapes)
+        shape = dict(shapes[0]) if shapes else emptyShape()
+
+        if name in ('seq', 'for'):
+            shape.update(gridsize=1, nlevel=1, nvar=1, ntime=1, points=1, bytes=8)
+        elif name in GeneratorOperators:
+            gridsize = gridPoints(params[0], self.metadata) if params else None
+            gridsize = gridsize or 360 * 180
+            shape.update(gridsize=gridsize, nlevel=1, nvar=1, ntime=1, points=gridsize, bytes=4)
+        elif name.startswith(('remap', 'gen')) and params:
+            gridsize = gridPoints(params[0], self.metadata)
+            if gridsize and shape['gridsize']:
+                shape['points'] = shape['points'] * gridsize // shape['gridsize']
+                shape['gridsize'] = gridsize
+                method = name[5:] if name.startswith('remap') else name[3:]
+                memory += gridsize * RemapWeights.get(method, 4) * 24
+        elif name in ('mergetime', 'cat', 'copy') and shapes:
+            shape['ntime'] = sum(s['ntime'] for s in shapes)
+        elif name == 'merge' and shapes:
+            shape.update(nvar=sum(s['nvar'] for s in shapes), points=inputPoints)
+        elif name in ('selname', 'selvar', 'selcode', 'selparam') and shape['nvar']:
+            shape['points'] = shape['points'] * min(len(params), shape['nvar']) // shape['nvar']
+            shape['nvar'] = min(len(params), shape['nvar'])
+        elif name in ('sellevel', 'sellevidx') and shape['nlevel']:
+            shape['points'] = shape['points'] * min(len(params), shape['nlevel']) // shape['nlevel']
+            shape['nlevel'] = min(len(params), shape['nlevel'])
+        elif name.startswith('fld'):
+            shape['points'] = shape['points'] // max(shape['gridsize'], 1)
+            shape['gridsize'] = 1
+        elif name.startswith(('zon', 'mer')) and shape['gridsize']:
+            lines = int(math.sqrt(shape['gridsize'] * 2))
+            shape['points'] = shape['points'] * lines // shape['gridsize']
+            shape['gridsize'] = lines
+        elif name.startswith('vert') and shape['nlevel']:
+            shape['points'] = shape['points'] // shape['nlevel']
+            shape['nlevel'] = 1
+
+        # one timestep of all inputs and of the output, in double precision
+        memory += 8 * (inputPoints + shape['points'])
+        prefixes = [p for p in TimeStatistics if name.startswith(p)]
+        if prefixes:
+            shape['ntime'] = min(shape['ntime'], TimeStatistics[max(prefixes, key=len)])
+            # accumulators of each output timestep
+            memory += 8 * 3 * shape['ntime'] * shape['points']
+        if name in WholeSeriesOperators:
+            memory += 8 * sum(s['ntime'] * s['points'] for s in shapes)
+        stages.append({'operator': node.token, 'shape': shape, 'memory': memory,
+                       'read': sum(volume(s) for s in shapes), 'written': volume(shape)})
+        return shape, below + memory
+    # }}}
+
+    def estimateChain(self, tokens, options=()):
+        """Estimate of chain tokens (operators and inputs, no outputs)
+
+        Returns a dict with 'memory' (peak bytes, refined by measurements),
+        'raw' (before refinement), 'output' (bytes of the result), 'shape',
+        'key' (the operator names), 'stages' (per operator: shape, memory,
+        bytes read and written) and 'volume' (bytes read and written by all)
+        """
+        from .parallel import parseChain, operatorsOf
+        root = parseChain(self.cdo, list(tokens))
+        stages = []
+        shape, raw = self.__inputShape(root, stages)
+        # '-b F64' changes the data type of the output
+        options = list(options)
+        if '-b' in options[:-1]:
+            shape['bytes'] = DataTypeBytes.get(options[options.index('-b') + 1].upper(), shape['bytes'])
+        raw += BaseMemory
+        key = tuple(operatorsOf(tokens))
+        with self._lock:
+            ratio = self._ratios.get(key, 1.0)
+        return {'memory': int(raw * ratio), 'raw': raw, 'output': volume(shape),
+                'shape': shape, 'key': key, 'stages': stages,
+                'volume': sum(stage['read'] + stage['written'] for stage in stages)}
+
+    def estimate(self, cmd, outputs=()):
+        """Estimate of a CDO command line (see estimateChain), None if unknown"""
+        from .parallel import isOperator, operatorName, chainTokens
+        try:
+            # operators may be quoted for the shell
+            tokens = [t for t in chainTokens(' '.join(cmd[1:])) if t not in ' '.join(outputs).split()]
+        except ValueError:
+            return None
+        first = next((i for i, t in enumerate(tokens)
+                      if isOperator(t) and operatorName(t) in self.cdo.operators), None)
+        if first is None:
+            return None
+        try:
+            return self.estimateChain(tokens[first:], tokens[:first])
+        except (ValueError, IndexError, OSError):
+            return None
+
+    def __update(self, values, key, value):
+        # caller holds the lock: moving average of measurements
+        previous = values.get(key)
+        values[key] = value if previous is None else \
+            self.weight * value + (1 - self.weight) * previous
+
+    def observe(self, estimate, maxrss, duration=None):
+        """Refine the estimates of a chain with its measured peak memory and run time"""
+        if not estimate:
+            return
+        with self._lock:
+            if maxrss:
+                self.__update(self._ratios, estimate['key'], float(maxrss) / estimate['raw'])
+            if duration is not None and estimate['volume']:
+                self.__update(self._rates, estimate['key'], duration / estimate['volume'])
+
+    def ratios(self):
+        """Measured / estimated memory by operator names"""
+        with self._lock:
+            return dict(self._ratios)
+
+    def runtime(self, key, volume):
+        """Seconds for processing volume bytes with the given operators, None if unknown"""
+        with self._lock:
+            rate = self._rates.get(tuple(key))
+        return None if rate is None else rate * volume
+
+
+# peak memory of a finished child process {{{
+class MeasuredProcess(object):
+    """communicate() for a Popen object, which keeps the peak RSS in maxrss (bytes)
+
+    The pipes are read by threads and the child is reaped with os.wait4, so
+    its resource usage, which includes the children of the shell running
+    CDO, is not lost in Popen.wait. communicate() can be called again after a
+    timeout, e.g. once the process has been killed.
+    """
+
+    maxrss = None
+
+    def __init__(self, proc):
+        self.proc = proc
+        self._output = {}
+        self._readers = [threading.Thread(target=self.__read, args=(name, pipe), daemon=True)
+                         for name, pipe in (('stdout', proc.stdout), ('stderr', proc.stderr))]
+        for reader in self._readers:
+            reader.start()
+
+    def __read(self, name, pipe):
+        try:
+            self._output[name] = pipe.read()
+        finally:
+            pipe.close()
+
+    def communicate(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        for reader in self._readers:
+            reader.join(None if deadline is None else max(0, deadline - time.time()))
+            if reader.is_alive():
+                raise subprocess.TimeoutExpired(self.proc.args, timeout)
+        if self.proc.returncode is None:
+            try:
+                pid, status, usage = os.wait4(self.proc.pid, 0)
+            except ChildProcessError:
+                # reaped by Popen (e.g. poll() from another thread): it has
+                # the status, the usage is lost
+                self.proc.wait()
+            else:
+                self.maxrss = usage.ru_maxrss * (1 if 'darwin' == sys.platform else 1024)
+                self.proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) \
+                    else os.WEXITSTATUS(status)
+        return self._output.get('stdout', b''), self._output.get('stderr', b'')
+# }}}
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
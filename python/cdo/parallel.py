@@ -0,0 +1,514 @@
+import os
+import math
+import shlex
+import hashlib
+import shutil
+import tempfile
+import concurrent.futures
+
+import six
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# parallel execution modes for Cdo chains: every mode runs the same chain on
+# independent pieces of the input in a pool of workers. Each worker only waits
+# for its own CDO child process, so a thread pool is enough to keep several
+# CDO processes busy at the same time.
+
+# helpers for handling chains {{{
+def chainTokens(expression):
+    """Split a CDO chain expression into its tokens (quotes are removed)"""
+    if isinstance(expression, (list, tuple)):
+        tokens = []
+        for item in expression:
+            tokens.extend(chainTokens(item))
+        return tokens
+    return shlex.split(os.fspath(expression))
+
+
+def chainString(tokens):
+    """Join chain tokens to a string which can be passed to the shell"""
+    return ' '.join(shlex.quote(token) for token in tokens)
+
+
+def isOperator(token):
+    return token.startswith('-') and 1 < len(token) and token[1].isalpha()
+
+
+def operatorName(token):
+    return token[1:].split(',')[0]
+
+
+def operatorsOf(tokens):
+    """Return the names of all operators in the given chain tokens"""
+    return [operatorName(token) for token in tokens if isOperator(token)]
+
+
+def inputExpression(cdo, kwargs):
+    """Return the 'input' of a call as a single chain expression"""
+    if 'input' not in kwargs or kwargs['input'] is None:
+        raise ValueError("An input is needed for parallel execution!")
+    _input = kwargs['input']
+    if isinstance(_input, six.string_types) or isinstance(_input, (list, tuple)):
+        return chainString(chainTokens(_input))
+    if hasattr(_input, '__fspath__'):
+        return chainString([os.fspath(_input)])
+    raise ValueError("Parallel execution needs file or chain input, got '%s'" % type(_input))
+
+
+def splitRange(total, pieces):
+    """Split 1..total into at most 'pieces' contiguous (first, last) ranges"""
+    if total < 1:
+        return []
+    pieces = max(1, min(int(pieces), total))
+    size, rest = divmod(total, pieces)
+    ranges, first = [], 1
+    for i in range(pieces):
+        last = first + size - 1 + (1 if i < rest else 0)
+        ranges.append((first, last))
+        first = last + 1
+    return ranges
+
+
+# keywords of the internal calls of a mode: their outputs are temporary files,
+# which are read right away, so they are never written behind and always
+# returned as plain paths, whatever Cdo(returnResults=...) says
+def internalKwargs(kwargs, keys=('options', 'env', 'timeout')):
+    internal = {k: v for k, v in kwargs.items() if k in keys}
+    internal['writeBehind'] = False
+    internal['returnResult'] = False
+    return internal
+
+
+def runInPool(func, items, workers, chain):
+    """Call func on every item in a pool of threads, keep the order of items
+
+    If one call fails (or the caller is interrupted), all pending calls are
+    dropped and the running CDO processes of the given chain are killed.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(func, item) for item in items]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            chain.cancel()
+            raise
+
+
+def removeFiles(files):
+    for f in files:
+        if hasattr(f, '__fspath__'):
+            f = os.fspath(f)
+        if isinstance(f, six.string_types) and os.path.isfile(f):
+            os.remove(f)
+# }}}
+
+# time-chunked execution {{{
+def checkTimeChunkable(cdo, chain):
+    names = operatorsOf(chain._cmd)
+    if not names:
+        raise ValueError("No operator given for time-chunked execution!")
+    unsafe = [op for op in names if op not in cdo.TimeChunkOperators]
+    if unsafe:
+        raise ValueError("Operator(s) '%s' cannot be chunked by time!" % ', '.join(unsafe))
+    if 1 != cdo.operators.get(names[0]):
+        raise ValueError("Only operators with one output can be chunked by time!")
+    # expr has access to the absolute timestep, which is local in a chunk
+    for token in chain._cmd:
+        if isOperator(token) and operatorName(token) in ('expr', 'aexpr') \
+           and 'ctimestep' in token:
+            raise ValueError("Expressions with 'ctimestep' cannot be chunked by time!")
+
+
+def timeSelection(cdo, expression):
+    """Return a function to create per-chunk inputs and the number of timesteps
+
+    Timestep selection is done directly on the input file if the input chain
+    is linear and consists of time-local operators only. Otherwise the
+    selection is put in front of the complete input expression.
+    """
+    tokens = chainTokens(expression)
+    files = [t for t in tokens if not isOperator(t)]
+    inputOps = [t for t in tokens if isOperator(t)]
+    pushDown = 1 == len(files) and tokens[-1] == files[0] and \
+        all(operatorName(op) in cdo.TimeChunkOperators and
+            1 == cdo.operators.get(operatorName(op)) for op in inputOps)
+
+    if pushDown:
+        nSteps = int(cdo._newChain().ntime(input=chainString(files))[0])
+
+        def select(first, last):
+            return chainString(tokens[:-1] + ['-seltimestep,%d/%d' % (first, last), files[0]])
+    else:
+        nSteps = int(cdo._newChain().ntime(input=expression)[0])
+
+        def select(first, last):
+            return '-seltimestep,%d/%d %s' % (first, last, expression)
+
+    return select, nSteps
+
+
+def runTimeChunked(cdo, args, kwargs):
+    """Run a chain on timestep ranges of the input and concatenate the results"""
+    kwargs = dict(kwargs)
+    nChunks = int(kwargs.pop('timeChunks'))
+    workers = kwargs.pop('workers', None) or nChunks
+
+    chain = (cdo(*args) if args else cdo)._withOwnProcesses()
+    checkTimeChunkable(cdo, chain)
+
+    # keep existing output if requested
+    force = kwargs.get('force', cdo.forceOutput)
+    if not force and kwargs.get('output') is not None and os.path.isfile(kwargs['output']):
+        return chain(**kwargs)
+
+    expression = inputExpression(cdo, kwargs)
+    select, nSteps = timeSelection(cdo, expression)
+    # nothing to split: CDO reports empty inputs
+    if nSteps < 1:
+        return chain(**kwargs)
+
+    # chunks are written to temporary files, final output and return values
+    # are handled by the concatenation
+    chunkKwargs = internalKwargs(kwargs)
+
+    def runChunk(timesteps):
+        return chain(input=select(*timesteps), **chunkKwargs)
+
+    chunkFiles = runInPool(runChunk, splitRange(nSteps, nChunks), workers, chain)
+
+    catKwargs = {k: v for k, v in kwargs.items() if k != 'input'}
+    try:
+        return cdo._newChain().cat(input=chunkFiles, **catKwargs)
+    finally:
+        removeFiles(chunkFiles)
+# }}}
+
+# spatial domain decomposition {{{
+def checkTileable(cdo, chain):
+    names = operatorsOf(chain._cmd)
+    if not names:
+        raise ValueError("No operator given for tiled execution!")
+    unsafe = [op for op in names if op not in cdo.SpatialTileOperators]
+    if unsafe:
+        raise ValueError("Operator(s) '%s' are not local in space!" % ', '.join(unsafe))
+    if 1 != cdo.operators.get(names[0]):
+        raise ValueError("Only operators with one output can be run on tiles!")
+    # expr can use horizontal statistics, which differ between tiles
+    for token in chain._cmd:
+        if isOperator(token) and operatorName(token) in ('expr', 'aexpr') \
+           and any(f in token for f in ('fld', 'zon', 'mer', 'gridarea', 'gridweight')):
+            raise ValueError("Expressions with horizontal statistics cannot be run on tiles!")
+
+
+def tileLayout(nTiles):
+    """Return (nx, ny) with nx*ny == nTiles and a shape as square as possible"""
+    nTiles = max(1, int(nTiles))
+    ny = int(math.sqrt(nTiles))
+    while nTiles % ny:
+        ny -= 1
+    return nTiles // ny, ny
+
+
+def numberOfTiles(cdo, kwargs, expression):
+    if kwargs.get('tiles'):
+        return int(kwargs['tiles'])
+    # memory target: based on the size of a plain input file
+    tokens = chainTokens(expression)
+    if 1 != len(tokens) or not os.path.isfile(tokens[0]):
+        raise ValueError("'tileMemory' needs a single input file, use 'tiles' instead!")
+    return max(1, int(math.ceil(os.path.getsize(tokens[0]) / float(kwargs['tileMemory']))))
+
+
+def runTiled(cdo, args, kwargs):
+    """Run a chain on horizontal tiles of the input and collect the results"""
+    kwargs = dict(kwargs)
+    expression = inputExpression(cdo, kwargs)
+    nTiles = numberOfTiles(cdo, kwargs, expression)
+    kwargs.pop('tiles', None)
+    kwargs.pop('tileMemory', None)
+    workers = kwargs.pop('workers', None) or nTiles
+
+    chain = (cdo(*args) if args else cdo)._withOwnProcesses()
+    checkTileable(cdo, chain)
+
+    # keep existing output if requested
+    force = kwargs.get('force', cdo.forceOutput)
+    if not force and kwargs.get('output') is not None and os.path.isfile(kwargs['output']):
+        return chain(**kwargs)
+
+    # distgrid writes its tiles into a private directory, so that exactly the
+    # tiles of this call are collected
+    tileDir = tempfile.mkdtemp(prefix=cdo.tempStore.fileTag, dir=cdo.tempStore.dir)
+    callKwargs = internalKwargs(kwargs)
+    tileOutputs = []
+    try:
+        nx, ny = tileLayout(nTiles)
+        cdo._newChain().distgrid(nx, ny, input=expression,
+                                 output=os.path.join(tileDir, 'tile'),
+                                 **callKwargs)
+        tiles = sorted(os.path.join(tileDir, f) for f in os.listdir(tileDir))
+
+        def runTile(tile):
+            return chain(input=tile, **callKwargs)
+
+        tileOutputs = runInPool(runTile, tiles, workers, chain)
+
+        # the tiles are collected in the layout they were split with
+        collKwargs = {k: v for k, v in kwargs.items() if k != 'input'}
+        return cdo._newChain().collgrid(nx, input=tileOutputs, **collKwargs)
+    finally:
+        removeFiles(tileOutputs)
+        shutil.rmtree(tileDir, ignore_errors=True)
+# }}}
+
+# checkpointed execution of long chains {{{
+class ChainNode(object):
+    """Operator (or file) in the tree of a chain with its input nodes"""
+
+    def __init__(self, token, children=()):
+        self.token = token
+        self.children = list(children)
+        self.file = None    # result file of a finished checkpoint
+
+    def isOperator(self):
+        return isOperator(self.token)
+
+    def tokens(self):
+        """Chain tokens of this subtree, finished checkpoints replaced by files"""
+        if self.file is not None:
+            return [self.file]
+        tokens = [self.token]
+        for child in self.children:
+            tokens.extend(child.tokens())
+        return tokens
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            for node in child.walk():
+                yield node
+
+
+def parseChain(cdo, tokens):
+    """Parse chain tokens into a tree using the input stream counts of CDO"""
+    if '[' in tokens or ']' in tokens:
+        raise ValueError("Chains with brackets cannot be checkpointed!")
+
+    def parse(i):
+        token = tokens[i]
+        if not isOperator(token):
+            return ChainNode(token), i + 1
+        nInputs = cdo.operatorInputs.get(operatorName(token), 1)
+        children, i = [], i + 1
+        # operators with a variable number of inputs take all remaining ones
+        while i < len(tokens) and (nInputs < 0 or len(children) < nInputs):
+            child, i = parse(i)
+            children.append(child)
+        return ChainNode(token, children), i
+
+    root, end = parse(0)
+    if end != len(tokens):
+        raise ValueError("Cannot parse chain '%s'" % chainString(tokens))
+    return root
+
+
+# number of operators which CDO pipes in one process between two automatic
+# checkpoints of a linear chain
+CheckpointSegment = 4
+
+
+def checkpointNodes(root, checkpoints):
+    """Select the operator nodes whose results are saved
+
+    'auto' (or True) selects the independent branches of multi-input
+    operators and splits linear chains into segments of CheckpointSegment
+    operators, which still run piped in one CDO process. Generators like -seq
+    or -topo are cheaper to rerun than to save. A list selects the nodes of the
+    given operators (names with or without parameters).
+    """
+    if checkpoints is True or 'auto' == checkpoints:
+        selected = []
+
+        def select(node, length):
+            # length: operators in the segment of node, node included
+            for child in node.children:
+                if not child.isOperator() or not child.children:
+                    continue
+                if len(node.children) > 1 or length >= CheckpointSegment:
+                    selected.append(child)
+                    select(child, 1)
+                else:
+                    select(child, length + 1)
+        select(root, 1)
+        return selected
+    return [node for node in root.walk()
+            if node is not root and node.isOperator()
+            and (operatorName(node.token) in checkpoints or node.token.lstrip('-') in checkpoints)]
+
+
+def checkpointFile(cdo, node, options=()):
+    """Name of the checkpoint file: depends on the chain, the options and the input files"""
+    digest = hashlib.sha1(chainString(list(options) + node.tokens()).encode('utf-8'))
+    for token in node.tokens():
+        if not isOperator(token) and os.path.isfile(token):
+            stat = os.stat(token)
+            digest.update(('%s:%s:%s' % (token, stat.st_size, stat.st_mtime)).encode('utf-8'))
+    return os.path.join(cdo.tempStore.dir,
+                        '%s_checkpoint_%s' % (cdo.tempStore.fileTag, digest.hexdigest()))
+
+
+def runCheckpointed(cdo, args, kwargs):
+    """Run a chain in segments, saving the result of each segment
+
+    Results of checkpoints are kept in the tempdir: a rerun after a failure
+    reuses all finished checkpoints. Checkpoints which do not depend on each
+    other run concurrently.
+    """
+    kwargs = dict(kwargs)
+    checkpoints = kwargs.pop('checkpoints')
+    workers = kwargs.pop('workers', None) or os.cpu_count()
+    keepCheckpoints = kwargs.pop('keepCheckpoints', False)
+
+    chain = (cdo(*args) if args else cdo)._withOwnProcesses()
+    tokens = list(chain._cmd)
+    if kwargs.get('input') is not None:
+        tokens += chainTokens(inputExpression(cdo, kwargs))
+    root = parseChain(cdo, tokens)
+    selected = checkpointNodes(root, checkpoints)
+
+    # checkpoints are run in waves: a checkpoint is ready if all checkpoints
+    # below it are finished
+    def depth(node):
+        return max([depth(n) + 1 for n in node.walk() if n is not node and n in selected] or [0])
+    waves = {}
+    for node in selected:
+        waves.setdefault(depth(node), []).append(node)
+
+    callKwargs = internalKwargs(kwargs)
+    # options like -f or -b change the saved results
+    options = list(chain._options) + kwargs.get('options', '').split()
+
+    def runCheckpoint(node):
+        target = checkpointFile(cdo, node, options)
+        if not os.path.isfile(target):
+            subChain = chain._withCmd(node.tokens()[:1])
+            subChain(input=chainString(node.tokens()[1:]), output=target + '.part',
+                     force=True, **callKwargs)
+            os.replace(target + '.part', target)
+        return target
+
+    files = []
+    for level in sorted(waves):
+        nodes = waves[level]
+        for node, target in zip(nodes, runInPool(runCheckpoint, nodes, workers, chain)):
+            node.file = target
+            files.append(target)
+
+    finalTokens = root.tokens()
+    kwargs['input'] = chainString(finalTokens[1:])
+    result = chain._withCmd(finalTokens[:1])(**kwargs)
+    if not keepCheckpoints:
+        removeFiles(files)
+    return result
+# }}}
+
+# tree reduction of long input lists {{{
+# groups of inputs are reduced by separate CDO calls: fan-in of a group, at
+# most this many inputs are open at the same time
+MaxFanIn = 256
+# the valid values of an input as 1, missing values as 0: the sum over the
+# members is the number of valid values used by ensmean
+CountExpression = '-setmisstoc,0 -addc,1 -mulc,0 %s'
+
+
+def commandLimit():
+    """Longest input list on a command line: the shell gets it as one argument"""
+    try:
+        limit = os.sysconf('SC_ARG_MAX')
+    except (ValueError, OSError, AttributeError):
+        limit = 131072
+    # linux limits each single argument to 32 pages
+    return min(limit, 32 * 4096) - 4096
+
+
+def exceedsCommandLine(inputs):
+    from .result import inputToken
+    return commandLimit() < sum(len(str(inputToken(item))) + 1 for item in inputs)
+
+
+def treeFanIn(inputs, workers):
+    """Enough groups to keep all workers busy, each group fits a command line"""
+    fanIn = min(MaxFanIn, int(math.ceil(len(inputs) / float(workers))))
+    longest = max(len(token) for token in inputs) + len(CountExpression) + 1
+    return max(2, min(fanIn, commandLimit() // longest))
+
+
+def runTreeReduced(cdo, args, kwargs):
+    """Reduce a long list of inputs in a tree of partial reductions
+
+    Groups of inputs are reduced in parallel, the results of the groups are
+    reduced again in groups until a single call combines the remaining ones.
+    ensmean is combined from the sums and the numbers of valid values.
+    """
+    from .result import inputToken
+    kwargs = dict(kwargs)
+    fanIn = kwargs.pop('treeReduce', None)
+    workers = kwargs.pop('workers', None) or os.cpu_count() or 1
+
+    chain = (cdo(*args) if args else cdo)._withOwnProcesses()
+    name = chain._operatorName()
+    if 1 != len(chain._cmd) or name not in cdo.TreeReduceOperators:
+        raise ValueError("Only single calls of %s can be reduced in a tree, not '%s'!"
+                         % (', '.join(sorted(cdo.TreeReduceOperators)), chainString(chain._cmd)))
+    items = kwargs.get('input')
+    items = items if isinstance(items, (list, tuple)) else [items]
+    inputs = chainTokens([inputToken(item) for item in items])
+    if any(isOperator(token) for token in inputs):
+        raise ValueError("Only plain input files can be reduced in a tree!")
+
+    # keep existing output if requested
+    force = kwargs.get('force', cdo.forceOutput)
+    if not force and kwargs.get('output') is not None and os.path.isfile(kwargs['output']):
+        return chain(**dict(kwargs, treeReduce=False))
+
+    fanIn = treeFanIn(inputs, workers) if fanIn in (True, None) else max(2, int(fanIn))
+    kwargs['treeReduce'] = False
+    if len(inputs) <= fanIn:
+        return chain(**kwargs)
+
+    # partial results are written to temporary files, final output and
+    # return values are handled by the last call
+    callKwargs = internalKwargs(kwargs, ('options', 'env', 'timeout', 'treeReduce'))
+    mean = 'ensmean' == name
+    reducer = chain._withCmd(('-enssum',)) if mean else chain
+    sums = inputs
+    counts = [CountExpression % token for token in inputs] if mean else []
+
+    def runGroup(group):
+        return reducer(input=group, **callKwargs)
+
+    files = []
+    try:
+        while len(sums) > (1 if mean else fanIn):
+            groups = [sums[i:i + fanIn] for i in range(0, len(sums), fanIn)]
+            groups += [counts[i:i + fanIn] for i in range(0, len(counts), fanIn)]
+            results = runInPool(runGroup, groups, workers, chain)
+            files.extend(results)
+            split = len(results) // 2 if mean else len(results)
+            sums, counts = results[:split], results[split:]
+        if mean:
+            kwargs['input'] = sums + counts
+            return cdo._newChain().div(**kwargs)
+        kwargs['input'] = sums
+        return chain(**kwargs)
+    finally:
+        removeFiles(files)
+# }}}
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -0,0 +1,136 @@
+import os
+import threading
+import weakref
+
+import six
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# result handles: with returnResult=True (or Cdo(returnResults=True)) calls
+# return CdoResult objects instead of file names. A result is path-like, so it
+# can be used wherever a file name is accepted, it knows the command which
+# wrote it and removes its temporary file when it is garbage collected.
+# returnResult='lazy' does not run anything: the call runs when the file is
+# needed, a lazy result given as input to another call becomes part of that
+# call's chain, so CDO pipes the data instead of writing a file.
+
+# keywords of calls which run in several CDO processes, see parallel.py
+ModeKeywords = ('timeChunks', 'tiles', 'tileMemory', 'treeReduce', 'checkpoints')
+
+
+class CdoResult(object):
+    """Output of a Cdo call
+
+    r = cdo.timmean(input=ifile, returnResult=True)
+    r.array('tas'); r.xarray(); r.cdf(); r.metadata()
+    cdo.fldmean(input=r)                          # path-like input
+    lazy = cdo.timmean(input=ifile, returnResult='lazy')
+    cdo.fldmean(input=lazy)                       # one CDO call: -fldmean -timmean ifile
+    """
+
+    def __init__(self, cdo, path=None, temporary=False, cmd=None, call=None):
+        self.cdo = cdo
+        self.cmd = cmd
+        self.temporary = temporary
+        self._path = path
+        self._call = call      # (chain, kwargs) of a lazy result
+        self._lock = threading.Lock()
+        if temporary and path is not None:
+            self.__own(path)
+
+    @classmethod
+    def lazy(cls, chain, kwargs):
+        kwargs = {k: v for k, v in kwargs.items() if k != 'returnResult'}
+        return cls(chain, cmd=chain._buildCmd(dict(kwargs)), call=(chain, kwargs))
+
+    def __own(self, path):
+        from .parallel import removeFiles
+        weakref.finalize(self, removeFiles, [path])
+
+    # file of the result, lazy results are computed on first use {{{
+    @property
+    def computed(self):
+        return self._path is not None
+
+    @property
+    def path(self):
+        with self._lock:
+            if self._path is None:
+                chain, kwargs = self._call
+                path = chain(**dict(kwargs, returnResult=False))
+                if not isinstance(path, six.string_types):
+                    raise ValueError("Only calls with a single output file can be lazy!")
+                self.temporary = kwargs.get('output') is None
+                if self.temporary:
+                    self.__own(path)
+                self._path = path
+            return self._path
+
+    def __fspath__(self):
+        return self.path
+
+    def __str__(self):
+        return self.path
+
+    def __repr__(self):
+        if self.computed:
+            return "CdoResult('%s')" % self._path
+        return "CdoResult(lazy: %s)" % ' '.join(self.cmd[1:])
+    # }}}
+
+    def tokens(self):
+        """Input for other calls: the chain of an uncomputed lazy result, else the file"""
+        if self.computed:
+            return [self._path]
+        chain, kwargs = self._call
+        # options and modes of the lazy call would get lost in another chain
+        if chain._options or kwargs.get('options') or kwargs.get('output') is not None \
+           or any(kwargs.get(k) for k in ModeKeywords) \
+           or 1 != chain.operators.get(chain._operatorName()):
+            return [self.path]
+        withoutInput = chain._buildCmd({k: v for k, v in kwargs.items() if k != 'input'})
+        return list(self.cmd[len(withoutInput) - len(chain._cmd):])
+
+    def expression(self):
+        return ' '.join(self.tokens())
+
+    # lazy readers {{{
+    def metadata(self):
+        """Grid size, levels, variables, timesteps and data type, see memory.py"""
+        from .memory import MemoryEstimator
+        return (self.cdo.memoryEstimator or MemoryEstimator(self.cdo)).metadata(self.path)
+
+    def array(self, varname, select=None):
+        return self.cdo.readArray(self.path, varname, select)
+
+    def maArray(self, varname, select=None):
+        return self.cdo.readMaArray(self.path, varname, select)
+
+    def xarray(self, varname=None):
+        """Dataset, or the DataArray of varname"""
+        if varname is None:
+            return self.cdo.readXDataset(self.path)
+        return self.cdo.readXArray(self.path, varname)
+
+    def cdf(self):
+        return self.cdo.readCdf(self.path)
+    # }}}
+
+
+def inputToken(item):
+    """Part of a command line for an input: file names, results, paths"""
+    return ' '.join(inputTokens(item))
+
+
+def inputTokens(item):
+    """Command line tokens of an input, operators of lazy results are separate tokens"""
+    if isinstance(item, CdoResult):
+        return item.tokens()
+    if hasattr(item, '__fspath__'):
+        return [os.fspath(item)]
+    return [item]
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -0,0 +1,185 @@
+import os
+import threading
+import contextlib
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# node-level scheduling of concurrent CDO calls
+
+# budget of cores for CDO's OpenMP parallelism {{{
+class ThreadBudget(object):
+    """Share a fixed number of cores between concurrently running CDO calls
+
+    Every call asks for cores before it starts and gets a number of threads
+    (CDO's '-P' option and OMP_NUM_THREADS) plus the set of cores to run on.
+    The number depends on how many calls are waiting and on how much the
+    operators gain from threads: see 'hints'. Calls wait if all cores are used.
+    """
+
+    # maximum number of useful threads per operator (or operator prefix),
+    # None means no limit. Operators not listed here run with one thread.
+    hints = {
+        'remap':       None,
+        'gen':         None,
+        'smooth':      None,
+        'fillmiss':    None,
+        'setmisstonn': None,
+        'eof':         None,
+        'sp2gp':       None,
+        'gp2sp':       None,
+        'intlevel':    8,
+        'ml2pl':       8,
+        'ap2pl':       8,
+        'expr':        4,
+        'fld':         4,
+        'zon':         4,
+        'mer':         4,
+        'ens':         4,
+        'verifygrid':  None,
+    }
+
+    def __init__(self, cores=None, hints=None, pin=True):
+        if hasattr(os, 'sched_getaffinity'):
+            available = sorted(os.sched_getaffinity(0))
+        else:
+            available = list(range(os.cpu_count() or 1))
+        self.cores = min(cores or len(available), len(available))
+        self.pin = pin and hasattr(os, 'sched_setaffinity')
+        self.hints = dict(self.hints, **(hints or {}))
+
+        self._free = available[:self.cores]
+        self._waiting = 0
+        self._condition = threading.Condition()
+
+    def hint(self, operator):
+        """Return the maximum number of useful threads for an operator"""
+        if operator in self.hints:
+            return self.hints[operator]
+        prefixes = [p for p in self.hints if operator.startswith(p)]
+        if prefixes:
+            return self.hints[max(prefixes, key=len)]
+        return 1
+
+    def threadsFor(self, operators):
+        limits = [self.hint(op) for op in operators]
+        if None in limits:
+            return self.cores
+        return max(limits or [1])
+
+    def acquire(self, operators, threads=None):
+        """Block until cores are free and return the list of granted cores
+
+        operators: names of the operators of the chain
+        threads:   fixed number of threads requested by the user (e.g. '-P 4')
+        """
+        wanted = min(threads or self.threadsFor(operators), self.cores)
+        with self._condition:
+            self._waiting += 1
+            try:
+                while not self._free or (threads and len(self._free) < wanted):
+                    self._condition.wait()
+                # fair share of the free cores among all waiting calls
+                share = max(1, len(self._free) // self._waiting)
+                n = wanted if threads else min(wanted, share)
+                granted, self._free = self._free[:n], self._free[n:]
+                return granted
+            finally:
+                self._waiting -= 1
+
+    def release(self, cores):
+        with self._condition:
+            self._free = sorted(self._free + list(cores))
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def pinned(self, cores):
+        """Restrict the calling thread (and processes started by it) to cores"""
+        if not self.pin or not cores:
+            yield
+            return
+        # on linux, pid 0 refers to the calling thread only
+        previous = os.sched_getaffinity(0)
+        os.sched_setaffinity(0, cores)
+        try:
+            yield
+        finally:
+            os.sched_setaffinity(0, previous)
+
+
+# budget shared by all Cdo objects created with threadBudget=True
+_nodeBudget = None
+_nodeBudgetLock = threading.Lock()
+
+
+def nodeBudget():
+    """Return the thread budget for the whole node (created on first use)"""
+    global _nodeBudget
+    with _nodeBudgetLock:
+        if _nodeBudget is None:
+            _nodeBudget = ThreadBudget()
+        return _nodeBudget
+# }}}
+
+# budget of memory for concurrently running CDO calls {{{
+def parseSize(size):
+    """Return the number of bytes of a size like 512M, 16G or 1024"""
+    if size is None or isinstance(size, (int, float)):
+        return size
+    size = str(size).strip().upper().rstrip('B')
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+class MemoryBudget(object):
+    """Start calls only while their memory fits into a fixed budget
+
+    A call which is larger than the whole budget runs alone.
+    """
+
+    def __init__(self, limit):
+        self.limit = parseSize(limit)
+        self._used = 0
+        self._condition = threading.Condition()
+
+    def used(self):
+        with self._condition:
+            return self._used
+
+    def acquire(self, amount):
+        """Block until amount bytes are free and return the reserved amount"""
+        amount = min(parseSize(amount) or 0, self.limit)
+        with self._condition:
+            while self._used and self._used + amount > self.limit:
+                self._condition.wait()
+            self._used += amount
+        return amount
+
+    def release(self, amount):
+        with self._condition:
+            self._used -= amount
+            self._condition.notify_all()
+
+
+def physicalMemory():
+    return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+# memory budget shared by all Cdo objects created with memoryBudget=True
+_nodeMemory = None
+
+
+def nodeMemory():
+    """Return the memory budget for the whole node (created on first use)"""
+    global _nodeMemory
+    with _nodeBudgetLock:
+        if _nodeMemory is None:
+            _nodeMemory = MemoryBudget(physicalMemory())
+        return _nodeMemory
+# }}}
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
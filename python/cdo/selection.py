@@ -0,0 +1,178 @@
+import datetime
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# partial reads for readArray/readMaArray: a selection is either an index
+# expression (int, slice, list or a tuple of them, e.g. numpy.s_[0, :, 2:4])
+# or a dict of labels:
+#
+#   {'time': ('2000-01-01', '2000-12-31'), 'level': 850, 'bbox': (0, 30, 40, 60)}
+#
+# Index expressions are always applied in the netCDF read. Labels are turned
+# into sel* operators if a chain is computed anyway: CDO writes only the
+# selection. For existing files they are mapped onto indices of the
+# coordinates, if this is not possible CDO selects them.
+
+LabelKeys = ('time', 'level', 'bbox')
+
+# names of the dimensions of coordinates {{{
+LevelNames = ('lev', 'level', 'plev', 'depth', 'height', 'alt', 'lev_2')
+LatNames = ('lat', 'latitude', 'y')
+LonNames = ('lon', 'longitude', 'x')
+# }}}
+
+
+def splitSelection(varname, select=None):
+    """Accept (varname, selection) tuples as used with returnArray
+
+    varname is a name or a list of names, other tuples are rejected.
+    """
+    if isinstance(varname, tuple):
+        names = varname[0] if varname else None
+        isNames = isinstance(names, str) or \
+            (isinstance(names, list) and all(isinstance(name, str) for name in names))
+        if 2 != len(varname) or not isNames or isinstance(varname[1], str):
+            raise ValueError("Use (varname, selection) for partial reads and a list "
+                             "for several variables, not %r!" % (varname,))
+        return varname
+    return varname, select
+
+
+def isLabelSelection(select):
+    if not isinstance(select, dict):
+        return False
+    unknown = [key for key in select if key not in LabelKeys]
+    if unknown:
+        raise ValueError("Unknown selection keys '%s', use: %s" % (unknown, ', '.join(LabelKeys)))
+    return True
+
+
+# labels as CDO operators {{{
+def timeLabel(value, end=False):
+    """Format a date as used by CDO's seldate (date only means the whole day)"""
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S')
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+    value = str(value)
+    if 'T' not in value:
+        value += 'T23:59:59' if end else 'T00:00:00'
+    return value
+
+
+def listOf(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def noTimesteps(start, end, path):
+    """Error of an empty time selection, in the netCDF read and with CDO"""
+    return ValueError("No timesteps between '%s' and '%s' in '%s'!" % (start, end, path))
+
+
+def selOperators(select, index=None):
+    """Return the CDO operators which select the given labels
+
+    With the TimeIndex of the input, time is selected by timestep.
+    """
+    operators = []
+    if 'time' in select:
+        start, end = select['time']
+        if index is not None:
+            operators.append(index.seltimestep(start, end))
+        else:
+            operators.append('-seldate,%s,%s' % (timeLabel(start), timeLabel(end, end=True)))
+    if 'level' in select:
+        operators.append('-sellevel,' + ','.join(map(str, listOf(select['level']))))
+    if 'bbox' in select:
+        operators.append('-sellonlatbox,' + ','.join(map(str, select['bbox'])))
+    return operators
+# }}}
+
+
+# labels as indices of the netCDF variable {{{
+def indicesToIndex(indices):
+    """Use a slice for contiguous indices: netCDF reads it as one hyperslab"""
+    indices = [int(i) for i in indices]
+    if not indices:
+        return slice(0, 0)
+    if indices == list(range(indices[0], indices[-1] + 1)):
+        return slice(indices[0], indices[-1] + 1)
+    return indices
+
+
+def timeIndices(np, coordinate, start, end):
+    from netCDF4 import num2date
+    # compare formatted dates: this works for every calendar
+    calendar = getattr(coordinate, 'calendar', 'standard')
+    dates = num2date(coordinate[:], coordinate.units, calendar)
+    labels = ['%04d-%02d-%02dT%02d:%02d:%02d' % (d.year, d.month, d.day, d.hour, d.minute, d.second)
+              for d in np.atleast_1d(dates)]
+    start, end = timeLabel(start), timeLabel(end, end=True)
+    return [i for i, label in enumerate(labels) if start <= label <= end]
+
+
+def coordinateKind(name, coordinate):
+    units = getattr(coordinate, 'units', '')
+    axis = getattr(coordinate, 'axis', '')
+    if 'since' in units or 'T' == axis:
+        return 'time'
+    if units in ('degrees_north', 'degree_north') or 'Y' == axis or name in LatNames:
+        return 'lat'
+    if units in ('degrees_east', 'degree_east') or 'X' == axis or name in LonNames:
+        return 'lon'
+    if 'Z' == axis or hasattr(coordinate, 'positive') or name in LevelNames:
+        return 'level'
+    return None
+
+
+def readIndex(np, fileObj, varname, select, times=None, path=None):
+    """Return the index of a label selection or None if it cannot be mapped
+
+    times is the cached TimeIndex of the file, if any. An empty time selection
+    raises ValueError, like the seltimestep operator of the TimeIndex.
+    """
+    variable = fileObj.variables[varname]
+    index, found = [], set()
+    for dim in variable.dimensions:
+        coordinate = fileObj.variables.get(dim)
+        kind = coordinateKind(dim, coordinate) if coordinate is not None else None
+        if 1 != getattr(coordinate, 'ndim', 0):
+            kind = None
+        if 'time' == kind and 'time' in select:
+            if times is not None and dim == times.dimension:
+                steps = times.indices(*select['time'])
+            else:
+                steps = timeIndices(np, coordinate, *select['time'])
+            if not len(steps):
+                raise noTimesteps(select['time'][0], select['time'][1], path)
+            index.append(indicesToIndex(steps))
+        elif 'level' == kind and 'level' in select:
+            values = coordinate[:]
+            levels = np.array(listOf(select['level']), dtype=float)
+            index.append(indicesToIndex(
+                np.where(np.isclose(values[:, None], levels[None, :]).any(axis=1))[0]))
+        elif 'lat' == kind and 'bbox' in select:
+            lat1, lat2 = sorted(select['bbox'][2:4])
+            values = coordinate[:]
+            index.append(indicesToIndex(np.where((values >= lat1) & (values <= lat2))[0]))
+        elif 'lon' == kind and 'bbox' in select:
+            lon1, lon2 = select['bbox'][0:2]
+            # longitudes relative to the western edge of the box
+            values = (coordinate[:] - lon1) % 360.0
+            width = (lon2 - lon1) % 360.0 or 360.0
+            index.append(indicesToIndex(np.where(values <= width)[0]))
+        else:
+            index.append(slice(None))
+            continue
+        found.add(kind)
+    if 'lat' in found and 'lon' in found:
+        found.add('bbox')
+    if not set(select) <= found:
+        return None
+    return tuple(index)
+# }}}
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
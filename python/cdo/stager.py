@@ -0,0 +1,223 @@
+import os
+import shutil
+import atexit
+import tempfile
+import threading
+import contextlib
+import collections
+import concurrent.futures
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# staging of inputs from slow (parallel) filesystems into local scratch: CDO
+# does many small reads, which are much faster on a local disk
+
+# cache of staged inputs {{{
+class InputStager(object):
+    """Copy (or hard-link) inputs into local scratch before CDO reads them
+
+    cdo = Cdo(stager=InputStager(scratch='/local/scratch', budget=50 * 2**30))
+
+    Every input file of a call is staged and its path is replaced in the
+    command. Staged files are kept in an LRU cache of at most 'budget' bytes,
+    files which are used by running calls are never removed. 'prefixes' limits
+    staging to files below the given directories, e.g. ['/lustre', '/nfs'].
+    'copy' is the function copying a file (src, dst).
+    """
+
+    def __init__(self, scratch=None, budget=10 * 2**30, prefetch=2, link=True,
+                 prefixes=None, copy=shutil.copyfile):
+        self.scratch = scratch or tempfile.mkdtemp(prefix='cdoPy_stage_')
+        if not os.path.isdir(self.scratch):
+            os.makedirs(self.scratch)
+        self.budget = budget
+        self.prefetchCount = prefetch
+        self.link = link
+        self.prefixes = [os.path.abspath(p) for p in prefixes] if prefixes else None
+        self.copy = copy
+
+        self._lock = threading.RLock()
+        self._cache = collections.OrderedDict()   # key -> (local path, size)
+        self._pinned = collections.Counter()      # key -> number of users
+        self._staging = {}                        # key -> future
+        self._unused = set()                      # prefetched, not used yet
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, prefetch))
+        atexit.register(self.clear)
+
+    def size(self):
+        """Number of bytes in the cache"""
+        with self._lock:
+            return sum(size for path, size in self._cache.values())
+
+    def wants(self, path):
+        if not os.path.isfile(path) or os.path.abspath(path).startswith(self.scratch):
+            return False
+        if self.prefixes is None:
+            return True
+        path = os.path.abspath(path)
+        return any(path.startswith(prefix + os.sep) for prefix in self.prefixes)
+
+    @staticmethod
+    def key(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime, stat.st_size)
+
+    def __copy(self, key):
+        src, mtime, size = key
+        dst = os.path.join(self.scratch, '%x_%s' % (abs(hash(key)), os.path.basename(src)))
+        if self.link:
+            try:
+                os.link(src, dst + '.part')
+            except OSError:
+                self.copy(src, dst + '.part')
+        else:
+            self.copy(src, dst + '.part')
+        os.replace(dst + '.part', dst)
+        return dst
+
+    def __evict(self):
+        # caller holds the lock: drop least recently used files, which are
+        # not in use, until the budget is kept. Prefetched files, which were
+        # not used yet, go last
+        total = sum(size for path, size in self._cache.values())
+        keys = [k for k in self._cache if k not in self._unused] + \
+               [k for k in self._cache if k in self._unused]
+        for key in keys:
+            if total <= self.budget:
+                break
+            if self._pinned[key]:
+                continue
+            path, size = self._cache.pop(key)
+            self._unused.discard(key)
+            if os.path.isfile(path):
+                os.remove(path)
+            total -= size
+
+    def __insert(self, key, future, pin=False):
+        # caller holds the lock: a finished copy goes into the cache
+        if self._staging.get(key) is future:
+            del self._staging[key]
+        if key not in self._cache and future.exception() is None \
+           and os.path.isfile(future.result()):
+            self._cache[key] = (future.result(), key[2])
+            self._unused.add(key)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            if pin:
+                self._pinned[key] += 1
+                self._unused.discard(key)
+        self.__evict()
+
+    def __finished(self, key, future):
+        with self._lock:
+            self.__insert(key, future)
+
+    def __future(self, key):
+        # caller holds the lock
+        if key in self._staging:
+            return self._staging[key]
+        future = self._pool.submit(self.__copy, key)
+        self._staging[key] = future
+        # a copy which is done already runs the callback right here, with
+        # the lock held: the lock is reentrant
+        future.add_done_callback(lambda f: self.__finished(key, f))
+        return future
+
+    def prefetch(self, paths):
+        """Start staging files in the background"""
+        with self._lock:
+            for path in paths:
+                if self.wants(path):
+                    key = self.key(path)
+                    if key not in self._cache and key[2] <= self.budget:
+                        self.__future(key)
+
+    def acquire(self, path):
+        """Stage a file (wait if needed), mark it as used and return the local path
+
+        If staging fails, the original path is used.
+        """
+        if not self.wants(path):
+            return path
+        key = self.key(path)
+        if key[2] > self.budget:
+            return path
+        while True:
+            with self._lock:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    self._pinned[key] += 1
+                    self._unused.discard(key)
+                    return self._cache[key][0]
+                future = self.__future(key)
+            if future.exception() is not None:
+                with self._lock:
+                    self.__insert(key, future)
+                return path
+            with self._lock:
+                self.__insert(key, future, pin=True)
+                if key in self._cache:
+                    return self._cache[key][0]
+            # removed from the cache meanwhile: stage it again
+
+    def release(self, local):
+        with self._lock:
+            for key, (path, size) in self._cache.items():
+                if path == local and self._pinned[key]:
+                    self._pinned[key] -= 1
+            self.__evict()
+
+    @contextlib.contextmanager
+    def staged(self, cmd, outputs=()):
+        """Command with staged inputs, which are kept while the call runs"""
+        from .incremental import inputFiles
+        local = {}
+        try:
+            # cmd[0] is the CDO binary, not an input
+            for path in inputFiles(' '.join(cmd[1:]).split(), outputs):
+                staged = self.acquire(path)
+                if staged != path:
+                    local[path] = staged
+            # replace whole tokens only, quoting and spacing are kept
+            yield cmd[:1] + [' '.join(stagedToken(token, local) for token in element.split(' '))
+                             for element in cmd[1:]]
+        finally:
+            for staged in local.values():
+                self.release(staged)
+
+    def imap(self, chain, inputs, **kwargs):
+        """Run chain(input=...) for each input and yield the results in order
+
+        The next 'prefetch' inputs are staged in the background meanwhile.
+        """
+        inputs = list(inputs)
+        for i, path in enumerate(inputs):
+            # the current input first, it is needed right away
+            self.prefetch(inputs[i:i + 1 + self.prefetchCount])
+            yield chain(input=path, **kwargs)
+
+    def map(self, chain, inputs, **kwargs):
+        return list(self.imap(chain, inputs, **kwargs))
+
+    def clear(self):
+        """Remove all staged files"""
+        with self._lock:
+            self._cache.clear()
+            self._pinned.clear()
+            self._unused.clear()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+
+def stagedToken(token, local):
+    if token in local:
+        return local[token]
+    if token.startswith('-') and ',' in token:
+        parts = token.split(',')
+        return ','.join([parts[0]] + [local.get(p, p) for p in parts[1:]])
+    return token
+# }}}
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import shutil
+import select
+import struct
+import tempfile
+import threading
+import collections
+import concurrent.futures
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# streaming of split* outputs: with stream=True, split operators return an
+# iterator of their output files, which yields every file as soon as CDO has
+# finished it. CDO writes into a private directory next to the outputs, which
+# is watched with inotify on linux (a file is finished when CDO closes it).
+# Without inotify (or with stream='poll') the directory is polled: files of
+# splits which write one file after the other (see SequentialSplits) are
+# finished when the next one appears, all others when CDO is done. Finished
+# files are renamed to their final names, i.e. <output prefix><suffix>.
+
+# split operators which write their outputs one after the other
+SequentialSplits = {'splityear', 'splityearmon', 'splitsel'}
+
+IN_CLOSE_WRITE = 0x00000008
+
+
+# watching a directory for finished files {{{
+class InotifyWatch(object):
+    """Names of files in a directory, which were closed after writing"""
+
+    def __init__(self, directory):
+        import ctypes
+        import ctypes.util
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if self._libc.inotify_add_watch(self._fd, os.fsencode(directory), IN_CLOSE_WRITE) < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed')
+
+    def poll(self, timeout):
+        names = []
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return names
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return names
+        i = 0
+        while i + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, i)
+            names.append(os.fsdecode(data[i + 16:i + 16 + length].rstrip(b'\0')))
+            i += 16 + length
+        return names
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingWatch(object):
+    """Names of finished files by polling: finished when the next one appears"""
+
+    def __init__(self, directory, sequential):
+        self.directory = directory
+        self.sequential = sequential
+        self._order = []
+
+    def __created(self, name):
+        try:
+            return os.stat(os.path.join(self.directory, name)).st_ctime
+        except OSError:
+            return 0
+
+    def poll(self, timeout):
+        time.sleep(timeout)
+        names = [n for n in os.listdir(self.directory) if n not in self._order]
+        self._order.extend(sorted(names, key=self.__created))
+        return self._order[:-1] if self.sequential else []
+
+    def close(self):
+        pass
+
+
+def watch(directory, mode, sequential):
+    if mode != 'poll' and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatch(directory)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatch(directory, sequential)
+# }}}
+
+
+def streamSplit(cdo, args, kwargs):
+    """Start a split operator and return a SplitStream of its finished outputs"""
+    from .executor import dispatcher
+    kwargs = dict(kwargs)
+    mode = kwargs.pop('stream')
+    interval = kwargs.pop('pollInterval', 0.2)
+    chain = cdo(*args) if args else cdo
+    name = chain._operatorName()
+    if not name.startswith('split'):
+        raise ValueError("Only split operators can stream their outputs, not '%s'!" % name)
+    if kwargs.get('output') is None:
+        raise ValueError("Streaming split outputs needs an output prefix!")
+
+    prefix = kwargs['output']
+    directory = os.path.dirname(os.path.abspath(prefix))
+    private = tempfile.mkdtemp(prefix='.%s_split_' % cdo.tempStore.fileTag, dir=directory)
+    watcher = watch(private, mode, name in SequentialSplits)
+    kwargs['output'] = os.path.join(private, os.path.basename(prefix))
+    kwargs['force'] = True
+    # the private directory is watched: no write-behind, and the call has to
+    # run now, even with Cdo(returnResults='lazy')
+    kwargs['writeBehind'] = False
+    kwargs['returnResult'] = False
+    future = dispatcher().submit(chain, **kwargs)
+    return SplitStream(future, watcher, private, directory, interval)
+
+
+class SplitStream(object):
+    """Iterator of the finished outputs of a split operator
+
+    Outputs get their final names when they are finished and, at the latest,
+    when the call is done: the private directory is cleaned up then, whether
+    the iterator is used or not. close() waits for the call.
+    """
+
+    def __init__(self, future, watcher, private, directory, interval):
+        self._future = future
+        self._watcher = watcher
+        self.private = private
+        self.directory = directory
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._delivered = set()
+        self._ready = collections.deque()
+        self._finished = False
+        self._error = None
+        future.add_done_callback(lambda f: self.__finish())
+
+    def __deliver(self, name):
+        # caller holds the lock
+        if name not in self._delivered and os.path.isfile(os.path.join(self.private, name)):
+            self._delivered.add(name)
+            final = os.path.join(self.directory, name)
+            os.replace(os.path.join(self.private, name), final)
+            self._ready.append(final)
+
+    def __finish(self):
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            # CDO errors are raised by the iterator, unfinished files are removed
+            if self._future.cancelled():
+                self._error = concurrent.futures.CancelledError()
+            else:
+                self._error = self._future.exception()
+            if self._error is None:
+                for name in sorted(os.listdir(self.private)):
+                    self.__deliver(name)
+            self._watcher.close()
+            shutil.rmtree(self.private, ignore_errors=True)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            if self._future.done():
+                self.__finish()
+            with self._lock:
+                if self._ready:
+                    return self._ready.popleft()
+                if self._finished:
+                    error, self._error = self._error, None
+                    if error is not None:
+                        raise error
+                    raise StopIteration
+                for name in self._watcher.poll(self.interval):
+                    self.__deliver(name)
+
+
+    def close(self):
+        """Stop iterating: waits for CDO, the remaining outputs still get their final names"""
+        concurrent.futures.wait([self._future])
+        self.__finish()
+        with self._lock:
+            self._ready.clear()
+            self._error = None
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -0,0 +1,161 @@
+import os
+import re
+import threading
+import collections
+
+import numpy as np
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# time axis of a file as numpy.datetime64: it is read once from the netCDF
+# time coordinate (or with showtimestamp for other formats) and cached per
+# (path, mtime, size). Date ranges become exact seltimestep ranges, so CDO can
+# stop reading after the last selected timestep instead of scanning the whole
+# series with seldate. Non-standard calendars (360_day, noleap, ...) have dates
+# which datetime64 cannot represent: these are NaT and selections compare the
+# formatted dates instead, which works for every calendar.
+
+# calendars represented by datetime64 (proleptic gregorian)
+StandardCalendars = ('standard', 'gregorian', 'proleptic_gregorian')
+
+# number of cached time axes
+CacheSize = 128
+
+_cache = collections.OrderedDict()
+_cacheLock = threading.Lock()
+
+
+def formatDate(date):
+    return '%04d-%02d-%02dT%02d:%02d:%02d' % (date.year, date.month, date.day,
+                                              date.hour, date.minute, date.second)
+
+
+class TimeIndex(object):
+    """Timestamps of a file
+
+    values: numpy.datetime64[s] array (NaT for dates not in the gregorian
+    calendar), labels: 'YYYY-MM-DDThh:mm:ss' strings, calendar and the netCDF
+    dimension of the time axis (None for other formats)
+    """
+
+    def __init__(self, labels, calendar='standard', dimension=None, path=None):
+        self.labels = np.asarray(labels, dtype=str)
+        self.calendar = calendar
+        self.dimension = dimension
+        self.path = path
+        self.standard = calendar in StandardCalendars
+        if self.standard:
+            self.values = self.labels.astype('datetime64[s]')
+        else:
+            self.values = np.array([self.__datetime(label) for label in self.labels],
+                                   dtype='datetime64[s]')
+        # datetime64 comparisons are exact for standard calendars only
+        self._keys = self.values if self.standard else self.labels
+        self._sorted = bool(np.all(self._keys[1:] >= self._keys[:-1]))
+
+    @staticmethod
+    def __datetime(label):
+        try:
+            return np.datetime64(label, 's')
+        except ValueError:
+            return np.datetime64('NaT')
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+    def __repr__(self):
+        if not len(self):
+            return "TimeIndex(empty, calendar='%s')" % self.calendar
+        return "TimeIndex(%d timesteps: %s .. %s, calendar='%s')" % (
+            len(self), self.labels[0], self.labels[-1], self.calendar)
+
+    def __bound(self, value, end=False):
+        from .selection import timeLabel
+        label = timeLabel(value, end)
+        return np.datetime64(label, 's') if self.standard else label
+
+    def indices(self, start, end):
+        """Indices (from 0) of the timesteps between start and end
+
+        A date only means the whole day, like with readArray's labels.
+        """
+        first, last = self.__bound(start), self.__bound(end, end=True)
+        if self._sorted:
+            return np.arange(np.searchsorted(self._keys, first, 'left'),
+                             np.searchsorted(self._keys, last, 'right'))
+        return np.nonzero((first <= self._keys) & (self._keys <= last))[0]
+
+    def seltimestep(self, start, end):
+        """Operator which selects the timesteps between start and end"""
+        from .selection import noTimesteps
+        steps = self.indices(start, end) + 1
+        if not len(steps):
+            raise noTimesteps(start, end, self.path)
+        if steps[-1] - steps[0] + 1 == len(steps):
+            return '-seltimestep,%d/%d' % (steps[0], steps[-1])
+        return '-seltimestep,' + ','.join(map(str, steps))
+
+
+# reading the time axis {{{
+def isNetcdf(path):
+    with open(path, 'rb') as f:
+        return f.read(4) in (b'CDF\x01', b'CDF\x02', b'CDF\x05', b'\x89HDF')
+
+
+def netcdfTimeIndex(cdo, path):
+    """Time axis of a netCDF file, None if it has no time coordinate"""
+    from netCDF4 import num2date
+    from .selection import coordinateKind
+    fileObj = cdo.cdf(path, mode='r')
+    try:
+        for name, coordinate in fileObj.variables.items():
+            if (name,) != coordinate.dimensions or 'time' != coordinateKind(name, coordinate) \
+               or 'since' not in getattr(coordinate, 'units', ''):
+                continue
+            calendar = getattr(coordinate, 'calendar', 'standard').lower()
+            dates = np.atleast_1d(num2date(coordinate[:], coordinate.units, calendar))
+            return TimeIndex([formatDate(d) for d in dates], calendar, name, path)
+    finally:
+        fileObj.close()
+    return None
+
+
+def showTimeIndex(cdo, path):
+    """Time axis from showtimestamp, calendar from sinfo"""
+    chain = cdo._newChain()
+    labels = ' '.join(chain.showtimestamp(input=path)).split()
+    calendar = 'standard'
+    for line in chain.sinfo(input=path):
+        match = re.search(r'Calendar\s*=\s*(\w+)', line)
+        if match:
+            calendar = match.group(1).lower()
+    return TimeIndex(labels, calendar, path=path)
+
+
+def timeIndex(cdo, path):
+    path = os.fspath(path)
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+    with _cacheLock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    index = None
+    if cdo.hasNetcdf and isNetcdf(path):
+        index = netcdfTimeIndex(cdo, path)
+    if index is None:
+        index = showTimeIndex(cdo, path)
+    with _cacheLock:
+        _cache[key] = index
+        while len(_cache) > CacheSize:
+            _cache.popitem(last=False)
+    return index
+# }}}
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -0,0 +1,185 @@
+import os
+import queue
+import warnings
+import threading
+
+import numpy as np
+import six
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# iterating over the timesteps of a (large) result in batches: a background
+# thread reads the next batches into a bounded queue, so memory stays flat
+# and reading overlaps with the analysis of the current batch. netCDF3 files
+# are memory mapped (scipy), their batches are views into the file: no copy,
+# read-ahead only touches the pages. Other formats are read with netCDF4.
+
+# number of batches which are read ahead
+ReadAhead = 2
+
+# size of memory pages touched by the read-ahead of mapped files
+PageSize = 4096
+
+
+# reading batches from a file {{{
+def isNetcdf3(path):
+    with open(path, 'rb') as f:
+        return f.read(4) in (b'CDF\x01', b'CDF\x02')
+
+
+class MappedReader(object):
+    """Batches of a variable in a memory mapped netCDF3 file"""
+
+    def __init__(self, path, varname):
+        from scipy.io import netcdf_file
+        self.handle = netcdf_file(path, 'r', mmap=True, maskandscale=False)
+        if varname not in self.handle.variables:
+            self.handle.close()
+            raise LookupError("Cannot find variable '%s'" % varname)
+        self.var = self.handle.variables[varname]
+        self.fill = getattr(self.var, '_FillValue', getattr(self.var, 'missing_value', None))
+        # packed variables are unpacked like netCDF4 does
+        self.scale = getattr(self.var, 'scale_factor', None)
+        self.offset = getattr(self.var, 'add_offset', None)
+        self.axis = timeAxis(self.var.dimensions, self.handle.dimensions)
+        self.length = self.var.shape[self.axis] if self.var.shape else 1
+
+    def read(self, start, end):
+        view = self.var.data[batchIndex(len(self.var.shape), self.axis, start, end)]
+        # read-ahead: fault in the pages of the batch
+        flat = view.reshape(-1).view(np.uint8) if view.flags.c_contiguous else None
+        if flat is not None and flat.size:
+            int(flat[::PageSize].sum())
+        if self.fill is not None:
+            view = np.ma.masked_equal(view, self.fill, copy=False)
+        # unpacking copies the batch
+        if self.scale is not None:
+            view = view * self.scale
+        if self.offset is not None:
+            view = view + self.offset
+        return view
+
+    def close(self):
+        # batches may still refer to the mapping: scipy keeps it open then
+        self.var = None
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.handle.close()
+
+
+class NetcdfReader(object):
+    """Batches of a variable read with netCDF4"""
+
+    def __init__(self, path, varname, cdf):
+        self.handle = cdf(path, mode='r')
+        if varname not in self.handle.variables:
+            self.handle.close()
+            raise LookupError("Cannot find variable '%s'" % varname)
+        self.var = self.handle.variables[varname]
+        self.axis = timeAxis(self.var.dimensions, self.handle.dimensions)
+        self.length = self.var.shape[self.axis] if self.var.shape else 1
+
+    def read(self, start, end):
+        return self.var[batchIndex(len(self.var.shape), self.axis, start, end)]
+
+    def close(self):
+        self.handle.close()
+
+
+def batchIndex(ndim, axis, start, end):
+    """Index of the timesteps start..end-1, scalar variables are read as a whole"""
+    if not ndim:
+        return Ellipsis
+    index = [slice(None)] * ndim
+    index[axis] = slice(start, end)
+    return tuple(index)
+
+
+def timeAxis(dimensions, fileDimensions):
+    """Position of the time (or else the unlimited) dimension, default: first"""
+    dimensions = list(dimensions)
+    if 'time' in dimensions:
+        return dimensions.index('time')
+    for i, name in enumerate(dimensions):
+        size = fileDimensions[name]
+        if size is None or (hasattr(size, 'isunlimited') and size.isunlimited()):
+            return i
+    return 0
+# }}}
+
+
+def iterTimesteps(cdo, chain, varname, batch=1, readAhead=ReadAhead):
+    """Yield arrays of 'batch' timesteps of varname from a file or a chain
+
+    chain is a file name, a CdoResult, a Cdo chain object or a chain
+    expression like '-timmean ifile'. Chains are written to a temporary
+    netCDF3 file first (memory mapped when scipy is available).
+    """
+    from .result import inputToken
+    if hasattr(chain, '_cmd') and hasattr(chain, '_buildCmd'):
+        path, temporary = chain(options='-f nc2', returnResult=False), True
+    else:
+        path = inputToken(chain)
+        if isinstance(path, six.string_types) and os.path.isfile(path):
+            temporary = False
+        else:
+            path, temporary = cdo._newChain().copy(input=path, options='-f nc2',
+                                                   returnResult=False), True
+
+    try:
+        import scipy.io
+        reader = MappedReader(path, varname) if isNetcdf3(path) else None
+    except ImportError:
+        reader = None
+    if reader is None:
+        if not cdo.hasNetcdf:
+            raise ImportError("Reading '%s' needs scipy (netCDF3) or netCDF4" % path)
+        reader = NetcdfReader(path, varname, cdo.cdf)
+    return batches(reader, max(1, int(batch)), readAhead, path if temporary else None)
+
+
+def batches(reader, batch, readAhead, temporary):
+    buffer = queue.Queue(maxsize=max(1, readAhead))
+    stop = threading.Event()
+    done = object()
+
+    def offer(item):
+        # False if the consumer has gone
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for start in range(0, reader.length, batch):
+                if not offer(reader.read(start, min(start + batch, reader.length))):
+                    return
+            offer(done)
+        except BaseException as e:
+            offer(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+        reader.close()
+        if temporary is not None and os.path.isfile(temporary):
+            os.remove(temporary)
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -0,0 +1,145 @@
+import os
+import shutil
+import atexit
+import tempfile
+import threading
+import concurrent.futures
+
+# Copyright 2011-2023 Ralf Mueller, ralf.mueller@dkrz.de {{{
+#
+# See cdo.py for the full license text (BSD 3-Clause).
+# }}}
+
+# write-behind outputs: CDO writes to local scratch, the file is moved to its
+# final (slow) destination in the background and appears there atomically
+
+class DeliveryError(Exception):
+    """Outputs which could not be moved to their destination"""
+
+    def __init__(self, errors):
+        Exception.__init__(self, errors)
+        self.errors = errors
+
+    def __str__(self):
+        return 'Could not deliver: ' + ', '.join(
+            "'%s' (%s)" % (path, error) for path, error in self.errors)
+
+
+# background delivery of outputs {{{
+class WriteBehind(object):
+    """Write outputs to local scratch and move them to their destination later
+
+    cdo = Cdo(writeBehind=WriteBehind(scratch='/local/scratch'))
+    cdo.timmean(input=ifile, output='/slow/nfs/mean.nc')   # returns right away
+    cdo.flush()                                            # wait for delivery
+
+    'prefixes' limits write-behind to outputs below the given directories.
+    Failed deliveries are raised by flush() as DeliveryError, their local
+    files are kept in scratch.
+    """
+
+    def __init__(self, scratch=None, workers=2, prefixes=None, copy=shutil.copyfile):
+        self.scratch = scratch or tempfile.mkdtemp(prefix='cdoPy_writebehind_')
+        if not os.path.isdir(self.scratch):
+            os.makedirs(self.scratch)
+        self.prefixes = [os.path.abspath(p) for p in prefixes] if prefixes else None
+        self.copy = copy
+
+        self._lock = threading.Lock()
+        self._pending = {}    # final path -> future
+        self._errors = []     # (final path, exception)
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        atexit.register(self.wait)
+
+    def wants(self, output):
+        if self.prefixes is None:
+            return True
+        output = os.path.abspath(output)
+        return any(output.startswith(prefix + os.sep) for prefix in self.prefixes)
+
+    def scratchFile(self, output):
+        """Local file for an output, the name keeps its suffix"""
+        fd, path = tempfile.mkstemp(dir=self.scratch, suffix='_' + os.path.basename(output))
+        os.close(fd)
+        return path
+
+    def __move(self, local, final, after):
+        try:
+            # same filesystem: a rename is enough
+            os.replace(local, final)
+        except OSError:
+            # copy next to the destination first, then rename atomically
+            part = '%s.part%d' % (final, threading.get_ident())
+            try:
+                self.copy(local, part)
+                os.replace(part, final)
+            except BaseException:
+                if os.path.isfile(part):
+                    os.remove(part)
+                raise
+            os.remove(local)
+        if after is not None:
+            after()
+
+    def __done(self, final, future):
+        # called once per delivery: by the pool or by wait(), whoever is first
+        with self._lock:
+            if self._pending.get(final) is not future:
+                return
+            del self._pending[final]
+            if future.exception() is not None:
+                self._errors.append((final, future.exception()))
+
+    def deliver(self, local, final, after=None):
+        """Move local to final in the background, then call after()"""
+        # a newer output for the same destination waits for the older one
+        previous = self._pending.get(final)
+        if previous is not None:
+            concurrent.futures.wait([previous])
+        with self._lock:
+            future = self._pool.submit(self.__move, local, final, after)
+            self._pending[final] = future
+        future.add_done_callback(lambda f: self.__done(final, f))
+        return future
+
+    def pending(self):
+        with self._lock:
+            return sorted(self._pending)
+
+    def wait(self, paths=None):
+        """Block until the given (default: all) outputs are delivered
+
+        Returns the list of failed deliveries as (path, exception)
+        """
+        with self._lock:
+            futures = [(path, f) for path, f in self._pending.items() if paths is None or path in paths]
+        concurrent.futures.wait([f for path, f in futures])
+        for path, future in futures:
+            self.__done(path, future)
+        with self._lock:
+            return [(path, e) for path, e in self._errors if paths is None or path in paths]
+
+    def waitFor(self, cmd, outputs=()):
+        """Deliver the pending outputs which a command reads or writes first"""
+        if not self.pending():
+            return
+        tokens = set(outputs)
+        for token in ' '.join(cmd[1:]).split():
+            token = token.strip('\'"')
+            tokens.update(token.split(',')[1:] if token.startswith('-') else [token])
+        # relative and absolute names of the same file
+        tokens = set(os.path.abspath(token) for token in tokens if token)
+        paths = [path for path in self.pending() if os.path.abspath(path) in tokens]
+        if paths:
+            self.flush(paths)
+
+    def flush(self, paths=None):
+        """Wait for all deliveries and raise a DeliveryError for failed ones"""
+        errors = self.wait(paths)
+        if errors:
+            with self._lock:
+                self._errors = [e for e in self._errors if e not in errors]
+            raise DeliveryError(errors)
+# }}}
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 fdm=marker
@@ -22,7 +22,7 @@ else:
 
 # add local dir to search path
 sys.path.insert(0,os.path.dirname(sys.path[0]))
-from cdo import Cdo, CDOException
+from cdo import Cdo, CDOException, CDOTimeoutException, ThreadBudget, Pipeline
 import cdo as cdoPkg
 
 if 'CDF_MOD' in os.environ:
@@ -759,6 +759,33 @@ class CdoTest(testClass):
         if DEBUG:
           cdo.showLog()
 
+        # one handler per process, structured records of each call
+        import logging
+        for i in range(3):
+          cdo = Cdo(logging=True, logFile=u'foo.log')
+        self.assertEqual(1, len(logging.getLogger('cdo.cdo').handlers))
+        lines = [l for l in cdo.collectLogs().splitlines() if 'sinfov' in l]
+        self.assertEqual(2, len(lines))
+        self.assertTrue(lines[-1].endswith('returncode 0]'))
+
+        # sampling skips successful calls only
+        cdo = Cdo(logging=True, logFile=u'sampled.log', logSampling=0.0)
+        cdo.topo()
+        self.assertEqual('', cdo.collectLogs())
+
+        # stopping writes and closes the log files, new objects log again
+        from cdo.log import stop
+        handler = logging.getLogger('cdo.cdo').handlers[0]
+        stop()
+        self.assertNotIn(handler, logging.getLogger('cdo.cdo').handlers)
+        with open('foo.log') as f:
+          self.assertTrue(any('sinfov' in l for l in f))
+        cdo = Cdo(logging=True, logFile=u'foo.log')
+        cdo.sinfov(input=cmd)
+        self.assertIn('sinfov', cdo.collectLogs())
+        stop()
+        rm(['foo.log', 'sampled.log'])
+
     def test_noOutputOps(self):
       cdo = Cdo()
       opCount = len(cdo.noOutputOperators)
@@ -898,6 +925,773 @@ class CdoTest(testClass):
       r = cdo.mul.const('1,global_10').const('11,global_10')
       self.assertTrue(callable(r))
 
+    def test_timeChunks(self):
+      cdo = Cdo()
+      varname = 'seq' if cdoShouldHaveSeqOperator(cdo) else 'for'
+      ifile = cdo.enlarge('r36x18',
+                          input='-settaxis,2001-01-01,12:00:00,1day -%s,1,100'%(varname),
+                          options='-f nc')
+      expected = cdo.fldmean(input='-mulc,2 ' + ifile)
+      chunked  = cdo.fldmean(input='-mulc,2 ' + ifile, timeChunks=4)
+      self.assertEqual(['100'], cdo.ntime(input=chunked))
+      self.assertEqual([], cdo.diffv(input=[expected, chunked], options='-s'))
+
+      # time-dependent operators must not be chunked
+      with self.assertRaises(ValueError):
+        cdo.timmean(input=ifile, timeChunks=4)
+
+      # empty inputs are not split into reversed ranges
+      from cdo.parallel import splitRange
+      self.assertEqual([], splitRange(0, 4))
+      self.assertEqual([(1, 2), (3, 3)], splitRange(3, 2))
+
+    def test_tiles(self):
+      cdo = Cdo()
+      varname = 'seq' if cdoShouldHaveSeqOperator(cdo) else 'for'
+      ifile = cdo.enlarge('r36x18',
+                          input='-settaxis,2001-01-01,12:00:00,1day -%s,1,10'%(varname),
+                          options='-f nc')
+      expected = cdo.timmean(input='-mulc,2 ' + ifile)
+      tiled    = cdo.timmean.mulc(2, input=ifile, tiles=4)
+      self.assertEqual([], cdo.diffv(input=[expected, tiled], options='-s'))
+      # non-square layouts are collected as they were split
+      tiled    = cdo.timmean.mulc(2, input=ifile, tiles=6, returnResult=True)
+      self.assertTrue('-collgrid,3' in tiled.cmd)
+      self.assertEqual([], cdo.diffv(input=[expected, tiled], options='-s'))
+
+      # operators with horizontal dependencies must not be tiled
+      with self.assertRaises(ValueError):
+        cdo.fldmean(input=ifile, tiles=4)
+
+    def test_threadSafety(self):
+      import concurrent.futures
+      cdo = Cdo()
+      if not cdo.hasNetcdf:
+        print("no tests run for test_threadSafety")
+        return
+      chain = cdo.fldmean.mulc
+      def work(i):
+        return float(chain(i, input='-const,1,r10x10', options='-f nc', returnArray='const').flatten()[0])
+
+      nCalls = 64
+      for nThreads in [1, 8]:
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=nThreads) as pool:
+          results = list(pool.map(work, range(nCalls)))
+        duration = time.time() - start
+        print('%d calls with %2d threads: %.2f calls/s'%(nCalls, nThreads, nCalls/duration))
+        self.assertEqual([float(i) for i in range(nCalls)], results)
+
+      # the shared chain itself is left untouched, also with keep=False
+      chain(1, input='-const,1,r10x10', keep=False)
+      self.assertEqual(('-fldmean', '-mulc'), chain._cmd)
+      self.assertEqual((), cdo._cmd)
+
+    def test_timeout(self):
+      # reading from a fifo without writer blocks CDO forever
+      tempPath = tempfile.mkdtemp()
+      fifo     = os.path.join(tempPath, 'hanging_input')
+      ofile    = os.path.join(tempPath, 'output.nc')
+      os.mkfifo(fifo)
+
+      cdo = Cdo()
+      start = time.time()
+      with self.assertRaises(CDOTimeoutException):
+        cdo.copy(input=fifo, output=ofile, timeout=1)
+      self.assertTrue(time.time() - start < 10)
+      self.assertFalse(os.path.exists(ofile))
+
+      # instance default
+      cdo = Cdo(timeout=1)
+      with self.assertRaises(CDOTimeoutException):
+        cdo.sinfo(input=fifo)
+
+      # cancel from another thread
+      import threading
+      cdo = Cdo()
+      threading.Timer(1.0, cdo.cancel).start()
+      with self.assertRaises(CDOException):
+        cdo.copy(input=fifo, output=ofile)
+      self.assertFalse(os.path.exists(ofile))
+
+      rm([fifo])
+      os.rmdir(tempPath)
+
+    def test_threadBudget(self):
+      import concurrent.futures
+      budget = ThreadBudget(cores=2)
+      self.assertEqual(1, budget.threadsFor(['selname']))
+      self.assertEqual(budget.cores, budget.threadsFor(['selname', 'remapbil']))
+
+      cdo = Cdo(threadBudget=budget)
+      def work(i):
+        return cdo.remapbil('r36x18', input='-addc,%d -topo,r72x36'%(i))
+      with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(work, range(8)))
+      self.assertEqual(8, len(set(results)))
+      # all cores are given back
+      self.assertEqual(budget.cores, len(budget._free))
+
+    def test_incremental(self):
+      cdo = Cdo(incremental=True)
+      tag   = 'test_incremental_{0}'.format( random.randrange(1,100000))
+      ifile = tag + '_in.grb'
+      ofile = tag + '_out.grb'
+      cdo.topo('r36x18', output=ifile)
+
+      cdo.fldmean(input=ifile, output=ofile)
+      mtime0 = os.stat(ofile).st_mtime
+      time.sleep(1)
+      # same call, same input: skipped
+      cdo.fldmean(input=ifile, output=ofile)
+      self.assertEqual(mtime0, os.stat(ofile).st_mtime)
+      # other command: rebuilt
+      cdo.fldmax(input=ifile, output=ofile)
+      mtime1 = os.stat(ofile).st_mtime
+      self.assertNotEqual(mtime0, mtime1)
+      # changed input: rebuilt
+      time.sleep(1)
+      cdo.topo('r72x36', output=ifile, incremental=False)
+      cdo.fldmax(input=ifile, output=ofile)
+      self.assertNotEqual(mtime1, os.stat(ofile).st_mtime)
+
+      # pipelines rebuild everything downstream of a changed input
+      meanFile, anomFile = tag + '_mean.grb', tag + '_anom.grb'
+      pipe = Pipeline(cdo)
+      pipe.add(cdo.timmean, input=ifile, output=meanFile)
+      pipe.add(cdo.sub, input=' '.join([ifile, meanFile]), output=anomFile)
+      self.assertEqual([meanFile, anomFile], pipe.run())
+      self.assertEqual([], pipe.outdated())
+      self.assertEqual([], pipe.run())
+      time.sleep(1)
+      cdo.topo('r36x18', output=ifile, incremental=False)
+      self.assertEqual([meanFile, anomFile], pipe.outdated())
+      self.assertEqual([meanFile, anomFile], pipe.run())
+
+      files = [ifile, ofile, meanFile, anomFile]
+      rm(files + [f + '.cdo.json' for f in files])
+
+    def test_checkpoints(self):
+      cdo = Cdo()
+      tag   = 'test_checkpoints_{0}'.format( random.randrange(1,100000))
+      ofile = tag + '_out.grb'
+      cfile = tag + '_chk.grb'
+      ifile = "-div -sub -timmean -seltimestep,2,3 -seq,1,10 -seltimestep,1 -seq,1,10 -addc,1 -seq,1,10"
+      cdo.fldmean(input=ifile, output=ofile)
+      cdo.fldmean(input=ifile, output=cfile, checkpoints='auto', keepCheckpoints=True)
+      self.assertEqual([], cdo.diffv(input=' '.join([ofile, cfile]), options='-s'))
+
+      # a rerun resumes from the saved results
+      checkpoints = glob.glob(os.path.join(cdo.tempStore.dir, cdo.tempStore.fileTag + '_checkpoint_*'))
+      self.assertTrue(len(checkpoints) >= 3)
+      mtimes = [os.stat(f).st_mtime for f in checkpoints]
+      cdo.fldmean(input=ifile, output=cfile, checkpoints='auto', keepCheckpoints=True)
+      self.assertEqual(mtimes, [os.stat(f).st_mtime for f in checkpoints])
+      cdo.fldmean(input=ifile, output=cfile, checkpoints='auto')
+      self.assertFalse(any(os.path.isfile(f) for f in checkpoints))
+
+      # explicit checkpoints
+      cdo.fldmean(input=ifile, output=cfile, checkpoints=['timmean'])
+      self.assertEqual([], cdo.diffv(input=' '.join([ofile, cfile]), options='-s'))
+
+      # linear chains are split into segments, which CDO still pipes
+      short = '-timmean -mulc,2 -seltimestep,2/9 -seq,1,10'
+      linear = '-timmean -addc,1 -mulc,2 -subc,1 -addc,3 -mulc,3 -seltimestep,2/9 -seq,1,10'
+      pattern = os.path.join(cdo.tempStore.dir, cdo.tempStore.fileTag + '_checkpoint_*')
+      cdo.fldmean(input=short, output=cfile, checkpoints='auto', keepCheckpoints=True)
+      self.assertEqual([], glob.glob(pattern))
+      cdo.fldmean(input=linear, output=cfile, checkpoints='auto', keepCheckpoints=True)
+      checkpoints = glob.glob(pattern)
+      self.assertEqual(1, len(checkpoints))
+      self.assertEqual([], cdo.diffv(input='-fldmean %s %s' % (linear, cfile), options='-s'))
+      # checkpoints written with other options are not reused
+      cdo.fldmean(input=linear, output=cfile, checkpoints='auto', keepCheckpoints=True, options='-b F64')
+      self.assertEqual(2, len(glob.glob(pattern)))
+      rm(glob.glob(pattern))
+      rm([ofile, cfile])
+
+    def test_formatPolicy(self):
+      cdo = Cdo(formatPolicy=True)
+      # options by the consumer of the result, user options win
+      self.assertEqual(['-f', 'nc2'], cdo.fldmean()._buildCmd({'returnArray': 'topo'})[3:5])
+      self.assertEqual(['-f', 'nc2'], cdo.fldmean()._buildCmd({'input': 'ifile'})[3:5])
+      self.assertEqual(['-fldmean'], cdo.fldmean()._buildCmd({'output': 'ofile'})[3:])
+      cmd = cdo.fldmean()._buildCmd({'returnArray': 'topo', 'options': '-f nc4', 'formatPolicy': {'compression': 'zip_1'}})
+      self.assertEqual(['-z', 'zip_1', '-f', 'nc4'], cmd[3:7])
+      self.assertEqual(['-f nc'], Cdo().fldmean()._buildCmd({'returnArray': 'topo'})[3:4])
+      if not cdo.hasNetcdf:
+        print("no tests run for test_formatPolicy")
+        return
+
+      # benchmark: compressed input, intermediate results in different formats
+      ifile = cdo.duplicate(20, input='-topo,r720x360', options='-f nc4 -z zip_6')
+      reference = Cdo().fldmean(input=Cdo().mulc(2, input=ifile), returnArray='topo')
+      for choice in [None, {'format': 'nc4', 'compression': 'zip_1'}, {'format': 'nc2'}, {'format': 'nc2', 'precision': 'F32'}]:
+        start = time.time()
+        for i in range(5):
+          policy = choice and {'format': choice['format']} or False
+          values = cdo.fldmean(input=cdo.mulc(2, input=ifile, formatPolicy=choice or False),
+                               returnArray='topo', formatPolicy=policy)
+        print('%-45s %.3fs'%(choice, (time.time() - start)/5))
+        self.assertTrue(np.allclose(reference, values))
+
+    def test_partialReads(self):
+      cdo = Cdo()
+      if not cdo.hasNetcdf:
+        print("no tests run for test_partialReads")
+        return
+      ifile = cdo.topo('r36x18', options='-f nc')
+      full = cdo.readArray(ifile, 'topo')
+      # index expressions are applied in the netCDF read
+      self.assertEqual((2, 3), cdo.readArray(ifile, 'topo', np.s_[0:2, 0:3]).shape)
+      self.assertTrue(np.array_equal(full[4, :], cdo.readArray(ifile, ('topo', np.s_[4, :]))))
+      # labels of existing files are mapped on the coordinates
+      bbox = {'bbox': (0, 90, 0, 90)}
+      inRead = cdo.readArray(ifile, 'topo', bbox)
+      self.assertEqual((9, 9), inRead.shape)
+      # labels of chains become sel* operators
+      byCdo = cdo.topo('r36x18', returnArray=('topo', bbox))
+      self.assertTrue(np.array_equal(inRead, byCdo))
+      masked = cdo.topo('r36x18', returnMaArray=('topo', np.s_[0:2]))
+      self.assertEqual((2, 36), masked.shape)
+      with self.assertRaises(ValueError):
+        cdo.readArray(ifile, 'topo', {'region': 'europe'})
+      # only (varname, selection) tuples, several names are given as a list
+      for varname in [('topo', 'topo'), ('topo', 'a', 'b'), (0, np.s_[0])]:
+        with self.assertRaises(ValueError):
+          cdo.readArray(ifile, varname)
+      # only unknown variables are reported as missing
+      with self.assertRaises(LookupError):
+        cdo.readArray(ifile, 'no_such_var')
+      with self.assertRaises((IndexError, ValueError)):
+        cdo.readArray(ifile, 'topo', np.s_[0, 0, 0, 0])
+
+    def test_returnManyVariables(self):
+      cdo = Cdo()
+      if not cdo.hasNetcdf:
+        print("no tests run for test_returnManyVariables")
+        return
+      ifile = '-setname,a -topo,r36x18 -setname,b -mulc,2 -topo,r36x18'
+      arrays = cdo.merge(input=ifile, returnArray=['a', 'b'])
+      self.assertEqual(['a', 'b'], sorted(arrays.keys()))
+      self.assertTrue(np.array_equal(2*arrays['a'], arrays['b']))
+      masked = cdo.merge(input=ifile, returnMaArray=(['a', 'b'], np.s_[0:2]))
+      self.assertEqual((2, 36), masked['b'].shape)
+      if cdo.hasXarray:
+        dataArrays = cdo.merge(input=ifile, returnXArray=['a', 'b'])
+        self.assertTrue(np.array_equal(arrays['b'], dataArrays['b'].values))
+      with self.assertRaises(LookupError):
+        cdo.merge(input=ifile, returnArray=['a', 'c'])
+
+    def test_memoizedReads(self):
+      cdo = Cdo()
+      if not cdo.hasNetcdf:
+        print("no tests run for test_memoizedReads")
+        return
+      chain = cdo.mulc(2).topo('r36x18').add_option('-f nc')
+      values = chain.readArray(varname='topo')
+      ofile = chain.readCdf().filepath()
+      mtime = os.stat(ofile).st_mtime
+      time.sleep(1)
+      # all reads of the chain use the same output
+      self.assertTrue(np.array_equal(values, chain.readMaArray(varname='topo')))
+      self.assertEqual(ofile, chain.readCdf().filepath())
+      self.assertEqual(mtime, os.stat(ofile).st_mtime)
+      # other chains run on their own
+      self.assertNotEqual(ofile, cdo.mulc(3).topo('r36x18').add_option('-f nc').readCdf().filepath())
+      chain.invalidate()
+      self.assertFalse(os.path.isfile(ofile))
+      ofile = chain.readCdf().filepath()
+      self.assertTrue(os.path.isfile(ofile))
+      # the output lives as long as the chain
+      del chain
+      import gc; gc.collect()
+      self.assertFalse(os.path.isfile(ofile))
+
+    def test_catalog(self):
+      from cdo.__main__ import main
+      from cdo.catalog import loadCatalog
+      import json
+      path = tempfile.mktemp(suffix='.json')
+      self.assertEqual(0, main(['catalog', 'build', '--output', path, '--no-docs']))
+
+      cdo, fromCatalog = Cdo(catalog=False), Cdo(catalog=path)
+      self.assertTrue(fromCatalog._catalog is not None)
+      self.assertEqual(cdo.operators, fromCatalog.operators)
+      self.assertEqual(cdo.operatorInputs, fromCatalog.operatorInputs)
+      self.assertEqual(cdo.noOutputOperators, fromCatalog.noOutputOperators)
+      self.assertEqual(cdo.version(), fromCatalog.version())
+
+      # docs are read from the catalog: no CDO process is started
+      from cdo.cdo import operator_doc
+      from unittest import mock
+      doc = operator_doc('fldmean', cdo.CDO)
+      with open(path) as f:
+        catalog = json.load(f)
+      catalog['operators']['fldmean'][3] = doc
+      with open(path, 'w') as f:
+        json.dump(catalog, f)
+      with mock.patch('subprocess.Popen', side_effect=subprocess.Popen) as popen:
+        fromCatalog = Cdo(catalog=path)
+        self.assertEqual(doc, fromCatalog._operatorDoc('fldmean'))
+        self.assertEqual(cdo.operators, fromCatalog.operators)
+      self.assertEqual(0, popen.call_count)
+
+      # catalogs of other binaries are ignored
+      with open(path) as f:
+        catalog = json.load(f)
+      catalog['binary']['size'] += 1
+      with open(path, 'w') as f:
+        json.dump(catalog, f)
+      self.assertEqual(None, loadCatalog(cdo.CDO, path))
+      self.assertEqual(None, Cdo(catalog=path)._catalog)
+      rm([path])
+
+    def test_inputStager(self):
+      import shutil
+      from cdo import InputStager
+      # a throttled copy stands in for the slow filesystem
+      slowDir, copies = tempfile.mkdtemp(), []
+      def slowCopy(src, dst):
+        time.sleep(0.2)
+        copies.append(src)
+        shutil.copyfile(src, dst)
+
+      cdo = Cdo()
+      if not cdo.hasNetcdf:
+        print("no tests run for test_inputStager")
+        return
+      ifiles = [cdo.topo('r%dx18'%(36 + i), output=os.path.join(slowDir, 'in%d.grb'%i)) for i in range(4)]
+      size = os.stat(ifiles[-1]).st_size
+      stager = InputStager(budget=3*size, prefetch=2, link=False, copy=slowCopy, prefixes=[slowDir])
+      staged = Cdo(stager=stager)
+
+      start = time.time()
+      results = stager.map(staged.fldmean, ifiles, returnArray='topo')
+      print('staged with prefetch: %.2fs'%(time.time() - start))
+      self.assertEqual(sorted(ifiles), sorted(copies))
+      self.assertTrue(stager.size() <= 3*size)
+      for ifile, result in zip(ifiles, results):
+        self.assertTrue(np.array_equal(cdo.fldmean(input=ifile, returnArray='topo'), result))
+
+      # cached files are not copied again
+      staged.fldmean(input=ifiles[-1])
+      self.assertEqual(4, len(copies))
+      stager.clear()
+
+      # the CDO binary is not an input, even if every path is staged
+      binary = shutil.which(cdo.CDO) or cdo.CDO
+      everything = InputStager(link=False)
+      cmd = [binary, '-O', '-fldmean', ifiles[0]]
+      with everything.staged(cmd) as stagedCmd:
+        self.assertEqual(binary, stagedCmd[0])
+        self.assertNotEqual(ifiles[0], stagedCmd[-1])
+      everything.clear()
+
+      # copies which are done before their callback is registered, like
+      # hard links of small files, do not deadlock
+      import concurrent.futures
+      class InlineExecutor(concurrent.futures.Executor):
+        def submit(self, fn, *args):
+          future = concurrent.futures.Future()
+          future.set_result(fn(*args))
+          return future
+      linked = InputStager(link=True, prefixes=[slowDir])
+      linked._pool = InlineExecutor()
+      local = linked.acquire(ifiles[0])
+      self.assertNotEqual(ifiles[0], local)
+      self.assertTrue(os.path.isfile(local))
+      linked.release(local)
+      linked.clear()
+      shutil.rmtree(slowDir)
+
+    def test_writeBehind(self):
+      import shutil
+      from cdo import WriteBehind, DeliveryError
+      finalDir = tempfile.mkdtemp()
+      writeBehind = WriteBehind()
+      cdo = Cdo(writeBehind=writeBehind)
+      ofile = os.path.join(finalDir, 'topo.grb')
+      self.assertEqual(ofile, cdo.topo('r36x18', output=ofile))
+      cdo.flush()
+      self.assertEqual([], writeBehind.pending())
+      self.assertEqual([], cdo.diffv(input=' '.join([ofile, '-topo,r36x18']), options='-s'))
+      self.assertEqual([], os.listdir(writeBehind.scratch))
+
+      # errors are reported by flush()
+      cdo.topo('r36x18', output=os.path.join(finalDir, 'missing', 'topo.grb'))
+      with self.assertRaises(DeliveryError):
+        cdo.flush()
+      cdo.flush()
+
+      # a busy delivery thread keeps the outputs pending: calls which read
+      # them wait, internal outputs are never written behind
+      busy = WriteBehind(workers=1)
+      cdo = Cdo(writeBehind=busy)
+      blocker = busy.scratchFile('blocker')
+      busy.deliver(blocker, os.path.join(finalDir, 'blocker'), after=lambda: time.sleep(1))
+      cdo.topo('r36x18', output=ofile)
+      self.assertEqual([os.path.join(finalDir, 'blocker'), ofile], busy.pending())
+      mean = cdo.fldmean(input='-timmean ' + ofile, output=os.path.join(finalDir, 'mean.grb'),
+                         checkpoints=['timmean'])
+      cdo.flush()
+      self.assertEqual([], cdo.diffv(input=[mean, '-fldmean -topo,r36x18'], options='-s'))
+      # relative and absolute names of a pending output are the same file
+      relative = os.path.relpath(os.path.join(finalDir, 'relative'))
+      busy.deliver(busy.scratchFile('relative'), relative, after=lambda: time.sleep(1))
+      busy.waitFor(['cdo', '-fldmean', os.path.abspath(relative)])
+      self.assertEqual([], busy.pending())
+      self.assertTrue(os.path.isfile(relative))
+      rm([ofile])
+      shutil.rmtree(finalDir)
+
+    def test_executor(self):
+      import concurrent.futures
+      cdo = Cdo()
+      with concurrent.futures.ThreadPoolExecutor(2) as threads, \
+           concurrent.futures.ProcessPoolExecutor(2) as processes:
+        for executor in [threads, processes]:
+          future = cdo.fldmean(input='-topo,r36x18', executor=executor)
+          self.assertTrue(isinstance(future, concurrent.futures.Future))
+          ofile = future.result()
+          self.assertTrue(os.path.isfile(ofile))
+          self.assertEqual(cdo.sinfov(input='-fldmean -topo,r36x18')[1:],
+                           cdo.sinfov(input=ofile, executor=executor).result()[1:])
+          if cdo.hasNetcdf:
+            self.assertTrue(np.array_equal(cdo.fldmean(input='-topo,r36x18', returnArray='topo'),
+                                           cdo.fldmean(input='-topo,r36x18', returnArray='topo',
+                                                       executor=executor).result()))
+          # errors are raised by the future
+          with self.assertRaises(CDOException):
+            cdo.fldmean(input='no_such_file.grb', executor=executor).result()
+
+      # running calls are stopped by future.cancel() and cdo.cancel()
+      import threading
+      tempPath = tempfile.mkdtemp()
+      fifo     = os.path.join(tempPath, 'hanging_input')
+      os.mkfifo(fifo)
+      with concurrent.futures.ThreadPoolExecutor(1) as threads, \
+           concurrent.futures.ProcessPoolExecutor(1) as processes:
+        for executor in [threads, processes]:
+          future = cdo.copy(input=fifo, executor=executor)
+          time.sleep(1)
+          self.assertTrue(future.cancel())
+          self.assertTrue(future.cancelled())
+          with self.assertRaises(concurrent.futures.CancelledError):
+            future.result(timeout=10)
+          threading.Timer(1.0, cdo.cancel).start()
+          with self.assertRaises(CDOException):
+            cdo.copy(input=fifo, executor=executor).result(timeout=10)
+      # cancel files are removed once the commands have ended
+      time.sleep(1)
+      self.assertEqual([], glob.glob(os.path.join(cdo.tempStore.dir, cdo.tempStore.fileTag + '_cancel_*')))
+      rm([fifo])
+      os.rmdir(tempPath)
+
+    def test_batchRunner(self):
+      import json
+      import shutil
+      from cdo.__main__ import main
+      tempdir = tempfile.mkdtemp()
+      for i in range(3):
+        Cdo().setname('topo%d' % i, input='-topo,r36x18', output=os.path.join(tempdir, 'in%d.grb' % i))
+      manifest = os.path.join(tempdir, 'jobs.json')
+      with open(manifest, 'w') as f:
+        json.dump({'cores': 2, 'memory': '1G', 'jobs': [
+          {'name': 'means', 'chain': '-fldmean', 'input': os.path.join(tempdir, 'in*.grb'),
+           'output': os.path.join(tempdir, 'out', '{stem}_mean.grb'), 'memory': '600M'},
+          {'chain': '-merge', 'input': [os.path.join(tempdir, 'out', '*_mean.grb')],
+           'output': os.path.join(tempdir, 'merged.grb')},
+          {'chain': '-fldmean', 'input': 'no_such_file.grb',
+           'output': os.path.join(tempdir, 'failed.grb')}]}, f)
+      report = os.path.join(tempdir, 'report.json')
+
+      self.assertEqual(1, main(['run', manifest, '--report', report]))
+      with open(report) as f:
+        jobs = json.load(f)['jobs']
+      self.assertEqual(['ok'] * 4 + ['failed'], [job['status'] for job in jobs])
+      self.assertEqual(3, len(jobs[3]['input']))
+      self.assertEqual(3, len(Cdo().showname(input=os.path.join(tempdir, 'merged.grb'))[0].split()))
+      # up to date outputs are skipped
+      main(['run', manifest, '--report', report])
+      with open(report) as f:
+        self.assertEqual(['skipped'] * 4 + ['failed'], [job['status'] for job in json.load(f)['jobs']])
+
+      # chain tokens stay raw, the given Cdo object is not changed
+      from cdo.batch import BatchRunner
+      cdo = Cdo()
+      runner = BatchRunner({'jobs': [{}]}, cdo=cdo, cores=2, memory='1G', progress=None)
+      self.assertEqual(None, cdo.memoryBudget)
+      chain = runner.chainOf({'name': 'expr', 'chain': "-expr,'topo=topo*2;' -topo,r36x18"})
+      self.assertEqual('expr', chain._operatorName())
+      self.assertTrue(np.array_equal(2 * cdo.fldmean(input='-topo,r36x18', returnArray='topo'),
+                                     cdo.fldmean(input=chain(returnResult=False), returnArray='topo')))
+      shutil.rmtree(tempdir)
+
+    def test_memoryBudget(self):
+      from cdo import MemoryBudget
+      cdo = Cdo(memoryBudget='1G')
+      self.assertTrue(isinstance(cdo.memoryBudget, MemoryBudget))
+      self.assertEqual(2**30, cdo.memoryBudget.limit)
+      ifile = cdo.topo('r36x18', options='-f nc')
+      shape = cdo.memoryEstimator.metadata(ifile)
+      self.assertEqual((648, 1, 1, 1), (shape['gridsize'], shape['nlevel'], shape['nvar'], shape['ntime']))
+
+      # finer grids need more memory
+      coarse = cdo.memoryEstimator.estimate(['cdo', '-remapbil,r72x36', ifile])
+      fine = cdo.memoryEstimator.estimate(['cdo', '-remapbil,r720x360', ifile])
+      self.assertTrue(coarse['memory'] < fine['memory'])
+      self.assertEqual(720 * 360 * shape['bytes'], fine['output'])
+      self.assertEqual(10 * shape['gridsize'] * shape['bytes'],
+                       cdo.memoryEstimator.estimate(['cdo', '-mergetime'] + [ifile] * 10)['output'])
+
+      # estimates are refined with the measured peak memory
+      cdo.remapbil('r72x36', input=ifile)
+      self.assertTrue(('remapbil',) in cdo.memoryEstimator.ratios())
+      self.assertEqual(0, cdo.memoryBudget.used())
+      # given memory is reserved instead of the estimate
+      self.assertTrue(os.path.isfile(cdo.fldmean(input=ifile, memory='2G')))
+
+    def test_explain(self):
+      cdo = Cdo()
+      ofile = os.path.join(tempfile.mkdtemp(), 'remapped.nc')
+      plan = cdo.remapbil.explain('r72x36', input='-fldmean -topo,r36x18', output=ofile)
+      # nothing runs
+      self.assertFalse(os.path.isfile(ofile))
+      self.assertEqual([cdo.CDO, '-O', '-s', '-remapbil,r72x36', '-fldmean', '-topo,r36x18', ofile],
+                       plan['argv'])
+      self.assertEqual([('remapbil', 1, 1), ('fldmean', 1, 1), ('topo', 0, 1)],
+                       [(op['operator'], op['inputs'], op['outputs']) for op in plan['operators']])
+      self.assertEqual([], plan['tempFiles'])
+      self.assertEqual(['-topo,r36x18', '-fldmean', '-remapbil,r72x36'],
+                       [stage['operator'] for stage in plan['stages']])
+      self.assertEqual(72 * 36 * 4, plan['output'])
+      self.assertTrue('command: ' in str(plan))
+
+      # temporary outputs, run times from earlier calls under a memory budget
+      cdo = Cdo(memoryBudget='1G')
+      self.assertEqual(None, cdo.fldmean.explain(input='-topo,r36x18')['runtime'])
+      cdo.fldmean(input='-topo,r36x18')
+      plan = cdo.fldmean.explain(input='-topo,r36x18')
+      self.assertEqual(1, len(plan['tempFiles']))
+      self.assertTrue(plan['runtime'] is not None)
+
+    def test_numpyEngine(self):
+      cdo = Cdo()
+      if not cdo.hasXarray:
+        return
+      import xarray
+      lat, lon = np.linspace(-85, 85, 18), np.arange(0, 360, 10.0)
+      values = np.random.rand(4, 18, 36).astype('f4')
+      values[0, :3, :5] = np.nan
+      ds = xarray.Dataset({'tas': (('time', 'lat', 'lon'), values),
+                           'pr': (('time', 'lat', 'lon'), 2 * values)},
+                          coords={'time': ('time', np.arange(4), {'units': 'days since 2000-01-01'}),
+                                  'lat': ('lat', lat, {'units': 'degrees_north'}),
+                                  'lon': ('lon', lon, {'units': 'degrees_east'})})
+      # results of numpy and CDO agree, fldmean is area weighted
+      for chain, args in [(cdo.fldmean, ()), (cdo.timmean, ()), (cdo.mulc, (3,)),
+                          (cdo.addc, (-1.5,)), (cdo.selname, ('tas',)),
+                          (cdo.fldmean.addc, (1,)), (cdo.fldmean.timmean.selname, ('pr',))]:
+        expected = chain(*args, input=ds, returnArray='tas' if 'pr' not in args else 'pr')
+        result = chain(*args, input=ds, returnArray='tas' if 'pr' not in args else 'pr', engine='numpy')
+        self.assertEqual(np.shape(expected), np.shape(result))
+        np.testing.assert_allclose(np.ma.filled(np.ma.masked_invalid(expected), np.nan), result, rtol=1e-5)
+      self.assertTrue(isinstance(cdo.fldmean(input=ds, returnXDataset=True, engine='numpy'), xarray.Dataset))
+      self.assertTrue(os.path.isfile(cdo.timmean(input=ds, engine='numpy')))
+      # results and existing outputs like with CDO
+      from cdo.result import CdoResult
+      self.assertTrue(isinstance(cdo.timmean(input=ds, engine='numpy', returnResult=True), CdoResult))
+      ofile = cdo.tempStore.newFile()
+      open(ofile, 'w').close()
+      self.assertEqual(ofile, cdo.timmean(input=ds, output=ofile, engine='numpy', force=False))
+      self.assertEqual(0, os.path.getsize(ofile))
+
+      # unsupported operators run with CDO
+      np.testing.assert_allclose(cdo.zonmean(input=ds, returnArray='pr'),
+                                 cdo.zonmean(input=ds, returnArray='pr', engine='numpy'))
+
+    def test_cdoResult(self):
+      import gc
+      from cdo.result import CdoResult
+      cdo = Cdo()
+      # file names stay the default
+      self.assertTrue(isinstance(cdo.topo('r36x18', options='-f nc'), str))
+      result = cdo.topo('r36x18', options='-f nc', returnResult=True)
+      self.assertTrue(isinstance(result, CdoResult))
+      self.assertTrue(os.path.isfile(result))
+      self.assertTrue('-topo,r36x18' in result.cmd)
+      self.assertEqual(648, result.metadata()['gridsize'])
+      if cdo.hasNetcdf:
+        self.assertEqual((18, 36), result.array('topo').shape)
+      if cdo.hasXarray:
+        self.assertTrue('topo' in result.xarray())
+      # results are inputs of other calls
+      self.assertEqual(cdo.fldmean(input='-topo,r36x18', returnArray='topo'),
+                       cdo.fldmean(input=result, returnArray='topo'))
+      # temporary files live as long as their result
+      path = result.path
+      del result
+      gc.collect()
+      self.assertFalse(os.path.isfile(path))
+
+      # lazy results become part of the next chain
+      lazy = cdo.mulc(2, input='-topo,r36x18', returnResult='lazy')
+      mean = cdo.fldmean(input=lazy, returnResult=True, options='-f nc')
+      self.assertFalse(lazy.computed)
+      self.assertTrue('-mulc,2' in mean.cmd)
+      self.assertEqual(2 * cdo.fldmean(input='-topo,r36x18', returnArray='topo'), mean.array('topo'))
+      self.assertTrue(os.path.isfile(lazy))
+      self.assertTrue(lazy.computed)
+
+      # internal calls of parallel modes always run and return paths
+      lazyCdo = Cdo(returnResults='lazy')
+      # arrays and calls with several outputs are never lazy
+      self.assertEqual(cdo.fldmean(input='-topo,r36x18', returnArray='topo'),
+                       lazyCdo.fldmean(input='-topo,r36x18', returnArray='topo'))
+      self.assertTrue(all(r.computed for r in lazyCdo.trend(input='-topo,r36x18')))
+      varname = 'seq' if cdoShouldHaveSeqOperator(cdo) else 'for'
+      ifile = cdo.enlarge('r36x18',
+                          input='-settaxis,2001-01-01,12:00:00,1day -%s,1,4'%(varname),
+                          options='-f nc')
+      for kwargs in [{'timeChunks': 2}, {'tiles': 2}]:
+        result = lazyCdo.mulc(2, input=ifile, **kwargs)
+        self.assertTrue(isinstance(result, CdoResult))
+        self.assertEqual([], cdo.diffv(input=[cdo.mulc(2, input=ifile), result], options='-s'))
+
+    def test_streamSplit(self):
+      cdo = Cdo()
+      varname = 'seq' if cdoShouldHaveSeqOperator(cdo) else 'for'
+      tempdir = tempfile.mkdtemp()
+      # unrelated files with the same prefix are not picked up
+      other = os.path.join(tempdir, 'sel_other.grb')
+      open(other, 'w').close()
+      for mode in [True, 'poll']:
+        prefix = os.path.join(tempdir, 'sel_')
+        files = list(cdo.splitsel(1, input='-%s,0,9' % varname, output=prefix, stream=mode))
+        self.assertEqual(sorted(files), sorted(set(files)))
+        self.assertEqual(10, len(files))
+        self.assertFalse(other in files)
+        self.assertTrue(all(os.path.isfile(f) and f.startswith(prefix) for f in files))
+        rm(files)
+      # closing the iterator early keeps all outputs
+      outputs = cdo.splitname(input='-stdatm,0', output=os.path.join(tempdir, 'var_'), stream=True)
+      first = next(outputs)
+      outputs.close()
+      self.assertTrue(os.path.isfile(first))
+      self.assertTrue(2 <= len([f for f in os.listdir(tempdir) if f.startswith('var_')]))
+      # streams which are never iterated still deliver their outputs
+      cdo.splitname(input='-stdatm,0', output=os.path.join(tempdir, 'unused_'), stream=True)
+      for i in range(100):
+        if not [f for f in os.listdir(tempdir) if f.startswith('.')]:
+          break
+        time.sleep(0.1)
+      self.assertTrue(2 <= len([f for f in os.listdir(tempdir) if f.startswith('unused_')]))
+      # only the private output directory is removed
+      self.assertEqual(sorted(f for f in os.listdir(tempdir) if not f.startswith('.')),
+                       sorted(os.listdir(tempdir)))
+      with self.assertRaises(ValueError):
+        cdo.fldmean(input='-topo', output='x', stream=True)
+      rm([os.path.join(tempdir, f) for f in os.listdir(tempdir)])
+      os.rmdir(tempdir)
+
+    def test_iterTimesteps(self):
+      cdo = Cdo()
+      if not cdo.hasXarray:
+        return
+      import xarray
+      values = np.random.rand(50, 18, 36).astype('f4')
+      ds = xarray.Dataset({'tas': (('time', 'lat', 'lon'), values)},
+                          coords={'time': ('time', np.arange(50), {'units': 'days since 2000-01-01'})})
+      ifile = cdo.tempStore.newFile()
+      ds.to_netcdf(ifile, format='NETCDF4')
+
+      # plain files, batches of k timesteps
+      batches = list(cdo.iterTimesteps(ifile, 'tas', batch=16))
+      self.assertEqual([16, 16, 16, 2], [b.shape[0] for b in batches])
+      np.testing.assert_allclose(values, np.concatenate(batches))
+      # chains are written to netCDF3 and memory mapped
+      batches = list(cdo.iter_timesteps('-mulc,2 %s' % ifile, 'tas', batch=7))
+      self.assertEqual(50, sum(b.shape[0] for b in batches))
+      np.testing.assert_allclose(2 * values, np.concatenate(batches), rtol=1e-6)
+      batches = list(cdo.iterTimesteps(cdo.addc(1, input=ifile, returnResult=True), 'tas'))
+      self.assertEqual(50, len(batches))
+      # stopping early
+      timesteps = cdo.iterTimesteps(ifile, 'tas', batch=5, readAhead=1)
+      self.assertEqual((5, 18, 36), next(timesteps).shape)
+      timesteps.close()
+      with self.assertRaises(LookupError):
+        next(cdo.iterTimesteps(ifile, 'no_such_var'))
+
+      # packed netCDF3 variables are unpacked, scalars are one batch
+      packed = xarray.Dataset({'tas': (('time', 'lat', 'lon'), 250 + 50 * values),
+                               'scale': ((), np.float32(5))})
+      packedFile = cdo.tempStore.newFile()
+      packed.to_netcdf(packedFile, format='NETCDF3_CLASSIC',
+                       encoding={'tas': {'dtype': 'i2', 'scale_factor': 0.01, 'add_offset': 250,
+                                                 '_FillValue': -32767}})
+      np.testing.assert_allclose(250 + 50 * values, np.concatenate(list(cdo.iterTimesteps(packedFile, 'tas'))),
+                                 atol=0.01)
+      self.assertEqual([5], [float(b) for b in cdo.iterTimesteps(packedFile, 'scale')])
+
+    def test_treeReduction(self):
+      cdo = Cdo()
+      if not cdo.hasNetcdf:
+        return
+      # members with missing values over the ocean
+      members = [cdo.mulc(i, input='-setrtomiss,-20000,0 -topo,r36x18' if i % 2 else '-topo,r36x18',
+                          options='-f nc') for i in range(1, 12)]
+      for op in ['ensmean', 'enssum', 'ensmax']:
+        expected = getattr(cdo, op)(input=members, returnMaArray='topo')
+        reduced  = getattr(cdo, op)(input=members, returnMaArray='topo', treeReduce=3)
+        np.testing.assert_allclose(expected.filled(np.nan), reduced.filled(np.nan), rtol=1e-5)
+
+      days = [cdo.settaxis('2001-01-%02d,12:00:00,1day' % (i + 1), input='-topo,r36x18', options='-f nc')
+              for i in range(10)]
+      merged = cdo.mergetime(input=days, treeReduce=4)
+      self.assertEqual(['10'], cdo.ntime(input=merged))
+      self.assertEqual('2001-01-01T12:00:00', cdo.showtimestamp(input=merged)[0].split()[0])
+
+      # the inputs of ensstd cannot be combined
+      with self.assertRaises(ValueError):
+        cdo.ensstd(input=members, treeReduce=3)
+      # without treeReduce, only input lists too long for a command line are reduced
+      from cdo.parallel import exceedsCommandLine, commandLimit
+      self.assertFalse(exceedsCommandLine(members))
+      self.assertTrue(exceedsCommandLine(['x' * 1024] * (commandLimit() // 1024 + 1)))
+
+    def test_timeIndex(self):
+      cdo = Cdo()
+      if not cdo.hasNetcdf:
+        return
+      varname = 'seq' if cdoShouldHaveSeqOperator(cdo) else 'for'
+      ifile = cdo.settaxis('2001-01-01,12:00:00,1day', input='-%s,1,100' % varname, options='-f nc')
+      index = cdo.timeIndex(ifile)
+      self.assertEqual(100, len(index))
+      self.assertEqual(np.datetime64('2001-01-01T12:00:00'), index.values[0])
+      # cached per file
+      self.assertIs(index, cdo.time_index(ifile))
+      self.assertEqual('-seltimestep,10/19', index.seltimestep('2001-01-10', '2001-01-19'))
+      self.assertEqual(['10'], cdo.ntime(input='%s %s' % (index.seltimestep('2001-01-10', '2001-01-19'), ifile)))
+      with self.assertRaises(ValueError):
+        index.seltimestep('1990-01-01', '1990-12-31')
+      # out-of-range time selections fail the same way in the netCDF read and with CDO
+      from cdo.selection import selOperators
+      outOfRange = {'time': ('1990-01-01', '1990-12-31')}
+      with self.assertRaises(ValueError):
+        cdo.readArray(ifile, varname, outOfRange)
+      with self.assertRaises(ValueError):
+        selOperators(outOfRange, index)
+
+      # dates of non-standard calendars are compared as strings
+      ifile = cdo.settaxis('2001-01-01,12:00:00,1day',
+                           input='-setcalendar,360_day -%s,1,100' % varname, options='-f nc')
+      index = cdo.timeIndex(ifile)
+      self.assertEqual('360_day', index.calendar)
+      self.assertEqual('2001-02-30T12:00:00', index.labels[59])
+      self.assertTrue(np.isnat(index.values[59]))
+      self.assertEqual('-seltimestep,59/61', index.seltimestep('2001-02-29', '2001-03-01'))
+
     if MAINTAINERMODE:
 
       def test_config(self):